@@ -1 +1,13 @@
-arduino = {"port": "COM3", "baud": 38400, "timeout": 2}
+# timeout: seconds a write to the board may block for
+# reply_deadline_ticks: how long to wait for the board's command each tick, after which the fallback controller flies
+# it. It is in ticks of the rate the telemetry says the simulation runs at, so 1 is 1/60s at the default rate.
+# At 38400 baud a telemetry frame alone takes ~13ms to send, so replies usually arrive pipelined a tick late.
+# check: frame check to ask the board for at connect, "xor" (what the autopilot-uno firmware speaks) or "crc16".
+# A board that doesn't answer the request within timeout stays on xor.
+arduino = {"port": "COM3", "baud": 38400, "timeout": 2, "reply_deadline_ticks": 1, "check": "xor"}
+
+# The in-memory cable to the simulated board used by the UNO_SIM pilot (see src/pilots/fake_arduino.py).
+# latency_sec, jitter_sec: delay added to every write, the jitter drawn uniformly up to the given amount
+# corruption_rate: chance of each byte getting a bit flipped
+# baud: line rate to limit the cable to, or None for no limit (38400 models the real board)
+arduino_sim = {"latency_sec": 0.001, "jitter_sec": 0.0005, "corruption_rate": 0.0, "baud": None}
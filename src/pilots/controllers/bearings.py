@@ -0,0 +1,155 @@
+"""Geometry of the lidar's fixed bearings, shared by the controller components.
+
+Lidar samples are indexed the way the controllers read them, with the
+telemetry scan reversed: with the default lidar, sample 0 looks 15
+degrees to the left and sample 30 looks 15 degrees to the right. Every
+per-bearing value is computed once per lidar, with the same math calls the
+controllers used to make, so the table lookups give exactly the same
+numbers.
+
+Other lidars (see the versioned telemetry header in zip_sim) get their
+own LidarBearings from lidar_bearings(). The module level names are the
+default lidar's.
+"""
+from __future__ import annotations
+from math import cos, sin, atan, radians, degrees
+
+import numpy as np
+
+
+class LidarBearings:
+    """The bearings of a lidar with sample_count samples step_deg apart, centred straight ahead.
+
+    Bearings are in degrees, and are ints when the step is a whole number
+    of degrees, so they can be compared and looked up exactly.
+    """
+
+    __slots__ = [
+        "sample_count",
+        "step_deg",
+        "step_rad",
+        "min_angle",
+        "max_angle",
+        "angles",
+        "cos",
+        "sin",
+        "gains",
+        "unit_vectors",
+        "_index",
+    ]
+
+    def __init__(self, sample_count=31, step_deg=1.0):
+        self.sample_count = sample_count
+        self.step_deg = step_deg
+        self.step_rad = radians(step_deg)
+        self.max_angle = (sample_count - 1) / 2 * step_deg
+        self.min_angle = -self.max_angle
+        # Bearing of each lidar sample in degrees, sample 0 being the leftmost.
+        if float(step_deg).is_integer():
+            self.angles = tuple(
+                int(self.max_angle) - idx * int(step_deg) for idx in range(sample_count)
+            )
+        else:
+            self.angles = tuple(self.max_angle - idx * step_deg for idx in range(sample_count))
+        self.cos = tuple(cos(radians(theta)) for theta in self.angles)
+        self.sin = tuple(sin(radians(theta)) for theta in self.angles)
+        self.gains = tuple(atan(radians(theta)) for theta in self.angles)
+        # (2, sample_count) unit vectors of the bearings, to turn a whole scan into points at once.
+        self.unit_vectors = np.array([self.cos, self.sin])
+        self._index = {theta: idx for idx, theta in enumerate(self.angles)}
+
+    def bearing_index(self, theta):
+        """Returns the sample index looking along theta degrees, or None if no sample does."""
+        return self._index.get(theta)
+
+    def unit_vector(self, theta):
+        idx = self._index.get(theta)
+        if idx is None:
+            rad = radians(theta)
+            return (cos(rad), sin(rad))
+        return (self.cos[idx], self.sin[idx])
+
+    def polar_to_xy(self, distance, theta):
+        (c, s) = self.unit_vector(theta)
+        return (distance * c, distance * s)
+
+    def nearest_sample_index(self, x, y):
+        """Returns the index of the sample closest to looking at a point, or None if it is outside the scan."""
+        if x <= 0:
+            return None
+        idx = round((self.max_angle - xy_to_bearing(x, y)) / self.step_deg)
+        if not 0 <= idx < self.sample_count:
+            return None
+        return idx
+
+    def bearing_gain(self, theta):
+        """Returns the lateral to forward speed ratio the controllers steer with for theta degrees.
+
+        This is atan of the bearing in radians rather than its tangent. The
+        difference is small over the lidar's field of view, and the autopilot
+        has always been tuned with it.
+        """
+        idx = self._index.get(theta)
+        if idx is None:
+            return atan(radians(theta))
+        return self.gains[idx]
+
+    def scan_points(self, samples):
+        """Converts a scan to Cartesian points in the vehicle frame, returned as lists of x and y."""
+        points = np.asarray(samples, dtype=float) * self.unit_vectors
+        return (points[0].tolist(), points[1].tolist())
+
+
+# (sample count, step) -> LidarBearings, so every controller flying one lidar shares the same tables
+_bearings = {}
+
+
+def lidar_bearings(sample_count, step_deg):
+    """Returns the LidarBearings of a lidar, building its tables the first time it is asked for."""
+    bearings = _bearings.get((sample_count, step_deg))
+    if bearings is None:
+        bearings = _bearings[(sample_count, step_deg)] = LidarBearings(sample_count, step_deg)
+    return bearings
+
+
+def xy_to_bearing(x, y):
+    """Returns the bearing in degrees of a point ahead of the vehicle."""
+    return degrees(atan(y / x))
+
+
+DEFAULT_BEARINGS = lidar_bearings(31, 1.0)
+
+LIDAR_SAMPLE_COUNT = DEFAULT_BEARINGS.sample_count
+
+MIN_LIDAR_ANGLE = DEFAULT_BEARINGS.min_angle
+
+MAX_LIDAR_ANGLE = DEFAULT_BEARINGS.max_angle
+
+LIDAR_STEP_RAD = DEFAULT_BEARINGS.step_rad
+
+LIDAR_ANGLES = DEFAULT_BEARINGS.angles
+
+LIDAR_COS = DEFAULT_BEARINGS.cos
+
+LIDAR_SIN = DEFAULT_BEARINGS.sin
+
+LIDAR_GAINS = DEFAULT_BEARINGS.gains
+
+LIDAR_UNIT_VECTORS = DEFAULT_BEARINGS.unit_vectors
+
+
+# ------=Bearing Helpers-------------------------------------------------
+# ------------------------------------------------------------------------------
+# ------------------------------------------------------------------------------
+# The default lidar's methods, for code that only ever flies it
+bearing_index = DEFAULT_BEARINGS.bearing_index
+
+unit_vector = DEFAULT_BEARINGS.unit_vector
+
+polar_to_xy = DEFAULT_BEARINGS.polar_to_xy
+
+nearest_sample_index = DEFAULT_BEARINGS.nearest_sample_index
+
+bearing_gain = DEFAULT_BEARINGS.bearing_gain
+
+scan_points = DEFAULT_BEARINGS.scan_points
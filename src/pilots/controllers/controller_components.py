@@ -2,12 +2,16 @@ from __future__ import annotations
 from enum import IntFlag
 
 # for autopilot calcs
-from operator import itemgetter
-from math import sqrt, cos, sin, tan, atan, radians, degrees
+from bisect import bisect_left, insort
+from math import sqrt
 import struct
 import random
 import numpy as np
-import itertools
+
+from .bearings import (
+    DEFAULT_BEARINGS,
+    xy_to_bearing,
+)
 
 
 AIRSPEED_X = 30.0
@@ -16,10 +20,6 @@ MAX_AIRSPEED = 30.0
 
 MAX_LIDAR_DISTANCE = 255
 
-MIN_LIDAR_ANGLE = -15.0
-
-MAX_LIDAR_ANGLE = 15.0
-
 WORLD_WIDTH = 50.0
 
 WORLD_LENGTH = 2000.0
@@ -32,98 +32,318 @@ MAX_AVOID_ANGLE = 15.0
 
 VEHICLE_AVOID_THRESHOLD = 30
 
+# Range difference between neighbouring samples that separates two objects.
+RANGE_JUMP_THRESHOLD = 6.0
+
+# Number of past lidar scans the Detector takes the median over.
+LIDAR_HISTORY_DEPTH = 5
+
+# 0.5 buffer for average diameter values
+LIDAR_DELIVERY_DIAMETER = 1.5
+
+# Controller tick length used to dead-reckon the vehicle between scans, unless the telemetry says otherwise.
+CONTROL_DT_SEC = 1 / 60.0
+
+# Furthest an observation can be from a track's position and still update it.
+TRACK_GATE_M = 3.0
+
+TRACK_INITIAL_CONFIDENCE = 0.3
+# Fraction of the remaining confidence gained per matching observation.
+TRACK_HIT_GAIN = 0.3
+# Confidence kept when a track in clear view of the lidar is not observed.
+TRACK_MISS_DECAY = 0.7
+
+TRACK_DROP_CONFIDENCE = 0.1
+# Smallest weight a new observation has on a track's position, so dead-reckoning
+# drift keeps getting corrected on long-lived tracks.
+TRACK_MIN_POSITION_GAIN = 0.2
+# Tracks this far behind the vehicle are forgotten.
+TRACK_BEHIND_M = 10.0
+
 
 class PackageFlags(IntFlag):
     DONT_DROP_PACKAGE = 0
     DROP_PACKAGE = 1
 
 
+class ObjectClass(IntFlag):
+    UNKNOWN = 0
+    TREE = 1
+    DELIVERY_SITE = 2
+
+
 # ------=Utility Functions-------------------------------------------------
 # ------------------------------------------------------------------------------
 # ------------------------------------------------------------------------------
-def euclid_values(idx_1, idx_2, data: list):
-    p_1 = data[idx_1]
-    p_2 = data[idx_2]
-    d_1 = p_1
-    d_2 = p_2
+def segment_midpoint(idx_1, idx_2, points):
+    """Returns the chord between two lidar samples and its midpoint, relative to the vehicle.
 
-    theta_1 = (-1) * (idx_1) + 15
-    theta_2 = (-1) * (idx_2) + 15
+    points are the scan's Cartesian points from LidarBearings.scan_points.
+    """
+    (xs, ys) = points
+    x_1 = xs[idx_1]
+    y_1 = ys[idx_1]
 
-    x_1 = d_1 * cos(radians(theta_1))
-    y_1 = d_1 * sin(radians(theta_1))
-
-    x_2 = d_2 * cos(radians(theta_2))
-    y_2 = d_2 * sin(radians(theta_2))
-    d_y = abs(y_1 - y_2)
+    x_2 = xs[idx_2]
+    y_2 = ys[idx_2]
 
     # euclidian distance between points
     d_1_2 = sqrt((x_1 - x_2) ** 2 + (y_1 - y_2) ** 2)
     # get midpoint
     m_x = (x_1 + x_2) / 2
     m_y = (y_1 + y_2) / 2
+    return (d_1_2, m_x, m_y)
+
+
+def euclid_values(idx_1, idx_2, points, bearings=DEFAULT_BEARINGS):
+    (d_1_2, m_x, m_y) = segment_midpoint(idx_1, idx_2, points)
     distance = sqrt(m_x ** 2 + m_y ** 2)
-    theta = degrees(atan(m_y / m_x))
-    return (d_1_2, distance, theta, theta_1, theta_2)
-
-
-def group_adjacent(data):
-    if np.count_nonzero(data) > 0:
-        nonzero = np.nonzero(data)
-        samples = nonzero[0].tolist()
-
-        for _, value in itertools.groupby(
-            enumerate(samples), lambda i_x: i_x[0] - i_x[1]
-        ):
-            consecutive_groups = map(itemgetter(1), value)
-            consecutive_groups = list(consecutive_groups)
-            if len(consecutive_groups) == 1:
-                yield consecutive_groups[0]
-            else:
-                # group even further by distance
-                subgroup = subgrouper(consecutive_groups, data)
-                # subgroup = map(itemgetter(1), subgroup)
-                # subgroup = list(subgroup)
-                yield subgroup
+    theta = xy_to_bearing(m_x, m_y)
+    return (d_1_2, distance, theta, bearings.angles[idx_1], bearings.angles[idx_2])
+
+
+def segment_obstacles(data, leading_only=True):
+    """Splits a lidar scan into obstacle segments.
+
+    Contiguous runs of non-zero samples are cut where the range jumps by
+    more than RANGE_JUMP_THRESHOLD. Segments are returned as
+    (first_idx, last_idx, single) where `single` marks a run made of one
+    sample. By default only the first segment of each run is returned and a
+    jump straight after sample 0 does not split, which is what the nearest
+    object search has always worked from; leading_only=False returns every
+    segment.
+    """
+    samples = np.asarray(data, dtype=float)
+    hit = samples != 0
+    if not hit.any():
+        return []
+    run_start = hit.copy()
+    run_start[1:] &= ~hit[:-1]
+    run_end = hit.copy()
+    run_end[:-1] &= ~hit[1:]
+    # jump[i]: samples i-1 and i both hit and are too far apart to be one object
+    jump = np.zeros_like(hit)
+    jump[1:] = hit[1:] & hit[:-1] & (np.abs(np.diff(samples)) > RANGE_JUMP_THRESHOLD)
+    if leading_only:
+        jump[1] = False
+    segment_end = run_end.copy()
+    segment_end[:-1] |= jump[1:]
+
+    if leading_only:
+        starts = np.flatnonzero(run_start)
+        run_ends = np.flatnonzero(run_end)
+        segment_ends = np.flatnonzero(segment_end)
+        segment_ends = segment_ends[np.searchsorted(segment_ends, starts)]
+        single = starts == run_ends
     else:
-        # if all non-zero, return front angle index
-        return None
-    # return np.split(test_array, np.where(np.diff(test_array) != 1)[0] + 1)
-
-
-def subgrouper(iterable, data):
-    for group in iterable:
-        prev = None
-        group = []
-        for item in iterable:
-            try:
-                val = abs(data[item] - data[prev])
-            except:
-                val = 0
-            if not prev or val <= 6.0 or val == 0:
-                group.append(item)
-            else:
-                yield group
-                group = [item]
-            prev = item
-            if group:
-                yield group
+        starts = np.flatnonzero(run_start | jump)
+        segment_ends = np.flatnonzero(segment_end)
+        single = starts == segment_ends
+    return list(zip(starts.tolist(), segment_ends.tolist(), single.tolist()))
+
+
+def classify_segment(first, last, chord, distance, bearings=DEFAULT_BEARINGS):
+    """Tells trees from delivery sites by the width of their lidar return."""
+    if chord > LIDAR_DELIVERY_DIAMETER:
+        return ObjectClass.TREE
+    if first == 0 or last == bearings.sample_count - 1:
+        # may be a wider object cut off by the edge of the scan
+        return ObjectClass.UNKNOWN
+    if distance * bearings.step_rad > LIDAR_DELIVERY_DIAMETER:
+        # too far out for a tree to be sure to span samples wider than a site
+        return ObjectClass.UNKNOWN
+    return ObjectClass.DELIVERY_SITE
 
 
 # ------CONTROLLER COMPONENTS---------------------------------------------------
 # ------------------------------------------------------------------------------
 # ------------------------------------------------------------------------------
+class Track:
+    """An object seen by the lidar, held in the tracker's world frame.
+
+    x, y are the object's lidar-facing point. The class is decided by a
+    running vote over the observations, confidence by how consistently the
+    object is seen whenever it should be.
+    """
+
+    __slots__ = ["track_id", "x", "y", "confidence", "hits", "_votes"]
+
+    def __init__(self, track_id, x, y, kind):
+        self.track_id = track_id
+        self.x = x
+        self.y = y
+        self.confidence = TRACK_INITIAL_CONFIDENCE
+        self.hits = 1
+        self._votes = 0
+        self.vote(kind)
+
+    @property
+    def kind(self):
+        if self._votes > 0:
+            return ObjectClass.TREE
+        elif self._votes < 0:
+            return ObjectClass.DELIVERY_SITE
+        return ObjectClass.UNKNOWN
+
+    def vote(self, kind):
+        if kind == ObjectClass.TREE:
+            self._votes += 1
+        elif kind == ObjectClass.DELIVERY_SITE:
+            self._votes -= 1
+
+    def hit(self, x, y, kind):
+        self.hits += 1
+        gain = max(1.0 / self.hits, TRACK_MIN_POSITION_GAIN)
+        self.x += (x - self.x) * gain
+        self.y += (y - self.y) * gain
+        self.confidence += (1.0 - self.confidence) * TRACK_HIT_GAIN
+        self.vote(kind)
+
+    def miss(self):
+        self.confidence *= TRACK_MISS_DECAY
+
+
+class ObjectTracker:
+    """Keeps a table of every object the lidar has segmented.
+
+    The vehicle's pose is dead-reckoned from its ground velocity, so objects
+    stay put in the tracker's frame and a new observation is matched to the
+    nearest track within TRACK_GATE_M of it. Unmatched observations start
+    new tracks, and tracks that should have been seen but were not lose
+    confidence until they are dropped.
+    """
+
+    __slots__ = ["_tracks", "_next_id", "_pose_x", "_pose_y", "_version", "bearings"]
+
+    def __init__(self, bearings=DEFAULT_BEARINGS):
+        # The lidar the tracked objects are seen with
+        self.bearings = bearings
+        self._tracks = []
+        self._next_id = 0
+        self._pose_x = 0.0
+        self._pose_y = 0.0
+        self._version = 0
+
+    @property
+    def pose(self):
+        return (self._pose_x, self._pose_y)
+
+    @property
+    def tracks(self):
+        return self._tracks
+
+    @property
+    def version(self):
+        """Bumped whenever a track is added, dropped or changes class."""
+        return self._version
+
+    def advance(self, d_x, d_y):
+        self._pose_x += d_x
+        self._pose_y += d_y
+
+    def update(self, observations, median_samples):
+        """Matches world frame (x, y, kind) observations to the tracks."""
+        tracks = self._tracks
+        matched = set()
+        for (x, y, kind) in observations:
+            best = None
+            best_d2 = TRACK_GATE_M ** 2
+            for track in tracks:
+                d2 = (track.x - x) ** 2 + (track.y - y) ** 2
+                if d2 < best_d2 and track not in matched:
+                    best = track
+                    best_d2 = d2
+            if best is None:
+                best = Track(self._next_id, x, y, kind)
+                self._next_id += 1
+                self._version += 1
+                tracks.append(best)
+            else:
+                kind_before = best.kind
+                best.hit(x, y, kind)
+                if best.kind != kind_before:
+                    self._version += 1
+            matched.add(best)
+
+        min_x = self._pose_x - TRACK_BEHIND_M
+        kept = []
+        for track in tracks:
+            if track not in matched and self.in_clear_view(track, median_samples):
+                track.miss()
+            if track.confidence >= TRACK_DROP_CONFIDENCE and track.x >= min_x:
+                kept.append(track)
+        if len(kept) != len(tracks):
+            self._version += 1
+        self._tracks = kept
+
+    def in_clear_view(self, track, median_samples):
+        """Whether the lidar should have seen the track, i.e. nothing nearer blocks it."""
+        d_x = track.x - self._pose_x
+        d_y = track.y - self._pose_y
+        idx = self.bearings.nearest_sample_index(d_x, d_y)
+        if idx is None:
+            return False
+        distance = sqrt(d_x ** 2 + d_y ** 2)
+        if distance >= MAX_LIDAR_DISTANCE:
+            return False
+        sample = median_samples[idx]
+        return sample == 0 or sample > distance + TRACK_GATE_M
+
+
 class Detector:
-    __slots__ = ["_lidar_matrix", "_d_1_2", "_distance", "_theta", "_theta1", "_theta2"]
+    """Median-filters lidar scans and locates the objects in them.
 
-    def __init__(self):
-        self._lidar_matrix = np.zeros(shape=(5, 31), dtype=int)
+    The last `history_depth` scans are kept in a ring buffer alongside a
+    sorted copy of each column, so a new scan only moves the samples that
+    changed and the medians are read straight out of the sorted columns.
+    Every segment of the filtered scan is fed to an ObjectTracker; the
+    nearest object is also kept on its own for the existing controllers.
+    Switching to a lidar with other bearings starts the history over.
+    """
+
+    __slots__ = [
+        "_bearings",
+        "_lidar_history",
+        "_history_index",
+        "_sorted_columns",
+        "_median_samples",
+        "_tracker",
+        "_d_1_2",
+        "_distance",
+        "_theta",
+        "_theta1",
+        "_theta2",
+    ]
+
+    def __init__(self, history_depth=LIDAR_HISTORY_DEPTH, bearings=DEFAULT_BEARINGS):
+        if history_depth < 1:
+            raise ValueError("history_depth must be at least 1")
+        self._tracker = ObjectTracker(bearings)
+        self._reset_history(history_depth, bearings)
         self._distance = (0.0, 0.0)
         self._theta = 0.0
         self._theta1 = None
         self._theta2 = None
         self._d_1_2 = 0.0
 
+    def _reset_history(self, history_depth, bearings):
+        sample_count = bearings.sample_count
+        self._bearings = bearings
+        self._lidar_history = np.zeros(shape=(history_depth, sample_count), dtype=int)
+        self._history_index = 0
+        self._sorted_columns = [[0] * history_depth for _ in range(sample_count)]
+        self._median_samples = [0.0] * sample_count
+
+    @property
+    def bearings(self):
+        return self._bearings
+
+    @bearings.setter
+    def bearings(self, bearings):
+        if bearings is not self._bearings:
+            self._reset_history(len(self._lidar_history), bearings)
+            self._tracker.bearings = bearings
+
     @property
     def d_1_2(self):
         return self._d_1_2
@@ -134,10 +354,7 @@ class Detector:
 
     @distance.setter
     def distance(self, value):
-        self._distance = (
-            value * cos(radians(self._theta)),
-            value * sin(radians(self._theta)),
-        )
+        self._distance = self._bearings.polar_to_xy(value, self._theta)
 
     @property
     def theta(self):
@@ -155,73 +372,109 @@ class Detector:
     def theta2(self):
         return self._theta1
 
+    @property
+    def tracker(self):
+        return self._tracker
+
+    @property
+    def tracks(self):
+        return self._tracker.tracks
+
+    @property
+    def history_depth(self):
+        return len(self._lidar_history)
+
     @property
     def lidar_samples(self):
-        return self._lidar_matrix
+        """The scan history as a (history_depth, sample count) array, oldest scan first."""
+        idx = self._history_index
+        return np.concatenate((self._lidar_history[idx:], self._lidar_history[:idx]))
 
     @lidar_samples.setter
     def lidar_samples(self, value: list):
-        if len(value) == 31:
-            self._lidar_matrix = np.delete(self._lidar_matrix, 0, 0)
-            self._lidar_matrix = np.append(self._lidar_matrix, [value], axis=0)
+        if len(value) == self._bearings.sample_count:
+            self.push_samples(value)
             self.interpret_lidar()
 
+    @property
+    def median_samples(self):
+        """Per-angle median of the scan history. Updated in place on every scan."""
+        return self._median_samples
+
+    def push_samples(self, value):
+        """Adds a scan (a sequence or array with a sample per bearing) to the history."""
+        # overwrite the oldest scan and move each changed sample in its sorted column
+        row = self._lidar_history[self._history_index]
+        self._history_index = (self._history_index + 1) % len(self._lidar_history)
+        changed = np.flatnonzero(row != value)
+        if not changed.size:
+            return
+        old_samples = row[changed].tolist()
+        row[changed] = np.asarray(value)[changed]
+        depth = len(self._lidar_history)
+        mid = depth // 2
+        medians = self._median_samples
+        for col, old, sample in zip(changed.tolist(), old_samples, row[changed].tolist()):
+            column = self._sorted_columns[col]
+            del column[bisect_left(column, old)]
+            insort(column, sample)
+            if depth % 2:
+                medians[col] = float(column[mid])
+            else:
+                medians[col] = (column[mid - 1] + column[mid]) / 2
+
     def interpret_lidar(self):
-        median_samples = np.median(self._lidar_matrix, axis=0).tolist()
+        points = self._bearings.scan_points(self._median_samples)
         (d_1_2, distance, theta, theta1, theta2) = self.get_closest_object(
-            median_samples
+            self._median_samples, points
         )
         self._d_1_2 = d_1_2
         self._theta = theta
         self._theta1 = theta1
         self._theta2 = theta2
         self.distance = distance
-
-    def get_closest_object(self, median_samples):
+        self.track_objects(points)
+
+    def track_objects(self, points):
+        samples = self._median_samples
+        (pose_x, pose_y) = self._tracker.pose
+        observations = []
+        for first, last, _ in segment_obstacles(samples, leading_only=False):
+            (chord, m_x, m_y) = segment_midpoint(first, last, points)
+            kind = classify_segment(
+                first, last, chord, sqrt(m_x ** 2 + m_y ** 2), self._bearings
+            )
+            observations.append((pose_x + m_x, pose_y + m_y, kind))
+        self._tracker.update(observations, samples)
+
+    def get_closest_object(self, median_samples, points=None):
         # Find possible delivery by isolating lidar points of contact
+        bearings = self._bearings
+        if points is None:
+            points = bearings.scan_points(median_samples)
         distance_nearest = MAX_LIDAR_DISTANCE
-        theta_nearest = MAX_LIDAR_ANGLE
+        theta_nearest = bearings.max_angle
         d_1_2_nearest = None
         theta1_nearest = None
         theta2_nearest = None
-        try:
-            for _, idx_lists in enumerate(group_adjacent(median_samples)):
-
-                if not isinstance(idx_lists, int):
-                    index_set = list(idx_lists)[0]
-                    # clean_set = detect_outlier(index_set, self.lidar_samples)
-                    location = euclid_values(
-                        index_set[0], index_set[-1], median_samples
-                    )
-                    d_1_2 = location[0]
-                    distance = location[1]
-                    theta = location[2]
-                    theta1 = location[3]
-                    theta2 = location[4]
-
-                    if distance < distance_nearest:
-
-                        d_1_2_nearest = d_1_2
-                        distance_nearest = distance
-                        theta_nearest = theta
-                        theta1_nearest = theta1
-                        theta2_nearest = theta2
-                else:
-                    # for single point
-                    d_1_2 = 0.0
-                    idx = int(idx_lists)
-                    distance = median_samples[idx]
-                    theta = (-1) * (idx) + 15
-
-                    # if single point is the closest, approach, but do not drop
-                    if distance < distance_nearest:
-                        # assign to 'nearest' values
-                        d_1_2_nearest = d_1_2
-                        distance_nearest = distance
-                        theta_nearest = theta
-        except Exception as e:
-            # catch when lidar samples are all 0 values
-            return (0, 0, 0, 0, 0)
+        for first, last, single in segment_obstacles(median_samples):
+            if single:
+                # if single point is the closest, approach, but do not drop
+                distance = median_samples[first]
+                if distance < distance_nearest:
+                    d_1_2_nearest = 0.0
+                    distance_nearest = distance
+                    theta_nearest = bearings.angles[first]
+            else:
+                (d_1_2, distance, theta, theta1, theta2) = euclid_values(
+                    first, last, points, bearings
+                )
+                if distance < distance_nearest:
+                    d_1_2_nearest = d_1_2
+                    distance_nearest = distance
+                    theta_nearest = theta
+                    theta1_nearest = theta1
+                    theta2_nearest = theta2
 
         return (
             d_1_2_nearest,
@@ -238,20 +491,33 @@ class SpeedController(Detector):
         "_v_x",
         "_wind_vector_x",
         "_wind_vector_y",
+        "dt_sec",
     ]
 
-    def __init__(self, v_x=AIRSPEED_X):
+    def __init__(self, v_x=AIRSPEED_X, history_depth=LIDAR_HISTORY_DEPTH):
         self._v_y = 0.0
         self._v_x = v_x
         self._wind_vector_x = 0.0
         self._wind_vector_y = 0.0
-        super().__init__()
+        self.dt_sec = CONTROL_DT_SEC
+        super().__init__(history_depth)
 
     @property
     def v_y(self):
         return self._v_y
 
+    def configure(self, bearings, dt_sec):
+        """Follows the lidar and tick length of the telemetry, e.g. from its versioned header."""
+        self.bearings = bearings
+        self.dt_sec = dt_sec
+
     def speed_inputs(self, wind_vector_x, wind_vector_y, lidar_samples):
+        # dead-reckon the last tick before the new scan is tracked
+        v_y = max(-MAX_AIRSPEED, min(MAX_AIRSPEED, self._v_y))
+        self.tracker.advance(
+            (self._v_x + wind_vector_x) * self.dt_sec,
+            (v_y + wind_vector_y) * self.dt_sec,
+        )
         self.lidar_samples = lidar_samples
         self._wind_vector_x = wind_vector_y
         self._wind_vector_y = wind_vector_y
@@ -262,19 +528,22 @@ class SpeedController(Detector):
         if distance is None:
             theta = self.theta
         elif distance[0] != 0:
-                theta = degrees(atan(distance[1] / distance[0]))
+                theta = xy_to_bearing(distance[0], distance[1])
         else:
             theta = 0
         #update airspeed        
-        self._v_y = (v_x_sum * atan(radians(theta))) - self._wind_vector_y      
+        self._v_y = (v_x_sum * self._bearings.bearing_gain(theta)) - self._wind_vector_y      
 
     def avoid_collision(self, lidar_samples):
-        theta_last = MAX_LIDAR_ANGLE
+        angles = self._bearings.angles
+        lidar_cos = self._bearings.cos
+        theta_last = self._bearings.max_angle
+        idx_last = 0
         distance_last = VEHICLE_AVOID_THRESHOLD
         
         for target_idx, distance in enumerate(lidar_samples):
-            theta = (-1) * (target_idx) + 15
-            d_x = distance * cos(radians(theta_last))
+            theta = angles[target_idx]
+            d_x = distance * lidar_cos[idx_last]
 
             #1 degree extra buffer for no collision direction
             if not (self.theta1 - 1  < theta < self.theta2 + 1) or (
@@ -285,6 +554,7 @@ class SpeedController(Detector):
                 ) < abs(theta_last):
                     distance_last = distance
                     theta_last = theta
+                    idx_last = target_idx
 
         self.theta = theta_last
 
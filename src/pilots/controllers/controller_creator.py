@@ -1,14 +1,24 @@
 from __future__ import annotations
 from abc import ABC, abstractmethod
 from enum import IntFlag
+import collections
 import serial
 import time
 import struct
-import sys
 
-from .controller_components import SpeedController, PackageController
-from zip_sim import TELEMETRY_STRUCT, COMMAND_STRUCT
-from config import arduino
+from .controller_components import (
+    SpeedController,
+    PackageController,
+    LIDAR_DELIVERY_DIAMETER,
+    DELIVERY_SITE_RADIUS,
+    ObjectClass,
+)
+from .bearings import lidar_bearings
+from .path_planner import PathPlanner, object_centers, near_any
+from zip_sim import COMMAND_STRUCT
+from config import arduino, arduino_sim
+from ..telemetry import TelemetryView, telemetry_format
+from ..serial_transport import SerialTransport
 
 ARDUINO_COMMAND_STRUCT = struct.Struct("<fB3s")  # struct for little endian conversion
 
@@ -20,15 +30,16 @@ VEHICLE_WINGSPAN_RADIUS = 1.6
 
 TREE_RADIUS = 3.0
 
-# 0.5 buffer for average diameter values
-LIDAR_DELIVERY_DIAMETER = 1.5
-
 LAT_AVOIDANCE_DISTANCE = VEHICLE_WINGSPAN_RADIUS + TREE_RADIUS
 
 VEHICLE_AIRSPEED = 30.0
 # How long it takes for the package to "fall" and hit the ground after being released.
 PACKAGE_FALL_SEC = 0.5
 
+RECOVERY_APPROACH_DISTANCE = 100.0
+# A package is dropped when it would land this close to a tracked site's centre.
+PLAN_DROP_RADIUS = DELIVERY_SITE_RADIUS - 2.0
+
 # ------Controller Flags--------------------------------------------------------
 # ------------------------------------------------------------------------------
 class PilotFlags(IntFlag):
@@ -54,8 +65,20 @@ class AutoControlCreator(ControllerCreator):
             speed_controller = SpeedController()
             package_controller = PackageController()
             return AutoController1(speed_controller, package_controller)
+        elif controller_select == "PLAN":
+            return PlanningController(SpeedController(), PathPlanner())
         elif controller_select == "UNO":
-            return ArduinoController()
+            return ArduinoController(self.create_controller("AUTO"))
+        elif controller_select == "UNO_SIM":
+            # The serial path end to end, with AUTO flying on a simulated board behind an in-memory cable. Imported here
+            # so that every other pilot doesn't load the simulated board along with the controllers.
+            from ..fake_arduino import FakeArduino, loopback_pair
+
+            (link, device_link) = loopback_pair(timeout=ArduinoController.READ_POLL_SEC, **arduino_sim)
+            device = FakeArduino(
+                device_link, self.create_controller("AUTO"), ARDUINO_COMMAND_STRUCT
+            )
+            return ArduinoController(self.create_controller("AUTO"), link, device)
 
 
 # ------CONCRETE CLASS DEFINITIONS----------------------------------------------
@@ -70,6 +93,15 @@ class AutoController(ABC):
     def return_data(self):
         pass
 
+    @property
+    def flag_status(self):
+        # PilotFlags state of the controller, None for controllers that don't keep one
+        return None
+
+    def close(self):
+        # releases anything the controller holds open, e.g. a serial port
+        pass
+
 
 class AutoController1(AutoController):
     __slots__ = ["_flag_status", "_v_y", "_d_x_last", "_d_y_last"]
@@ -78,20 +110,26 @@ class AutoController1(AutoController):
         self._flag_status = PilotFlags.APPROACH_TARGET
         self._speed_ctrl = speed_controller
         self._package_ctrl = package_controller
+        self._telemetry = TelemetryView()
         # self._d_rel = None
 
         super().__init__()
 
+    @property
+    def flag_status(self):
+        return self._flag_status
+
     def receive_data(self, telemetry_buffer):
         # method for autopilot1 to interpret telemetry data
-        telemetry = TELEMETRY_STRUCT.unpack(telemetry_buffer)
+        telemetry = self._telemetry.decode(telemetry_buffer)
+        self._speed_ctrl.configure(lidar_bearings(*telemetry.lidar_geometry), telemetry.dt_sec)
 
-        timestamp = telemetry[0]
-        recovery_x_error = telemetry[1]
-        wind_vector_x = float(telemetry[2])
-        wind_vector_y = float(telemetry[3])
-        recovery_y_error = telemetry[4]
-        lidar_samples = list(telemetry[5:])[::-1]
+        timestamp = telemetry.timestamp
+        recovery_x_error = telemetry.recovery_x_error
+        wind_vector_x = telemetry.wind_vector_x
+        wind_vector_y = telemetry.wind_vector_y
+        recovery_y_error = telemetry.recovery_y_error
+        lidar_samples = telemetry.lidar
 
         # update the speed controller
         self._speed_ctrl.speed_inputs(wind_vector_x, wind_vector_y, lidar_samples)
@@ -144,108 +182,218 @@ class AutoController1(AutoController):
         return (self._speed_ctrl.v_y, self._package_ctrl.drop_status)
 
 
-class ArduinoController(AutoController):
-    def __init__(self):
-        self._arduino = serial.Serial(
-            arduino["port"], timeout=arduino["timeout"], baudrate=arduino["baud"]
+class PlanningController(AutoController):
+    """Flies a path planned over every tracked object instead of reacting to the nearest one.
+
+    The speed controller's Detector keeps the object tracks, the PathPlanner
+    turns them into a lateral path, and a package is dropped whenever it
+    would land on a tracked site that has not had one yet.
+    """
+
+    __slots__ = [
+        "_speed_ctrl",
+        "_planner",
+        "_telemetry",
+        "_drop_status",
+        "_delivered",
+        "_goal",
+    ]
+
+    def __init__(self, speed_controller, path_planner):
+        self._speed_ctrl = speed_controller
+        self._planner = path_planner
+        self._telemetry = TelemetryView()
+        self._drop_status = 0
+        self._delivered = []
+        self._goal = None
+        super().__init__()
+
+    @property
+    def planner(self):
+        return self._planner
+
+    @property
+    def flag_status(self):
+        return PilotFlags.RECOVER if self._goal is not None else PilotFlags.APPROACH_TARGET
+
+    def receive_data(self, telemetry_buffer):
+        telemetry = self._telemetry.decode(telemetry_buffer)
+        self._speed_ctrl.configure(lidar_bearings(*telemetry.lidar_geometry), telemetry.dt_sec)
+
+        recovery_x_error = telemetry.recovery_x_error
+        wind_vector_x = telemetry.wind_vector_x
+        wind_vector_y = telemetry.wind_vector_y
+        recovery_y_error = telemetry.recovery_y_error
+        lidar_samples = telemetry.lidar
+
+        self._speed_ctrl.speed_inputs(wind_vector_x, wind_vector_y, lidar_samples)
+        tracker = self._speed_ctrl.tracker
+        (pose_x, pose_y) = tracker.pose
+        v_x_sum = VEHICLE_AIRSPEED + wind_vector_x
+
+        if self._goal is None and recovery_x_error < RECOVERY_APPROACH_DISTANCE:
+            self._goal = (pose_x + recovery_x_error, pose_y + recovery_y_error)
+
+        self._planner.update(tracker, v_x_sum, self._delivered, self._goal)
+        v_y = self._planner.lateral_speed(tracker.pose, v_x_sum) - wind_vector_y
+        v_y = max(-VEHICLE_AIRSPEED, min(VEHICLE_AIRSPEED, v_y))
+        self._speed_ctrl._v_y = v_y
+
+        self._drop_status = 0 if self._drop_status else self.check_drop(
+            tracker, (v_x_sum, v_y + wind_vector_y)
         )
-        time.sleep(1)
-        self._telemetry_buffer = None
-        self._emergency_counter = 0
+
+    def check_drop(self, tracker, velocity):
+        # the package leaves after this tick's move and keeps the vehicle's velocity while it falls
+        fall_sec = self._speed_ctrl.dt_sec + PACKAGE_FALL_SEC
+        (pose_x, pose_y) = tracker.pose
+        landing = (pose_x + velocity[0] * fall_sec, pose_y + velocity[1] * fall_sec)
+        for site in object_centers(tracker.tracks, tracker.pose, (ObjectClass.DELIVERY_SITE,)):
+            if near_any(site, self._delivered, 2 * DELIVERY_SITE_RADIUS):
+                continue
+            if near_any(landing, (site,), PLAN_DROP_RADIUS):
+                self._delivered.append(site)
+                return 1
+        return 0
+
+    def return_data(self):
+        return (self._speed_ctrl.v_y, self._drop_status)
+
+
+class ArduinoController(AutoController):
+    """Flies with the commands of an autopilot board on a serial link, and a local controller when it stalls.
+
+    The fallback controller (an AutoController1) is fed every tick's
+    telemetry too, so it is tracking the same objects when the board
+    misses its reply deadline and can take over within that tick. Control
+    goes back to the board as soon as it answers current telemetry again.
+
+    Replies carry nothing saying which telemetry they answer, so the frames
+    in flight are kept in order and each reply is matched to the oldest.
+    """
+
+    # Read timeout of the serial port. It only bounds how long the reader thread takes to notice close().
+    READ_POLL_SEC = 0.05
+
+    # Telemetry frames in flight before the board counts as behind and new ones are held back.
+    MAX_OUTSTANDING_FRAMES = 2
+
+    # Frames unanswered for this long are written off as lost on the way, e.g. to a corrupted byte.
+    LOST_FRAME_SEC = 0.1
+
+    # Oldest telemetry, in ticks, that a reply can answer and still be flown. 1 allows a reply pipelined a tick late.
+    MAX_REPLY_AGE_TICKS = 1
+
+    def __init__(self, fallback, link=None, device=None):
+        """Opens the port in config.arduino, unless given a link to talk over (and the device behind it to close)."""
+        if link is None:
+            link = serial.Serial(
+                arduino["port"],
+                baudrate=arduino["baud"],
+                timeout=self.READ_POLL_SEC,
+                write_timeout=arduino["timeout"],
+            )
+            time.sleep(1)
+        self._device = device
+        self._transport = SerialTransport(link, max_payload_size=ARDUINO_COMMAND_STRUCT.size)
+        self._transport.negotiate(arduino["check"], arduino["timeout"])
+        self._fallback = fallback
+        self._degraded = False
+        self._tick = 0
+        # Seconds to wait for the board's reply, set from the tick length of the telemetry
+        self._reply_deadline = 0.0
+        # (tick, send time) of every frame sent that the board hasn't answered yet, oldest first
+        self._outstanding = collections.deque()
+        # Ticks flown on the fallback controller so far
+        self.fallback_ticks = 0
+
+    @property
+    def degraded(self):
+        # True while the fallback controller is flying instead of the board
+        return self._degraded
+
+    @property
+    def outstanding(self):
+        return len(self._outstanding)
+
+    @property
+    def flag_status(self):
+        return self._fallback.flag_status if self._degraded else None
 
     def receive_data(self, telemetry_buffer):
         if telemetry_buffer != None:
-            # store telemetry for emergency case
-            self._telemetry_buffer = telemetry_buffer
-            self.__send_packet(telemetry_buffer)
+            self._fallback.receive_data(telemetry_buffer)
+            self._tick += 1
+            (dt_sec, _, offset) = telemetry_format(telemetry_buffer)
+            self._reply_deadline = arduino["reply_deadline_ticks"] * dt_sec
+
+            outstanding = self._outstanding
+            now = time.monotonic()
+            while outstanding and now - outstanding[0][1] > self.LOST_FRAME_SEC:
+                outstanding.popleft()
+            if len(outstanding) >= self.MAX_OUTSTANDING_FRAMES:
+                return  # the board would only answer it after telemetry that's already stale
+            if offset:
+                return  # the firmware only reads the default telemetry, so the fallback flies every tick
+            try:
+                self._transport.send(telemetry_buffer)
+            except serial.SerialException:
+                # includes write timeouts, so a wedged port doesn't hold up the tick
+                return
+            outstanding.append((self._tick, now))
 
     def return_data(self):
         """Interface for reading data out of arduino controller and pipeing it
         back into zip_sim"""
 
-        payload = None
-        start_time = time.time()
-        while payload == None and time.time() < (start_time + arduino["timeout"]):
-            payload = self.__read_packet()
+        payload = self.__current_reply()
 
         if payload != None:
             (lateral_airspeed, drop_flag, _) = ARDUINO_COMMAND_STRUCT.unpack(payload)
-
+            self._degraded = False
         else:
-            (lateral_airspeed, drop_flag) = self.__emergency_command()
+            (lateral_airspeed, drop_flag) = self._fallback.return_data()
+            self._degraded = True
+            self.fallback_ticks += 1
 
         return (lateral_airspeed, drop_flag)
 
-    def __send_packet(self, buffer):
-        payload = None
-        tx = b"\x10\x02"  # start sequence
-        tx += struct.pack("<B", 44)  # length of data
-        tx += bytes(buffer)
-        tx += struct.pack("<B", self.__calc_checksum(buffer))
-        tx += b"\x10\x03"  # end sequence
-        self._arduino.write(tx)
-        # start_time = time.time()
-        # while payload == None and time.time() < (start_time + arduino["timeout"]):
-        #     payload = self.__read_packet()
-
-        # end_time = time.time()
-        # tot = end_time - start_time
-        # str_time = "Round Trip Time: " + str(tot)
-
-        # return None
-
-    def __emergency_command(self):
-        """Returns emergency command to negate lateral wind velocity if
-        arduino connection fails
-
-        returns empty after arbitrary 10 tries"""
-
-        if self._emergency_counter < 5:
-            telemetry = TELEMETRY_STRUCT.unpack(bytes(self._telemetry_buffer))
-            v_y = float(telemetry[3]) * -1
-            self._emergency_counter += 1
-
-            return (v_y, 0)
-        else:
+    def close(self):
+        self._transport.close()
+        if self._device is not None:
+            self._device.close()
+
+    def __current_reply(self):
+        """Returns the newest command answering recent enough telemetry, or None if the board missed this tick.
+
+        Only a tick that sent the board a frame waits out the deadline for
+        it. If nothing at all arrives in that time, the frames sent before
+        it are written off: they'd be too old to fly by the time they were
+        answered, and keeping a lost one would make every later reply look
+        a tick older than it is."""
+        transport = self._transport
+        outstanding = self._outstanding
+        if transport.error is not None or not (outstanding or transport.pending()):
             return None
-
-    def __calc_checksum(self, data):
-        calculated_checksum = 0
-        for byte in data:
-            calculated_checksum ^= byte
-        return calculated_checksum
-
-    def __read_packet(self):
-        """
-        :return received data in the packet if read sucessfully, else return None
-        """
-        try:
-            # check start sequence
-            if self._arduino.read() != b"\x10":
-                return None
-
-            if self._arduino.read() != b"\x02":
-                return None
-
-            payload_len = self._arduino.read()[0]
-            if payload_len != ARDUINO_COMMAND_STRUCT.size:
-                # could be other type of packet, but not implemented for now
-                return None
-
-            # we don't know if it is valid yet
-            payload = self._arduino.read(payload_len)
-
-            checksum = self._arduino.read()[0]
-            if checksum != self.__calc_checksum(payload):
-                return None  # checksum error
-
-            # check end sequence
-            if self._arduino.read() != b"\x10":
-                return None
-            if self._arduino.read() != b"\x03":
-                return None
-            # yeah valid packet received
-            return payload
-        except self._arduino.SerialTimeoutException:
-            sys.stderr.write("Controller has timed out.\n")
-            raise TimeoutError
+        waiting = bool(outstanding) and outstanding[-1][0] == self._tick
+        deadline = time.monotonic() + (self._reply_deadline if waiting else 0.0)
+        payload = None
+        while True:
+            reply = transport.receive(max(deadline - time.monotonic(), 0.0))
+            if reply is None:
+                break
+            waiting = False
+            if not outstanding:
+                continue  # an answer to a frame already written off
+            (tick, _) = outstanding.popleft()
+            if (
+                len(reply) == ARDUINO_COMMAND_STRUCT.size
+                and self._tick - tick <= self.MAX_REPLY_AGE_TICKS
+            ):
+                payload = reply
+            if payload is not None and not transport.pending():
+                break
+        if waiting:
+            while len(outstanding) > 1:
+                outstanding.popleft()
+        return payload
@@ -0,0 +1,227 @@
+from __future__ import annotations
+from math import sqrt
+
+import numpy as np
+
+from .controller_components import (
+    ObjectClass,
+    DELIVERY_SITE_RADIUS,
+    TRACK_INITIAL_CONFIDENCE,
+    WORLD_WIDTH,
+)
+
+TREE_COLLISION_RADIUS = 2.0
+
+TREE_LIDAR_RADIUS = 3.0
+
+DELIVERY_SITE_LIDAR_RADIUS = 0.5
+
+# How far ahead a path is planned, and the spacing of the planning grid along and across the flight path.
+PLAN_HORIZON_M = 100.0
+
+PLAN_STATION_M = 2.5
+
+PLAN_CELL_M = 0.5
+
+PLAN_STATIONS = int(PLAN_HORIZON_M / PLAN_STATION_M)
+
+PLAN_CELLS = int(WORLD_WIDTH / PLAN_CELL_M)
+
+# Kept on top of the tree collision radius. Also covers the path cutting
+# corners between stations and the tracker's position error.
+PLAN_CLEARANCE_M = 1.5
+
+# Lateral ground speed a path may ask for, leaving headroom for wind and corrections.
+PLAN_MAX_LATERAL_SPEED = 20.0
+
+PLAN_SITE_REWARD = 100.0
+# Passing a site this close counts as visiting it.
+PLAN_SITE_CAPTURE_M = 1.5
+
+PLAN_STEER_COST = 0.05
+
+PLAN_BLOCKED_COST = 1e4
+# Cost per metre the path ends up outside the recovery zone.
+PLAN_GOAL_COST = 50.0
+
+PLAN_GOAL_TOLERANCE_M = 5.0
+# The vehicle is steered at the path this far ahead of it.
+PLAN_LOOKAHEAD_M = 5.0
+
+PLAN_REPLAN_DEVIATION_M = 1.5
+
+
+# ------=Utility Functions-------------------------------------------------
+# ------------------------------------------------------------------------------
+# ------------------------------------------------------------------------------
+def wrap_lateral(d_y):
+    """Wraps lateral offsets into [-WORLD_WIDTH / 2, WORLD_WIDTH / 2)."""
+    return (d_y + WORLD_WIDTH / 2) % WORLD_WIDTH - WORLD_WIDTH / 2
+
+
+def object_centers(tracks, pose, kinds):
+    """Returns the estimated centres of the tracks of the given classes.
+
+    Tracks hold the point of an object facing the lidar, so the centre is
+    pushed back along the line of sight by the object's lidar radius.
+    """
+    (pose_x, pose_y) = pose
+    centers = []
+    for track in tracks:
+        kind = track.kind
+        if kind not in kinds or track.confidence < TRACK_INITIAL_CONFIDENCE:
+            continue
+        radius = (
+            DELIVERY_SITE_LIDAR_RADIUS
+            if kind == ObjectClass.DELIVERY_SITE
+            else TREE_LIDAR_RADIUS
+        )
+        d_x = track.x - pose_x
+        d_y = track.y - pose_y
+        norm = sqrt(d_x ** 2 + d_y ** 2)
+        if norm > 0:
+            centers.append((track.x + radius * d_x / norm, track.y + radius * d_y / norm))
+        else:
+            centers.append((track.x, track.y))
+    return centers
+
+
+def near_any(position, points, radius):
+    for (x, y) in points:
+        if (x - position[0]) ** 2 + wrap_lateral(y - position[1]) ** 2 < radius ** 2:
+            return True
+    return False
+
+
+# ------PATH PLANNER------------------------------------------------------------
+# ------------------------------------------------------------------------------
+# ------------------------------------------------------------------------------
+class PathPlanner:
+    """Plans a lateral path over the tracked objects ahead of the vehicle.
+
+    The plan is a dynamic program over a grid of stations along the flight
+    path by lateral cells across the wrapping world width. Cells within
+    TREE_COLLISION_RADIUS + PLAN_CLEARANCE_M of a tree (or of an object not
+    yet classified) are blocked. Cells passing over a delivery site are
+    rewarded, and once recovering, cells outside the recovery zone cost.
+
+    The plan is kept until the tracker's map or the goal changes, the
+    vehicle strays from it, or half of it has been flown.
+    """
+
+    __slots__ = ["_path_x", "_path_y", "_plan_key", "replans"]
+
+    def __init__(self):
+        self._path_x = None
+        self._path_y = None
+        self._plan_key = None
+        self.replans = 0
+
+    @property
+    def path(self):
+        """The planned (x, y) stations in the tracker's frame."""
+        if self._path_x is None:
+            return []
+        return list(zip(self._path_x.tolist(), self._path_y.tolist()))
+
+    def update(self, tracker, ground_speed_x, delivered=(), goal=None):
+        """Replans if the cached plan no longer applies.
+
+        delivered holds the positions of sites already given a package and
+        goal the (x, y) of the recovery point, once it is being flown to.
+        """
+        plan_key = (tracker.version, len(delivered), goal)
+        (pose_x, pose_y) = tracker.pose
+        if (
+            self._path_x is None
+            or plan_key != self._plan_key
+            or pose_x > self._path_x[PLAN_STATIONS // 2]
+            or abs(pose_y - self.path_y_at(pose_x)) > PLAN_REPLAN_DEVIATION_M
+        ):
+            self.replan(tracker, ground_speed_x, delivered, goal)
+            self._plan_key = plan_key
+
+    def path_y_at(self, x):
+        # linear interpolation between stations, holding the ends
+        step = (x - self._path_x[0]) / PLAN_STATION_M
+        idx = int(step)
+        if idx < 0:
+            return float(self._path_y[0])
+        if idx >= PLAN_STATIONS:
+            return float(self._path_y[-1])
+        frac = step - idx
+        return float(self._path_y[idx] * (1 - frac) + self._path_y[idx + 1] * frac)
+
+    def lateral_speed(self, pose, ground_speed_x):
+        """Returns the lateral ground speed that steers the vehicle onto the plan."""
+        (pose_x, pose_y) = pose
+        target_y = self.path_y_at(pose_x + PLAN_LOOKAHEAD_M)
+        return (target_y - pose_y) * ground_speed_x / PLAN_LOOKAHEAD_M
+
+    def replan(self, tracker, ground_speed_x, delivered=(), goal=None):
+        (pose_x, pose_y) = tracker.pose
+        tracks = tracker.tracks
+        xs = pose_x + PLAN_STATION_M * np.arange(PLAN_STATIONS + 1)
+        offsets = PLAN_CELL_M * (np.arange(PLAN_CELLS) - PLAN_CELLS // 2)
+        score = np.zeros((PLAN_STATIONS + 1, PLAN_CELLS))
+
+        obstacles = object_centers(
+            tracks, (pose_x, pose_y), (ObjectClass.TREE, ObjectClass.UNKNOWN)
+        )
+        if obstacles:
+            centers = np.array(obstacles)
+            d_x = xs[np.newaxis, :, np.newaxis] - centers[:, 0, np.newaxis, np.newaxis]
+            d_y = wrap_lateral(
+                offsets[np.newaxis, np.newaxis, :]
+                - (centers[:, 1, np.newaxis, np.newaxis] - pose_y)
+            )
+            clearance = TREE_COLLISION_RADIUS + PLAN_CLEARANCE_M
+            blocked = (d_x ** 2 + d_y ** 2 < clearance ** 2).any(axis=0)
+            score -= PLAN_BLOCKED_COST * blocked
+
+        for (site_x, site_y) in object_centers(
+            tracks, (pose_x, pose_y), (ObjectClass.DELIVERY_SITE,)
+        ):
+            if near_any((site_x, site_y), delivered, 2 * DELIVERY_SITE_RADIUS):
+                continue
+            station = round((site_x - pose_x) / PLAN_STATION_M)
+            if 0 < station <= PLAN_STATIONS:
+                reached = np.abs(wrap_lateral(offsets - (site_y - pose_y))) < PLAN_SITE_CAPTURE_M
+                score[station, reached] += PLAN_SITE_REWARD
+
+        if goal is not None:
+            (goal_x, goal_y) = goal
+            first = max(0, min(PLAN_STATIONS, round((goal_x - pose_x) / PLAN_STATION_M)))
+            miss = np.abs(wrap_lateral(offsets - (goal_y - pose_y))) - PLAN_GOAL_TOLERANCE_M
+            score[first:] -= PLAN_GOAL_COST * np.maximum(miss, 0.0)
+
+        # forward pass: best score of reaching each cell, starting from the vehicle's own cell
+        reach = max(
+            1,
+            int(PLAN_MAX_LATERAL_SPEED / max(ground_speed_x, 1.0) * PLAN_STATION_M / PLAN_CELL_M),
+        )
+        moves = np.array(sorted(range(-reach, reach + 1), key=abs))
+        # sources[m, j]: the cell that reaches cell j with moves[m]
+        sources = (np.arange(PLAN_CELLS)[np.newaxis, :] - moves[:, np.newaxis]) % PLAN_CELLS
+        steer_cost = PLAN_STEER_COST * np.abs(moves)[:, np.newaxis]
+        cells = np.arange(PLAN_CELLS)
+        value = np.full(PLAN_CELLS, -np.inf)
+        value[PLAN_CELLS // 2] = 0.0
+        came_by = np.zeros((PLAN_STATIONS + 1, PLAN_CELLS), dtype=int)
+        for station in range(1, PLAN_STATIONS + 1):
+            candidates = value[sources] - steer_cost
+            # ties go to the smallest move, which comes first
+            best = np.argmax(candidates, axis=0)
+            came_by[station] = moves[best]
+            value = candidates[best, cells] + score[station]
+
+        # walk back from the best final cell, keeping the lateral moves unwrapped
+        cell = int(np.argmax(value))
+        steps = np.zeros(PLAN_STATIONS + 1)
+        for station in range(PLAN_STATIONS, 0, -1):
+            move = came_by[station, cell]
+            steps[station] = move
+            cell = (cell - move) % PLAN_CELLS
+        self._path_x = xs
+        self._path_y = pose_y + PLAN_CELL_M * np.cumsum(steps)
+        self.replans += 1
@@ -0,0 +1,217 @@
+"""An in-memory stand-in for the Arduino, so the serial pilot path runs without a board.
+
+loopback_pair() makes the two ends of a simulated serial cable, each with
+the parts of pyserial's interface SerialTransport uses. A FakeArduino on
+one end answers telemetry frames the way the autopilot-uno firmware does,
+with a controller running on its own thread, and ArduinoController talks
+to the other end exactly as it would to a port. The cable can delay,
+jitter, rate-limit and corrupt what goes through it, to exercise the
+transport's deadlines and resyncing.
+"""
+from __future__ import annotations
+import collections
+import random
+import threading
+import time
+
+import serial
+
+from zip_sim import TELEMETRY_MAGIC, TELEMETRY_STRUCT
+from .serial_protocol import requested_check
+from .serial_transport import SerialTransport
+
+# Bits on the wire per byte at 8N1: a start bit, 8 data bits and a stop bit.
+BITS_PER_BYTE = 10
+
+# How long the device waits for a frame before checking whether the cable was closed.
+DEVICE_POLL_SEC = 0.05
+
+
+class _Channel:
+    """One direction of the cable: chunks of bytes, each readable from its delivery time on."""
+
+    __slots__ = ["chunks", "buffer", "line_free_at"]
+
+    def __init__(self):
+        self.chunks = collections.deque()
+        self.buffer = bytearray()
+        # When the last chunk written finishes arriving, for rate-limited cables
+        self.line_free_at = 0.0
+
+
+class LoopbackLink:
+    """One end of an in-memory serial cable. Create them in pairs with loopback_pair()."""
+
+    __slots__ = [
+        "_condition",
+        "_closed",
+        "_rx",
+        "_tx",
+        "timeout",
+        "latency_sec",
+        "jitter_sec",
+        "corruption_rate",
+        "baud",
+        "_rng",
+    ]
+
+    def __init__(self, condition, closed, rx, tx, timeout, latency_sec, jitter_sec, corruption_rate, baud, rng):
+        self._condition = condition
+        self._closed = closed
+        self._rx = rx
+        self._tx = tx
+        self.timeout = timeout
+        self.latency_sec = latency_sec
+        self.jitter_sec = jitter_sec
+        self.corruption_rate = corruption_rate
+        self.baud = baud
+        self._rng = rng
+
+    @property
+    def closed(self):
+        return self._closed.is_set()
+
+    def _deliver(self, now):
+        # Moves every chunk that has arrived by now into the read buffer. Must hold the condition.
+        rx = self._rx
+        while rx.chunks and rx.chunks[0][0] <= now:
+            rx.buffer += rx.chunks.popleft()[1]
+
+    def _next_arrival(self):
+        return self._rx.chunks[0][0] if self._rx.chunks else None
+
+    @property
+    def in_waiting(self):
+        with self._condition:
+            self._deliver(time.monotonic())
+            return len(self._rx.buffer)
+
+    def read(self, size=1):
+        """Reads up to size bytes, waiting until there are size bytes or the timeout passes, like pyserial."""
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                self._deliver(now)
+                if self._closed.is_set():
+                    raise serial.SerialException("Attempting to use a port that is not open")
+                if len(self._rx.buffer) >= size:
+                    break
+                wait = None if deadline is None else deadline - now
+                if wait is not None and wait <= 0:
+                    break
+                arrival = self._next_arrival()
+                if arrival is not None:
+                    wait = arrival - now if wait is None else min(wait, arrival - now)
+                self._condition.wait(wait)
+            data = bytes(self._rx.buffer[:size])
+            del self._rx.buffer[:size]
+            return data
+
+    def write(self, data):
+        if self._closed.is_set():
+            raise serial.SerialException("Attempting to use a port that is not open")
+        data = bytearray(data)
+        rng = self._rng
+        if self.corruption_rate:
+            for idx in range(len(data)):
+                if rng.random() < self.corruption_rate:
+                    data[idx] ^= 1 << rng.randrange(8)
+        now = time.monotonic()
+        arrival = now + self.latency_sec + (rng.uniform(0.0, self.jitter_sec) if self.jitter_sec else 0.0)
+        with self._condition:
+            tx = self._tx
+            if self.baud:
+                # The line sends one chunk at a time, so a chunk can't start before the previous one is through.
+                arrival = max(arrival, tx.line_free_at) + len(data) * BITS_PER_BYTE / self.baud
+                tx.line_free_at = arrival
+            # Bytes never overtake each other on a serial line, whatever the jitter.
+            if tx.chunks:
+                arrival = max(arrival, tx.chunks[-1][0])
+            tx.chunks.append((arrival, bytes(data)))
+            self._condition.notify_all()
+        return len(data)
+
+    def close(self):
+        """Closes both ends of the cable."""
+        with self._condition:
+            self._closed.set()
+            self._condition.notify_all()
+
+
+def loopback_pair(timeout=None, latency_sec=0.0, jitter_sec=0.0, corruption_rate=0.0, baud=None, seed=None):
+    """Returns the two ends of an in-memory serial cable, with the same impairments in both directions.
+
+    latency_sec and a uniform jitter of up to jitter_sec delay every write, baud (if given) limits how fast bytes go
+    through, and corruption_rate is the chance of each byte getting a bit flipped."""
+    condition = threading.Condition()
+    closed = threading.Event()
+    rng = random.Random(seed)
+    (a_to_b, b_to_a) = (_Channel(), _Channel())
+    impairments = (latency_sec, jitter_sec, corruption_rate, baud, rng)
+    return (
+        LoopbackLink(condition, closed, b_to_a, a_to_b, timeout, *impairments),
+        LoopbackLink(condition, closed, a_to_b, b_to_a, timeout, *impairments),
+    )
+
+
+def is_telemetry(payload):
+    """Whether a payload is a telemetry message the firmware reads, which is only the default one."""
+    return len(payload) == TELEMETRY_STRUCT.size and payload[: len(TELEMETRY_MAGIC)] != TELEMETRY_MAGIC
+
+
+class FakeArduino:
+    """Answers every telemetry frame on its end of a cable with a command frame from a controller.
+
+    The controller (e.g. AutoController1) runs on the device's own thread,
+    and commands are packed with the board's little-endian command struct.
+    The device agrees to any check the host asks for, and like the
+    firmware it only answers the default telemetry.
+    """
+
+    __slots__ = ["_transport", "_controller", "_command_struct", "_running", "_thread", "frames"]
+
+    def __init__(self, link, controller, command_struct):
+        # The device stops once the cable is closed from either end.
+        self._transport = SerialTransport(link)
+        self._controller = controller
+        self._command_struct = command_struct
+        # Telemetry frames answered so far
+        self.frames = 0
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="fake-arduino", daemon=True)
+        self._thread.start()
+
+    @property
+    def transport(self):
+        return self._transport
+
+    def _run(self):
+        transport = self._transport
+        while self._running and transport.error is None:
+            payload = transport.receive(DEVICE_POLL_SEC)
+            if payload is None:
+                continue
+            check = requested_check(payload)
+            if check is not None:
+                reply = payload
+            elif is_telemetry(payload):
+                self._controller.receive_data(payload)
+                (lateral_airspeed, drop_flag) = self._controller.return_data()
+                reply = self._command_struct.pack(lateral_airspeed, drop_flag, b"zip")
+            else:
+                continue
+            try:
+                transport.send(reply)
+            except serial.SerialException:
+                break  # the host closed the cable while we were answering
+            if check is not None:
+                # The echo went out on the old check, and everything after it is on the new one.
+                transport.set_check(check)
+            else:
+                self.frames += 1
+
+    def close(self):
+        self._running = False
+        self._thread.join()
+        self._transport.close()
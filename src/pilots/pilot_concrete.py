@@ -5,7 +5,8 @@ import struct
 import sys
 import keyboard
 
-from zip_sim import TELEMETRY_STRUCT, COMMAND_STRUCT
+from zip_sim import COMMAND_STRUCT
+from .telemetry import TelemetryView
 
 # ----------INTERFACE CLASS DEFINITIONS----------------------------------------------
 # ------------------------------------------------------------------------------
@@ -20,10 +21,30 @@ class IPilot(ABC):
         pass
 
     @abstractmethod
-    def send_command(self):
-        # abstract method for pilot to prepare command
+    def build_command(self):
+        # abstract method for pilot to prepare packed command bytes
+        pass
+
+    @property
+    def flag_status(self):
+        # PilotFlags state of the pilot's controller, None if it has none
+        return None
+
+    def close(self):
+        # releases anything the pilot holds open
         pass
 
+    def send_command(self):
+        cmd = self.build_command()
+
+        # send command back to parent process
+        try:
+            sys.stdout.buffer.write(cmd)
+            sys.stdout.flush()
+        except struct.error as e:
+            raise e
+        return None
+
 
 # ------CONCRETE CLASS DEFINITIONS----------------------------------------------
 # ------------------------------------------------------------------------------
@@ -35,25 +56,24 @@ class Autopilot(IPilot):
         super().__init__(pilot_id)
         self._ctrl = controller
 
-    def send_command(self):
+    @property
+    def flag_status(self):
+        return self._ctrl.flag_status
+
+    def close(self):
+        self._ctrl.close()
+
+    def build_command(self):
         # retrieve data from controller
         (v_y, drop_status) = self._ctrl.return_data()
 
         # create tuple for command
-        cmd = COMMAND_STRUCT.pack(
+        return COMMAND_STRUCT.pack(
             v_y,
             drop_status,
             self._padding.encode(),
         )
 
-        # send command back to parent process
-        try:
-            sys.stdout.buffer.write(cmd)
-            sys.stdout.flush()
-        except struct.error as e:
-            raise e
-        return None
-
     def interpret_telemetry(self, telemetry_buffer):
         # method for autopilot1 to interpret telemetry data
         self._ctrl.receive_data(telemetry_buffer)
@@ -69,23 +89,25 @@ class ManualPilot(IPilot):
         self._drop_package_commanded = 0
         self._drop_timestamp = 0
         self._timestamp = 0
+        self._telemetry = TelemetryView()
 
     # skeleton class for manualpilot implementation
     def interpret_telemetry(self, telemetry_buffer):
         # save instance of timestamp
-        telemetry = TELEMETRY_STRUCT.unpack(telemetry_buffer)
-        self._timestamp = telemetry[0]
+        self._timestamp = self._telemetry.decode(telemetry_buffer).timestamp
         return None
 
-    def send_command(self):
-        self._lateral_airspeed -= self._lateral_airspeed / 0.5 * (1 / 60.0)
+    def build_command(self):
+        # the keys ramp the airspeed per tick, so follow the tick length the telemetry was sent with
+        dt_sec = self._telemetry.dt_sec
+        self._lateral_airspeed -= self._lateral_airspeed / 0.5 * dt_sec
         if keyboard.is_pressed("a"):
             self._lateral_airspeed = min(
-                30.0, self._lateral_airspeed + (1 / 60.0) * 200.0
+                30.0, self._lateral_airspeed + dt_sec * 200.0
             )
         if keyboard.is_pressed("d"):
             self._lateral_airspeed = max(
-                -30.0, self._lateral_airspeed - (1 / 60.0) * 200.0
+                -30.0, self._lateral_airspeed - dt_sec * 200.0
             )
         if keyboard.is_pressed("space"):
             time_elapsed = self._timestamp - self._drop_timestamp
@@ -99,13 +121,6 @@ class ManualPilot(IPilot):
             self._padding.encode(),
         )
 
-        # send command back to parent process
-        try:
-            sys.stdout.buffer.write(cmd)
-            sys.stdout.flush()
-        except struct.error as e:
-            raise e
-
         self._drop_package_commanded = 0
 
-        return None
+        return cmd
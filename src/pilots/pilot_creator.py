@@ -42,6 +42,8 @@ class AutoPilotCreator(PilotCreator):
     # AP IDs:
     # 1: AUTO: Path Kinematics-based Autopilot Controller
     # 2: UNO: Arduino Autopilot MicroController over serial bus
+    # 3: PLAN: Autopilot Controller flying a path planned over tracked objects
+    # 4: UNO_SIM: UNO interface to a simulated MicroController running AUTO
     def __init__(self, pilot_id) -> None:
         super().__init__()
         self.pilot_id = pilot_id
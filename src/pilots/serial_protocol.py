@@ -0,0 +1,198 @@
+"""Frames of the serial protocol spoken with the autopilot board.
+
+Frames on the wire are
+
+    DLE STX | length | payload | check | DLE ETX
+
+where DLE STX is 0x10 0x02 and DLE ETX is 0x10 0x03. The check is one of
+
+    xor     the XOR of the payload bytes, in one byte. What the autopilot-uno firmware speaks.
+    crc16   CRC-16/CCITT-FALSE of the payload, in two big-endian bytes.
+
+Payloads aren't byte-stuffed, so the length is what delimits a frame. A
+DLE STX seen inside a payload only costs a resync when it is mistaken for
+a frame start.
+
+Every link starts out on xor. Right after connecting, the host may send a
+check request naming another check. A board that supports it echoes the
+request and switches, and once the echo is back the host switches too. A
+board that doesn't know the request ignores it, and the link stays on xor.
+"""
+from __future__ import annotations
+import binascii
+import struct
+
+FRAME_START = b"\x10\x02"
+
+FRAME_END = b"\x10\x03"
+
+# Start sequence and length byte before the payload.
+FRAME_HEADER_SIZE = len(FRAME_START) + 1
+
+MAX_PAYLOAD_SIZE = 255
+
+CHECK_XOR = "xor"
+
+CHECK_CRC16 = "crc16"
+
+# Struct format of each check's field, and the id a check request names it by.
+CHECK_FORMATS = {CHECK_XOR: "B", CHECK_CRC16: "H"}
+
+CHECK_IDS = {CHECK_XOR: 0, CHECK_CRC16: 1}
+
+CRC16_INIT = 0xFFFF
+
+# A check request is this followed by the id of the check asked for.
+CHECK_REQUEST_PREFIX = b"ZCK"
+
+# (shift, mask) steps folding a payload of a given size down to one byte, built as sizes are seen
+_xor_folds = {}
+
+
+def _fold_steps(size):
+    width = 8
+    while width < size * 8:
+        width *= 2
+    steps = []
+    while width > 8:
+        width //= 2
+        steps.append((width, (1 << width) - 1))
+    _xor_folds[size] = steps
+    return steps
+
+
+def xor_checksum(data):
+    """XOR of the bytes in data, folding them as one integer so it takes log2(len) steps instead of one per byte."""
+    value = int.from_bytes(data, "little")
+    for (shift, mask) in _xor_folds.get(len(data)) or _fold_steps(len(data)):
+        value = (value >> shift) ^ (value & mask)
+    return value
+
+
+def crc16(data):
+    return binascii.crc_hqx(data, CRC16_INIT)
+
+
+CHECK_FUNCTIONS = {CHECK_XOR: xor_checksum, CHECK_CRC16: crc16}
+
+
+def check_request(check):
+    return CHECK_REQUEST_PREFIX + bytes([CHECK_IDS[check]])
+
+
+def requested_check(payload):
+    """Returns the check a payload is a request for, or None if it isn't a check request (or names an unknown one)."""
+    if len(payload) != len(CHECK_REQUEST_PREFIX) + 1 or not payload.startswith(CHECK_REQUEST_PREFIX):
+        return None
+    for check, check_id in CHECK_IDS.items():
+        if payload[-1] == check_id:
+            return check
+    return None
+
+
+class FrameCodec:
+    """Builds frames around payloads.
+
+    Each payload size gets its own preallocated frame and a struct that
+    packs the whole frame into it with one pack_into(). The frame returned
+    by encode() is overwritten by the next payload of the same size.
+    """
+
+    __slots__ = ["_check", "_check_fn", "_frames"]
+
+    def __init__(self, check=CHECK_XOR):
+        self.check = check
+
+    @property
+    def check(self):
+        return self._check
+
+    @check.setter
+    def check(self, check):
+        self._check = check
+        self._check_fn = CHECK_FUNCTIONS[check]
+        # payload size -> (frame struct, frame buffer)
+        self._frames = {}
+
+    def encode(self, payload):
+        size = len(payload)
+        entry = self._frames.get(size)
+        if entry is None:
+            frame_struct = struct.Struct(
+                ">{}sB{}s{}{}s".format(
+                    len(FRAME_START), size, CHECK_FORMATS[self._check], len(FRAME_END)
+                )
+            )
+            entry = self._frames[size] = (frame_struct, bytearray(frame_struct.size))
+        (frame_struct, frame) = entry
+        frame_struct.pack_into(frame, 0, FRAME_START, size, payload, self._check_fn(payload), FRAME_END)
+        return frame
+
+
+class FrameParser:
+    """Splits a byte stream into frame payloads, dropping anything that isn't a valid frame.
+
+    Bytes are appended to one buffer that is compacted after every feed,
+    so a frame split across reads is completed by the next one.
+    """
+
+    __slots__ = ["_buffer", "_max_payload_size", "_check", "_check_fn", "_check_struct", "frames", "errors"]
+
+    def __init__(self, max_payload_size=MAX_PAYLOAD_SIZE, check=CHECK_XOR):
+        self._buffer = bytearray()
+        self._max_payload_size = max_payload_size
+        self.check = check
+        # Counts of valid frames and of frame starts that turned out not to be frames
+        self.frames = 0
+        self.errors = 0
+
+    @property
+    def check(self):
+        return self._check
+
+    @check.setter
+    def check(self, check):
+        self._check = check
+        self._check_fn = CHECK_FUNCTIONS[check]
+        self._check_struct = struct.Struct(">" + CHECK_FORMATS[check])
+
+    def feed(self, data):
+        """Adds bytes from the link and returns the payloads of the frames they complete."""
+        buffer = self._buffer
+        buffer += data
+        check_struct = self._check_struct
+        trailer_size = check_struct.size + len(FRAME_END)
+        payloads = []
+        pos = 0
+        while True:
+            start = buffer.find(FRAME_START, pos)
+            if start < 0:
+                # A trailing DLE might be the first half of the next start sequence.
+                pos = len(buffer) - 1 if buffer.endswith(FRAME_START[:1]) else len(buffer)
+                break
+            if len(buffer) - start < FRAME_HEADER_SIZE:
+                pos = start
+                break
+            length = buffer[start + len(FRAME_START)]
+            if length > self._max_payload_size:
+                self.errors += 1
+                pos = start + 1
+                continue
+            payload_end = start + FRAME_HEADER_SIZE + length
+            end = payload_end + trailer_size
+            if len(buffer) < end:
+                pos = start
+                break
+            payload = bytes(buffer[start + FRAME_HEADER_SIZE : payload_end])
+            if (
+                check_struct.unpack_from(buffer, payload_end)[0] != self._check_fn(payload)
+                or buffer[end - len(FRAME_END) : end] != FRAME_END
+            ):
+                self.errors += 1
+                pos = start + 1
+                continue
+            payloads.append(payload)
+            self.frames += 1
+            pos = end
+        del buffer[:pos]
+        return payloads
@@ -0,0 +1,96 @@
+"""Serial transport to the autopilot board, read on a background thread.
+
+A reader thread pulls whatever bytes the link has, feeds them to a
+FrameParser and queues every valid payload, so the pilot never reads the
+port byte by byte and only waits as long as its per-tick deadline. The
+frames themselves are described in serial_protocol.
+"""
+from __future__ import annotations
+import queue
+import threading
+
+from .serial_protocol import MAX_PAYLOAD_SIZE, FrameCodec, FrameParser, check_request
+
+# Largest read the reader thread asks the link for at once.
+READ_CHUNK_SIZE = 256
+
+
+class SerialTransport:
+    """Sends framed payloads over a serial link and receives them through a queue filled by a reader thread.
+
+    The link is anything with pyserial's read(), write(), in_waiting and
+    close(), opened with a short read timeout so the reader thread notices
+    close() promptly.
+    """
+
+    __slots__ = ["_link", "_codec", "_parser", "_frames", "_running", "_thread", "error"]
+
+    def __init__(self, link, max_payload_size=MAX_PAYLOAD_SIZE):
+        self._link = link
+        self._codec = FrameCodec()
+        self._parser = FrameParser(max_payload_size)
+        self._frames = queue.SimpleQueue()
+        self._running = True
+        # Set to the exception that stopped the reader thread, if any
+        self.error = None
+        self._thread = threading.Thread(target=self._read_loop, name="serial-reader", daemon=True)
+        self._thread.start()
+
+    @property
+    def parser(self):
+        return self._parser
+
+    @property
+    def check(self):
+        return self._codec.check
+
+    def set_check(self, check):
+        """Switches the check of the frames sent and received from now on."""
+        self._codec.check = check
+        self._parser.check = check
+
+    def negotiate(self, check, timeout):
+        """Asks the other end to switch to check and returns the check in use afterwards.
+
+        Call it right after connecting, before any other frames, since a
+        frame crossing the switch would fail its check. The link stays on
+        its current check if no echo arrives within timeout seconds."""
+        if check == self.check:
+            return check
+        request = check_request(check)
+        self.send(request)
+        if self.receive(timeout) == request:
+            self.set_check(check)
+        return self.check
+
+    def send(self, payload):
+        self._link.write(self._codec.encode(payload))
+
+    def receive(self, timeout=None):
+        """Returns the next received payload, or None if none arrives within timeout seconds."""
+        try:
+            return self._frames.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def pending(self):
+        """Returns how many received payloads are waiting to be taken."""
+        return self._frames.qsize()
+
+    def _read_loop(self):
+        link = self._link
+        try:
+            while self._running:
+                # Blocks for a byte (up to the link's timeout), then takes everything else that arrived with it.
+                data = link.read(min(max(link.in_waiting, 1), READ_CHUNK_SIZE))
+                if data:
+                    for payload in self._parser.feed(data):
+                        self._frames.put(payload)
+        except Exception as e:  # the link failed or was closed underneath us
+            if self._running:
+                self.error = e
+
+    def close(self):
+        self._running = False
+        self._thread.join()
+        self._link.close()
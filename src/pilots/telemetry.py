@@ -0,0 +1,157 @@
+"""Telemetry decoding that reads and views messages in place instead of copying them.
+
+Messages at the challenge's own tick rate and lidar are TELEMETRY_STRUCT.
+Any other simulation starts every message with the versioned header of
+TELEMETRY_FORMAT_STRUCT, which gives the tick length and the lidar's
+sample count and angle step, followed by the same fields with as many
+lidar samples as the header says.
+"""
+from __future__ import annotations
+import struct
+
+import numpy as np
+
+from zip_sim import (
+    DEFAULT_LIDAR_GEOMETRY,
+    DT_SEC,
+    TELEMETRY_FORMAT_STRUCT,
+    TELEMETRY_MAGIC,
+    TELEMETRY_STRUCT,
+    TELEMETRY_VERSION,
+    LidarGeometry,
+)
+
+# Everything in a telemetry message before the lidar samples.
+TELEMETRY_HEADER_STRUCT = struct.Struct(">Hhffb")
+
+LIDAR_OFFSET = TELEMETRY_HEADER_STRUCT.size
+
+LIDAR_SAMPLE_COUNT = TELEMETRY_STRUCT.size - LIDAR_OFFSET
+
+
+def telemetry_format(buffer):
+    """Returns (dt_sec, lidar geometry, offset of the fields) of a telemetry message.
+
+    Messages without the versioned header are the defaults. Raises
+    ValueError for a header of a version this module doesn't know."""
+    if buffer[: len(TELEMETRY_MAGIC)] != TELEMETRY_MAGIC:
+        return (DT_SEC, DEFAULT_LIDAR_GEOMETRY, 0)
+    (_, version, dt_sec, sample_count, step_deg) = TELEMETRY_FORMAT_STRUCT.unpack_from(buffer)
+    if version != TELEMETRY_VERSION:
+        raise ValueError("unknown telemetry version {}".format(version))
+    return (dt_sec, LidarGeometry(sample_count, step_deg), TELEMETRY_FORMAT_STRUCT.size)
+
+
+class TelemetryView:
+    """Decoded fields of a telemetry message, with the lidar left in the message's bytes.
+
+    `lidar` is a uint8 view of the samples, reversed into the
+    order the controllers use (leftmost bearing first). The view is only
+    rebuilt when a different buffer is decoded, so a reader that refills
+    one buffer every tick gets the new samples without any copying.
+    `dt_sec` and `lidar_geometry` come from the versioned header, and are
+    the defaults for messages without one.
+    """
+
+    __slots__ = [
+        "_buffer",
+        "_lidar",
+        "_offset",
+        "dt_sec",
+        "lidar_geometry",
+        "timestamp",
+        "recovery_x_error",
+        "wind_vector_x",
+        "wind_vector_y",
+        "recovery_y_error",
+    ]
+
+    def __init__(self):
+        self._buffer = None
+        self._lidar = None
+        self._offset = 0
+        self.dt_sec = DT_SEC
+        self.lidar_geometry = DEFAULT_LIDAR_GEOMETRY
+        self.timestamp = 0
+        self.recovery_x_error = 0
+        self.wind_vector_x = 0.0
+        self.wind_vector_y = 0.0
+        self.recovery_y_error = 0
+
+    @property
+    def buffer(self):
+        return self._buffer
+
+    @property
+    def lidar(self):
+        return self._lidar
+
+    def decode(self, buffer):
+        (dt_sec, geometry, offset) = telemetry_format(buffer)
+        if (
+            buffer is not self._buffer
+            or offset != self._offset
+            or geometry != self.lidar_geometry
+            or dt_sec != self.dt_sec
+        ):
+            self._buffer = buffer
+            self._offset = offset
+            self.dt_sec = dt_sec
+            self.lidar_geometry = geometry
+            self._lidar = np.frombuffer(
+                buffer, dtype=np.uint8, count=geometry.sample_count, offset=offset + LIDAR_OFFSET
+            )[::-1]
+        (
+            self.timestamp,
+            self.recovery_x_error,
+            self.wind_vector_x,
+            self.wind_vector_y,
+            self.recovery_y_error,
+        ) = TELEMETRY_HEADER_STRUCT.unpack_from(buffer, offset)
+        return self
+
+
+class TelemetryReader:
+    """Reads telemetry messages from a binary stream into one reusable buffer.
+
+    A versioned message is read header first, since the header says how
+    long the rest is. The buffer is only replaced when a message is a
+    different size than the one before it.
+    """
+
+    __slots__ = ["_stream", "_buffer", "_view"]
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._buffer = bytearray(TELEMETRY_STRUCT.size)
+        self._view = memoryview(self._buffer)
+
+    def _fill(self, start, end):
+        # Reads bytes start to end of the buffer, returning False if the stream ends first
+        while start < end:
+            count = self._stream.readinto(self._view[start:end])
+            if not count:
+                return False
+            start += count
+        return True
+
+    def read(self):
+        """Reads the next message, returning the (reused) buffer or None once the stream ends."""
+        filled = len(TELEMETRY_MAGIC)
+        if not self._fill(0, filled):
+            return None
+        size = TELEMETRY_STRUCT.size
+        if self._buffer[:filled] == TELEMETRY_MAGIC:
+            if not self._fill(filled, TELEMETRY_FORMAT_STRUCT.size):
+                return None
+            filled = TELEMETRY_FORMAT_STRUCT.size
+            (_, geometry, offset) = telemetry_format(self._buffer)
+            size = offset + LIDAR_OFFSET + geometry.sample_count
+        if size != len(self._buffer):
+            buffer = bytearray(size)
+            buffer[:filled] = self._buffer[:filled]
+            self._buffer = buffer
+            self._view = memoryview(buffer)
+        if not self._fill(filled, size):
+            return None
+        return self._buffer
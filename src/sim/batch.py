@@ -0,0 +1,225 @@
+"""Runs a pilot against many seeded simulations in parallel and reports per-seed and aggregate results.
+
+Usage:
+    python -m src.sim.batch --seeds 0 1000 --workers 8 --output results.csv python test_pilot.py
+    python -m src.sim.batch --seeds 0 1000 --workers 8 --in-process AUTO
+    python -m src.sim.batch --seeds 0 100 --in-process PLAN --export-traces traces/
+    python -m src.sim.batch --seeds 0 1000 --in-process PLAN --scenario scenarios/tree_wall.json
+    python -m src.sim.batch --seeds 0 100 --in-process AUTO --rate-hz 240 --lidar-step-deg 0.25
+"""
+import argparse
+import csv
+import multiprocessing
+import os
+import statistics
+import sys
+from collections import namedtuple
+
+from zip_sim import (
+    RECOVERED,
+    PARALANDED,
+    CRASHED,
+    SIM_QUIT,
+    Simulation,
+    InProcessPilot,
+    SubprocessPilot,
+    fly,
+)
+from .scenario import load_scenario
+from .trace import EpisodeTrace
+
+RESULT_NAMES = {
+    RECOVERED: "RECOVERED",
+    PARALANDED: "PARALANDED",
+    CRASHED: "CRASHED",
+    SIM_QUIT: "SIM_QUIT",
+}
+
+CSV_FIELDS = ["seed", "result", "result_name", "deliveries", "zipaa_violations"]
+
+SeedResult = namedtuple("SeedResult", ["seed", "result", "deliveries", "violations"])
+
+
+# ------Simulation Workers------------------------------------------------------
+# ------------------------------------------------------------------------------
+# ------------------------------------------------------------------------------
+def run_seed(job):
+    """Flies one headless simulation inside the worker and returns its SeedResult.
+
+    Exactly one of pilot_id (run in process) or pilot_command (run as a child process) is set. If trace_dir is set,
+    the flight's EpisodeTrace is saved there as seed_<seed>.npz. If a Scenario is given, its world is flown with the
+    seed only driving the wind. rate_hz and lidar_step_deg are passed on to the Simulation."""
+    seed, pilot_id, pilot_command, trace_dir, scenario, rate_hz, lidar_step_deg = job
+    sim = Simulation(rate_hz=rate_hz, lidar_step_deg=lidar_step_deg)
+    if pilot_id is not None:
+        pilot = InProcessPilot(pilot_id)
+    else:
+        pilot = SubprocessPilot(pilot_command)
+    trace = EpisodeTrace(sim.dt_sec) if trace_dir is not None else None
+    try:
+        score = fly(sim, pilot, seed, trace, scenario)
+    finally:
+        pilot.close()
+    if trace is not None:
+        trace.save(os.path.join(trace_dir, "seed_{}.npz".format(seed)), seed, score)
+    return SeedResult(seed, score.result, score.deliveries, score.violations)
+
+
+def run_batch(
+    seeds,
+    pilot_id=None,
+    pilot_command=None,
+    workers=None,
+    trace_dir=None,
+    scenario=None,
+    rate_hz=None,
+    lidar_step_deg=None,
+):
+    """Runs every seed across a process pool and returns the results sorted by seed."""
+    if trace_dir is not None:
+        os.makedirs(trace_dir, exist_ok=True)
+    jobs = [
+        (seed, pilot_id, pilot_command, trace_dir, scenario, rate_hz, lidar_step_deg)
+        for seed in seeds
+    ]
+    with multiprocessing.Pool(workers) as pool:
+        results = list(pool.imap_unordered(run_seed, jobs, chunksize=4))
+    results.sort(key=lambda r: r.seed)
+    return results
+
+
+# ------Reporting---------------------------------------------------------------
+# ------------------------------------------------------------------------------
+# ------------------------------------------------------------------------------
+def write_results(results, path):
+    with open(path, "w", newline="") as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(CSV_FIELDS)
+        for r in results:
+            writer.writerow(
+                [
+                    r.seed,
+                    r.result,
+                    RESULT_NAMES[r.result],
+                    r.deliveries,
+                    r.violations,
+                ]
+            )
+
+
+def summarize(results):
+    """Returns aggregate statistics over a list of SeedResults as a dict."""
+    deliveries = [r.deliveries for r in results]
+    violations = [r.violations for r in results]
+    counts = {name: 0 for name in RESULT_NAMES.values()}
+    for r in results:
+        counts[RESULT_NAMES[r.result]] += 1
+    return {
+        "runs": len(results),
+        "results": counts,
+        "deliveries_mean": statistics.mean(deliveries) if deliveries else 0.0,
+        "deliveries_stdev": statistics.pstdev(deliveries) if deliveries else 0.0,
+        "deliveries_min": min(deliveries, default=0),
+        "deliveries_max": max(deliveries, default=0),
+        "violations_total": sum(violations),
+        "runs_with_violations": sum(1 for v in violations if v > 0),
+    }
+
+
+def print_summary(summary):
+    runs = summary["runs"]
+    print("Runs: {}".format(runs))
+    for name, count in summary["results"].items():
+        if count:
+            print("  {:<10} {:>6} ({:.1%})".format(name, count, count / runs))
+    print(
+        "Deliveries: mean {:.2f} stdev {:.2f} min {} max {}".format(
+            summary["deliveries_mean"],
+            summary["deliveries_stdev"],
+            summary["deliveries_min"],
+            summary["deliveries_max"],
+        )
+    )
+    print(
+        "ZIPAA Violations: {} total in {} runs".format(
+            summary["violations_total"], summary["runs_with_violations"]
+        )
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Batch Monte Carlo runner for the Zip Sim")
+    parser.add_argument(
+        "pilot", nargs=argparse.REMAINDER, help="A pilot process to run"
+    )
+    parser.add_argument(
+        "--seeds",
+        type=int,
+        nargs=2,
+        metavar=("START", "STOP"),
+        default=(0, 100),
+        help="Half-open range of seeds to simulate",
+    )
+    parser.add_argument(
+        "--in-process",
+        metavar="PILOT_ID",
+        help="Run a pilot from PilotDirector inside each simulation instead of as a process",
+    )
+    parser.add_argument(
+        "--workers", type=int, help="Number of worker processes (default: CPU count)"
+    )
+    parser.add_argument(
+        "--output", default="batch_results.csv", help="CSV file for per-seed results"
+    )
+    parser.add_argument(
+        "--scenario",
+        metavar="FILE",
+        help="Fly every seed in the world from a scenario file, with the seeds only varying the wind",
+    )
+    parser.add_argument(
+        "--export-traces",
+        metavar="DIR",
+        help="Save a per-tick .npz trace of every flight to DIR (see src.sim.trace). The pilot state is only "
+        "recorded for --in-process pilots",
+    )
+    parser.add_argument(
+        "--rate-hz", type=float, help="Tick rate of every simulation (see zip_sim.py --rate-hz)"
+    )
+    parser.add_argument(
+        "--lidar-step-deg",
+        type=float,
+        help="Angle between lidar rays in every simulation (see zip_sim.py --lidar-step-deg)",
+    )
+    args = parser.parse_args()
+
+    if bool(args.pilot) == bool(args.in_process):
+        parser.error("exactly one of a pilot process or --in-process is required")
+    scenario = None
+    if args.scenario:
+        try:
+            (scenario, _) = load_scenario(args.scenario)
+        except (OSError, ValueError) as e:
+            parser.error(str(e))
+    if args.rate_hz is not None and args.rate_hz <= 0:
+        parser.error("--rate-hz must be positive")
+    try:
+        # Checked up front rather than failing in every worker
+        Simulation(rate_hz=args.rate_hz, lidar_step_deg=args.lidar_step_deg)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.export_traces and not args.in_process:
+        sys.stderr.write("--export-traces only records the pilot state of --in-process pilots, it will be -1\n")
+
+    results = run_batch(
+        range(*args.seeds),
+        args.in_process,
+        args.pilot or None,
+        args.workers,
+        args.export_traces,
+        scenario,
+        args.rate_hz,
+        args.lidar_step_deg,
+    )
+    write_results(results, args.output)
+    print_summary(summarize(results))
@@ -0,0 +1,351 @@
+"""Benchmarks for the simulator and pilot hot paths.
+
+Each case reports per-call latency percentiles and calls (or ticks) per second. Results can be saved as a baseline
+and compared against later runs.
+
+Usage:
+    python -m src.sim.benchmark                              # run everything
+    python -m src.sim.benchmark --only lidar controller      # run cases whose names start with these
+    python -m src.sim.benchmark --only episode.AUTO          # how AUTO scales to faster ticks and finer lidars
+    python -m src.sim.benchmark --save baseline.json         # keep a baseline
+    python -m src.sim.benchmark --compare baseline.json      # compare against it
+"""
+import argparse
+import json
+import random
+import sys
+import time
+
+import numpy as np
+
+from zip_sim import (
+    WORLD_LENGTH,
+    WORLD_WIDTH,
+    NUM_DELIVERY_SITES,
+    DELIVERY_SITE_X_BOUNDS,
+    DELIVERY_SITE_Y_BOUNDS,
+    TREE_X_BOUNDS,
+    TREE_LIDAR_RADIUS,
+    TELEMETRY_STRUCT,
+    COMMAND_STRUCT,
+    Circle,
+    LidarIndex,
+    Simulation,
+    InProcessPilot,
+    RandomCandidates,
+    FastCandidates,
+    cast_lidar,
+    lidar_angles,
+    lidar_geometry,
+    lidar_rays,
+    place_delivery_sites,
+    place_trees,
+)
+from src.pilots.controllers.controller_components import (
+    Detector,
+    segment_obstacles,
+)
+from src.pilots.controllers.controller_creator import AutoControlCreator
+from src.pilots.serial_protocol import CHECK_FUNCTIONS, FrameCodec, FrameParser
+from .profiling import latency_stats, format_stats
+
+# Tree counts to benchmark the lidar with. The default world has up to 100.
+LIDAR_TREE_COUNTS = (0, 20, 100, 500, 2000)
+
+# Tree counts to benchmark world generation with, from a typical world to a stress scenario.
+WORLDGEN_TREE_COUNTS = (20, 100, 2000)
+
+# Pilots to fly full episodes with. Ones that can't be created here (e.g. no board or keyboard access) are skipped.
+EPISODE_PILOTS = ("AUTO", "PLAN", "UNO_SIM", "MANUAL")
+
+# (tick rate, lidar step) the AUTO and PLAN pilots are also flown at, to see how the per-tick cost scales.
+SCALED_EPISODES = ((120.0, 0.5), (240.0, 0.25))
+
+SCALED_EPISODE_PILOTS = ("AUTO", "PLAN")
+
+# Tree count the lidar is benchmarked with at the finer steps of SCALED_EPISODES.
+SCALED_LIDAR_TREE_COUNT = 100
+
+# Seed used for every randomized input, so runs are comparable.
+BENCHMARK_SEED = 0
+
+# A case is reported as a regression if its p50 latency grows by more than this fraction over the baseline.
+DEFAULT_TOLERANCE = 0.2
+
+
+# ------Measurement-------------------------------------------------------------
+# ------------------------------------------------------------------------------
+# ------------------------------------------------------------------------------
+def time_calls(fn, inputs):
+    """Calls fn once per input and returns the latency of each call in nanoseconds."""
+    clock = time.perf_counter_ns
+    latencies = []
+    for args in inputs:
+        start = clock()
+        fn(*args)
+        latencies.append(clock() - start)
+    return latencies
+
+
+def record_telemetry(seed=BENCHMARK_SEED, max_ticks=None):
+    """Flies the AUTO pilot through a seeded world and returns every telemetry message it was sent."""
+    sim = Simulation()
+    pilot = InProcessPilot("AUTO")
+    frames = []
+    telemetry = sim.reset(seed)
+    while telemetry is not None and (max_ticks is None or len(frames) < max_ticks):
+        frames.append(telemetry)
+        (lateral_airspeed, drop, _) = COMMAND_STRUCT.unpack(pilot.exchange(telemetry))
+        telemetry = sim.step(lateral_airspeed, bool(drop))
+    return frames
+
+
+def lidar_medians(frames):
+    """Returns the per-tick median lidar samples a Detector works from for recorded telemetry."""
+    detector = Detector()
+    medians = []
+    for frame in frames:
+        detector.lidar_samples = list(TELEMETRY_STRUCT.unpack(frame)[5:])[::-1]
+        medians.append(list(detector.median_samples))
+    return medians
+
+
+# ------Benchmark Cases---------------------------------------------------------
+# ------------------------------------------------------------------------------
+# ------------------------------------------------------------------------------
+def bench_lidar(iterations):
+    rng = random.Random(BENCHMARK_SEED)
+    for num_trees in LIDAR_TREE_COUNTS:
+        trees = LidarIndex(
+            Circle(
+                (rng.uniform(*TREE_X_BOUNDS), rng.uniform(0, WORLD_WIDTH)),
+                TREE_LIDAR_RADIUS,
+            )
+            for _ in range(num_trees)
+        )
+        positions = [
+            ((rng.uniform(0, WORLD_LENGTH), rng.uniform(0, WORLD_WIDTH)), trees)
+            for _ in range(iterations)
+        ]
+        yield "lidar.cast_lidar[trees={}]".format(num_trees), time_calls(
+            cast_lidar, positions
+        )
+        if num_trees == SCALED_LIDAR_TREE_COUNT:
+            for (_, step_deg) in SCALED_EPISODES:
+                rays = lidar_rays(lidar_angles(lidar_geometry(step_deg)))
+                yield "lidar.cast_lidar[trees={},step={:g}]".format(num_trees, step_deg), time_calls(
+                    cast_lidar, [position + (rays,) for position in positions]
+                )
+
+
+def bench_worldgen(iterations):
+    def exact_candidates(rng):
+        return (
+            RandomCandidates(rng, DELIVERY_SITE_X_BOUNDS, DELIVERY_SITE_Y_BOUNDS, wrap=True),
+            RandomCandidates(rng, TREE_X_BOUNDS, (0, WORLD_WIDTH), wrap=False),
+        )
+
+    def fast_candidates(rng):
+        generator = np.random.default_rng(rng.getrandbits(64))
+        return (
+            FastCandidates(generator, DELIVERY_SITE_X_BOUNDS, DELIVERY_SITE_Y_BOUNDS, wrap=True),
+            FastCandidates(generator, TREE_X_BOUNDS, (0, WORLD_WIDTH), wrap=False),
+        )
+
+    def generate(make_candidates, seed, num_trees):
+        (site_candidates, tree_candidates) = make_candidates(random.Random(seed))
+        delivery_sites = place_delivery_sites(site_candidates, NUM_DELIVERY_SITES)
+        place_trees(tree_candidates, num_trees, delivery_sites)
+
+    for num_trees in WORLDGEN_TREE_COUNTS:
+        # Fewer worlds for the big ones, which take far longer than a tick each.
+        count = max(10, iterations * 20 // (num_trees + 20))
+        for mode, make_candidates in (("exact", exact_candidates), ("fast", fast_candidates)):
+            yield "worldgen.{}[trees={}]".format(mode, num_trees), time_calls(
+                generate,
+                [(make_candidates, BENCHMARK_SEED + i, num_trees) for i in range(count)],
+            )
+
+
+def bench_episodes():
+    """Yields the per-tick latencies of full episodes along with each one's real-time budget in milliseconds."""
+    configs = [(pilot_id, None, None) for pilot_id in EPISODE_PILOTS] + [
+        (pilot_id, rate_hz, step_deg)
+        for (rate_hz, step_deg) in SCALED_EPISODES
+        for pilot_id in SCALED_EPISODE_PILOTS
+    ]
+    for (pilot_id, rate_hz, step_deg) in configs:
+        name = "episode.{}".format(pilot_id)
+        if rate_hz is not None:
+            name += "[{:g}Hz,{:g}deg]".format(rate_hz, step_deg)
+        try:
+            pilot = InProcessPilot(pilot_id)
+        except Exception as e:
+            sys.stderr.write("Skipping {}: {}\n".format(name, e))
+            continue
+        sim = Simulation(rate_hz=rate_hz, lidar_step_deg=step_deg)
+        clock = time.perf_counter_ns
+        latencies = []
+        telemetry = sim.reset(BENCHMARK_SEED)
+        try:
+            while telemetry is not None:
+                start = clock()
+                cmd = pilot.exchange(telemetry)
+                if cmd is None:
+                    break
+                (lateral_airspeed, drop, _) = COMMAND_STRUCT.unpack(cmd)
+                telemetry = sim.step(lateral_airspeed, bool(drop))
+                latencies.append(clock() - start)
+        finally:
+            pilot.close()
+        if not latencies:
+            sys.stderr.write("Skipping {}: pilot failed\n".format(name))
+            continue
+        yield name, latencies, sim.dt_sec * 1e3
+
+
+def bench_controller(frames):
+    detector = Detector()
+    samples = [(list(TELEMETRY_STRUCT.unpack(f)[5:])[::-1],) for f in frames]
+
+    def set_samples(value):
+        detector.lidar_samples = value
+
+    yield "controller.Detector.lidar_samples", time_calls(set_samples, samples)
+
+    yield "controller.Detector.interpret_lidar", time_calls(
+        detector.interpret_lidar, [()] * len(frames)
+    )
+
+    medians = [(m,) for m in lidar_medians(frames)]
+
+    yield "controller.segment_obstacles", time_calls(segment_obstacles, medians)
+
+    controller = AutoControlCreator.create_controller("AUTO")
+    yield "controller.AutoController1.receive_data", time_calls(
+        controller.receive_data, [(f,) for f in frames]
+    )
+
+
+def bench_structs(frames):
+    def telemetry_round_trip(frame):
+        TELEMETRY_STRUCT.pack(*TELEMETRY_STRUCT.unpack(frame))
+
+    yield "struct.telemetry_round_trip", time_calls(
+        telemetry_round_trip, [(f,) for f in frames]
+    )
+
+    commands = [(COMMAND_STRUCT.pack(1.5, 1, b"zip"),)] * len(frames)
+
+    def command_round_trip(cmd):
+        COMMAND_STRUCT.pack(*COMMAND_STRUCT.unpack(cmd))
+
+    yield "struct.command_round_trip", time_calls(command_round_trip, commands)
+
+
+def bench_serial(frames):
+    for check in CHECK_FUNCTIONS:
+        codec = FrameCodec(check)
+        yield "serial.encode[{}]".format(check), time_calls(codec.encode, [(f,) for f in frames])
+
+        parser = FrameParser(TELEMETRY_STRUCT.size, check)
+        encoded = [(bytes(codec.encode(f)),) for f in frames]
+        yield "serial.parse[{}]".format(check), time_calls(parser.feed, encoded)
+
+
+def run_benchmarks(only=None, iterations=2000):
+    """Runs every benchmark case whose name starts with one of the prefixes in only, and returns their stats."""
+    frames = record_telemetry(max_ticks=iterations)
+    groups = [
+        ("lidar.", lambda: bench_lidar(iterations)),
+        ("worldgen.", lambda: bench_worldgen(iterations)),
+        ("controller.", lambda: bench_controller(frames)),
+        ("struct.", lambda: bench_structs(frames)),
+        ("serial.", lambda: bench_serial(frames)),
+        ("episode.", lambda: bench_episodes()),
+    ]
+    results = {}
+    for group, cases in groups:
+        if only and not any(p.startswith(group) or group.startswith(p) for p in only):
+            continue
+        # Episode cases also give their real-time budget per tick
+        for name, latencies, *budget in cases():
+            if only and not any(name.startswith(p) for p in only):
+                continue
+            stats = latency_stats(latencies)
+            total_sec = sum(latencies) * 1e-9
+            stats["per_sec"] = stats["count"] / total_sec if total_sec else 0.0
+            if budget:
+                stats["budget_ms"] = budget[0]
+                stats["over_budget"] = sum(
+                    1 for l in latencies if l * 1e-6 > stats["budget_ms"]
+                )
+            results[name] = stats
+            print_result(name, stats)
+    return results
+
+
+# ------Reporting---------------------------------------------------------------
+# ------------------------------------------------------------------------------
+# ------------------------------------------------------------------------------
+def print_result(name, stats):
+    print("{:<45} {:>12.1f}/s  {}".format(name, stats["per_sec"], format_stats(stats)))
+    if "over_budget" in stats:
+        print(
+            "{:<45} {} of {} ticks over the {:.1f}ms real-time budget".format(
+                "", stats["over_budget"], stats["count"], stats["budget_ms"]
+            )
+        )
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Prints each case's p50 latency against the baseline and returns the names of cases that regressed."""
+    regressions = []
+    print()
+    print("Compared to baseline (p50 latency):")
+    for name, stats in results.items():
+        if name not in baseline or not stats["count"]:
+            continue
+        before = baseline[name]["p50_ms"]
+        after = stats["p50_ms"]
+        ratio = after / before if before else float("inf")
+        regressed = ratio > 1.0 + tolerance
+        if regressed:
+            regressions.append(name)
+        print(
+            "{:<45} {:>10.4f}ms -> {:>10.4f}ms  x{:.2f}{}".format(
+                name, before, after, ratio, "  REGRESSION" if regressed else ""
+            )
+        )
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Zip Sim and pilot benchmarks")
+    parser.add_argument(
+        "--only", nargs="+", metavar="PREFIX", help="Only run cases starting with these"
+    )
+    parser.add_argument(
+        "--iterations", type=int, default=2000, help="Calls per micro benchmark"
+    )
+    parser.add_argument("--save", metavar="FILE", help="Save results as a baseline")
+    parser.add_argument("--compare", metavar="FILE", help="Compare to a saved baseline")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=DEFAULT_TOLERANCE,
+        help="Allowed p50 slowdown before a case counts as a regression",
+    )
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.only, args.iterations)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
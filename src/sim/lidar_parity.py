@@ -0,0 +1,110 @@
+"""Checks that the batched lidar gives exactly the samples of the one-ray-at-a-time cast_lidar_ray.
+
+Every seed draws a handful of random circle sets in the vehicle's frame,
+with circles out of reach, wrapping around the world's width and
+occasionally around the vehicle itself, and casts them at the default
+lidar and at the finer lidars of --lidar-step-deg. Each set is cast on its
+own and all of a seed's sets at once as one padded batch. Any sample that
+differs from cast_lidar_ray is reported.
+
+Usage:
+    python -m src.sim.lidar_parity --seeds 0 200
+"""
+import argparse
+import sys
+
+import numpy as np
+
+from zip_sim import (
+    DELIVERY_SITE_LIDAR_RADIUS,
+    LIDAR_MAX_DISTANCE,
+    TREE_LIDAR_RADIUS,
+    WORLD_WIDTH,
+    cast_lidar_ray,
+    cast_lidar_rays,
+    lidar_angles,
+    lidar_geometry,
+    lidar_rays,
+)
+
+# Angle steps to check besides the default lidar's, as given to --lidar-step-deg
+STEPS_DEG = (1.0, 0.5, 0.25)
+
+SCANS_PER_SEED = 8
+
+MAX_CIRCLES = 40
+
+# A circle that never reflects anything, to pad a scan's circles to the batch's size
+PADDING_CIRCLE = (1.0, 0.0, 0.0)
+
+MAX_REPORTED_MISMATCHES = 10
+
+
+def random_circles(rng):
+    """Returns an (N, 3) array of random (x, y, radius) circles in the vehicle's frame."""
+    count = rng.integers(0, MAX_CIRCLES + 1)
+    x = rng.uniform(-20.0, LIDAR_MAX_DISTANCE + 20.0, count)
+    # Some circles lie outside the width the simulation shifts them into, so rays have to wrap to reach them.
+    y = rng.uniform(-WORLD_WIDTH, WORLD_WIDTH, count)
+    radius = rng.choice([TREE_LIDAR_RADIUS, DELIVERY_SITE_LIDAR_RADIUS], count)
+    odd = rng.random(count) < 0.3
+    radius[odd] = rng.uniform(0.1, 8.0, odd.sum())
+    circles = np.column_stack([x, y, radius])
+    if count and rng.random() < 0.1:
+        # The vehicle is inside this one, which blinds the whole scan.
+        circles[rng.integers(count)] = (rng.uniform(-1.0, 1.0), rng.uniform(-1.0, 1.0), 2.0)
+    return circles
+
+
+def expected_samples(circles, angles):
+    return [cast_lidar_ray(angle, circles.tolist()) for angle in angles]
+
+
+def check_seed(seed):
+    """Returns a list of (step_deg, scan index, expected samples, batched samples) for every scan that differed."""
+    rng = np.random.default_rng(seed)
+    scans = [random_circles(rng) for _ in range(SCANS_PER_SEED)]
+    size = max(len(circles) for circles in scans)
+    padded = np.array(
+        [np.vstack([circles, np.tile(PADDING_CIRCLE, (size - len(circles), 1))]) for circles in scans]
+    )
+    mismatches = []
+    for step_deg in STEPS_DEG:
+        angles = lidar_angles(lidar_geometry(step_deg))
+        # The default lidar is also cast without rays, the way the simulation casts it.
+        rays = None if step_deg == 1.0 else lidar_rays(angles)
+        batched = cast_lidar_rays(padded, rays)
+        for idx, circles in enumerate(scans):
+            expected = expected_samples(circles, angles)
+            for samples in (cast_lidar_rays(circles, rays), batched[idx]):
+                if samples.tolist() != expected:
+                    mismatches.append((step_deg, idx, expected, samples.tolist()))
+    return mismatches
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check the batched lidar against cast_lidar_ray")
+    parser.add_argument(
+        "--seeds",
+        type=int,
+        nargs=2,
+        metavar=("START", "STOP"),
+        default=(0, 200),
+        help="Half-open range of seeds to draw circle sets from",
+    )
+    args = parser.parse_args(argv)
+
+    mismatches = 0
+    for seed in range(*args.seeds):
+        for (step_deg, idx, expected, samples) in check_seed(seed):
+            mismatches += 1
+            if mismatches <= MAX_REPORTED_MISMATCHES:
+                print("seed {} scan {} step {}:".format(seed, idx, step_deg))
+                print("  cast_lidar_ray  {}".format(expected))
+                print("  cast_lidar_rays {}".format(samples))
+    print("{} mismatching scans over seeds {} to {}".format(mismatches, *args.seeds))
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
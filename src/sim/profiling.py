@@ -0,0 +1,113 @@
+"""Helpers for measuring and summarizing latencies in the simulator and pilots."""
+import csv
+import sys
+import time
+
+import numpy as np
+
+PERCENTILES = (50, 95, 99)
+
+# The pilot's first answer includes its own startup, so deadlines aren't enforced until after this many ticks.
+DEADLINE_GRACE_TICKS = 1
+
+
+def latency_stats(samples_ns):
+    """Summarizes a sequence of latencies in nanoseconds as a dict of milliseconds.
+
+    Returns the count, mean, p50/p95/p99 and max."""
+    samples = np.asarray(samples_ns, dtype=float) * 1e-6
+    if samples.size == 0:
+        return {"count": 0}
+    stats = {"count": int(samples.size), "mean_ms": float(samples.mean())}
+    for p, value in zip(PERCENTILES, np.percentile(samples, PERCENTILES)):
+        stats["p{}_ms".format(p)] = float(value)
+    stats["max_ms"] = float(samples.max())
+    return stats
+
+
+def format_stats(stats):
+    """Formats latency stats from latency_stats() on one line."""
+    if not stats["count"]:
+        return "no samples"
+    return (
+        "n={count} mean={mean_ms:.4f}ms p50={p50_ms:.4f}ms p95={p95_ms:.4f}ms "
+        "p99={p99_ms:.4f}ms max={max_ms:.4f}ms"
+    ).format(**stats)
+
+
+class TickProfiler:
+    """Times the phases of every simulation tick.
+
+    Call start_tick() at the top of each tick, then lap(phase) after each phase finishes. Each lap is timed from the
+    end of the one before it. If a deadline is set, a pilot lap that takes longer counts as a missed deadline."""
+
+    PHASES = ("pilot", "physics", "lidar", "render")
+
+    __slots__ = ["deadline_ms", "deadline_misses", "_samples", "_last"]
+
+    def __init__(self, deadline_ms=None):
+        self.deadline_ms = deadline_ms
+        self.deadline_misses = 0
+        self._samples = {phase: [] for phase in self.PHASES}
+        self._last = None
+
+    @property
+    def ticks(self):
+        return len(self._samples["pilot"])
+
+    @property
+    def deadline_active(self):
+        """Whether the deadline applies to the current tick."""
+        return self.deadline_ms is not None and self.ticks > DEADLINE_GRACE_TICKS
+
+    def start_tick(self):
+        for samples in self._samples.values():
+            samples.append(None)
+        self._last = time.perf_counter_ns()
+
+    def lap(self, phase):
+        """Records the time since the last lap for a phase. Returns True if it was a pilot lap that missed the
+        deadline."""
+        now = time.perf_counter_ns()
+        elapsed = now - self._last
+        self._last = now
+        self._samples[phase][-1] = elapsed
+        if (
+            phase == "pilot"
+            and self.deadline_active
+            and elapsed * 1e-6 > self.deadline_ms
+        ):
+            self.deadline_misses += 1
+            return True
+        return False
+
+    def stats(self):
+        """Returns latency_stats() for every phase that was timed."""
+        return {
+            phase: latency_stats([s for s in samples if s is not None])
+            for phase, samples in self._samples.items()
+            if any(s is not None for s in samples)
+        }
+
+    def print_report(self, file=sys.stderr):
+        """Prints the timings of every phase, to stderr by default so they stay out of a run's --json summary."""
+        print("Tick timings over {} ticks:".format(self.ticks), file=file)
+        for phase, stats in self.stats().items():
+            print("  {:<8} {}".format(phase, format_stats(stats)), file=file)
+        if self.deadline_ms is not None:
+            print(
+                "Deadline misses: {} of {} ticks over {}ms".format(
+                    self.deadline_misses, self.ticks, self.deadline_ms
+                ),
+                file=file,
+            )
+
+    def write_trace(self, path):
+        """Writes one row per tick with each phase's time in milliseconds. Phases that didn't run are left empty."""
+        with open(path, "w", newline="") as trace_file:
+            writer = csv.writer(trace_file)
+            writer.writerow(["tick"] + ["{}_ms".format(p) for p in self.PHASES])
+            for tick, row in enumerate(zip(*(self._samples[p] for p in self.PHASES))):
+                writer.writerow(
+                    [tick] + ["" if s is None else "{:.6f}".format(s * 1e-6) for s in row]
+                )
@@ -0,0 +1,127 @@
+"""Binary flight logs of the telemetry a pilot was sent and the commands it answered with.
+
+A log is a header followed by one record per tick, each record being the
+packed TELEMETRY_STRUCT message and the COMMAND_STRUCT reply to it:
+
+    header: magic b"ZREC", format version, seed, tick count (big-endian)
+    record: telemetry (44 bytes) + command (8 bytes)
+
+The tick count is filled in when the recorder is closed.
+"""
+import mmap
+import struct
+
+import numpy as np
+
+from zip_sim import TELEMETRY_STRUCT, COMMAND_STRUCT
+
+LOG_MAGIC = b"ZREC"
+
+LOG_VERSION = 1
+
+LOG_HEADER_STRUCT = struct.Struct(">4sHqI")
+
+# Offset of the tick count within the header, rewritten on close.
+LOG_TICKS_OFFSET = LOG_HEADER_STRUCT.size - 4
+
+RECORD_SIZE = TELEMETRY_STRUCT.size + COMMAND_STRUCT.size
+
+RECORD_DTYPE = np.dtype(
+    [("telemetry", "V{}".format(TELEMETRY_STRUCT.size)), ("command", "V{}".format(COMMAND_STRUCT.size))]
+)
+
+
+class FlightRecorder:
+    """Appends telemetry and command frames to a flight log."""
+
+    __slots__ = ["_file", "ticks"]
+
+    def __init__(self, path, seed):
+        self._file = open(path, "wb")
+        self.ticks = 0
+        self._file.write(LOG_HEADER_STRUCT.pack(LOG_MAGIC, LOG_VERSION, seed, 0))
+
+    def record(self, telemetry, command):
+        self._file.write(telemetry)
+        self._file.write(command)
+        self.ticks += 1
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._file.seek(LOG_TICKS_OFFSET)
+        self._file.write(struct.pack(">I", self.ticks))
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class FlightLog:
+    """A memory-mapped flight log.
+
+    Records are read straight out of the mapping; `records` is a numpy
+    view of them with "telemetry" and "command" fields, and telemetry() and
+    command() return memoryviews of a single tick's frames.
+    """
+
+    __slots__ = ["_file", "_map", "seed", "ticks", "records"]
+
+    def __init__(self, path):
+        self._file = open(path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError("{} is empty, not a flight log".format(path))
+        if len(self._map) < LOG_HEADER_STRUCT.size:
+            self.close()
+            raise ValueError("{} is too short to be a flight log".format(path))
+        (magic, version, self.seed, self.ticks) = LOG_HEADER_STRUCT.unpack_from(self._map)
+        if magic != LOG_MAGIC:
+            self.close()
+            raise ValueError("{} is not a flight log".format(path))
+        if version != LOG_VERSION:
+            self.close()
+            raise ValueError(
+                "{} is a version {} flight log, expected version {}".format(
+                    path, version, LOG_VERSION
+                )
+            )
+        # A log whose recorder never closed still holds every complete record.
+        available = (len(self._map) - LOG_HEADER_STRUCT.size) // RECORD_SIZE
+        if self.ticks == 0 or self.ticks > available:
+            self.ticks = available
+        self.records = np.frombuffer(
+            self._map, dtype=RECORD_DTYPE, count=self.ticks, offset=LOG_HEADER_STRUCT.size
+        )
+
+    def telemetry(self, tick):
+        start = LOG_HEADER_STRUCT.size + tick * RECORD_SIZE
+        return memoryview(self._map)[start : start + TELEMETRY_STRUCT.size]
+
+    def command(self, tick):
+        start = LOG_HEADER_STRUCT.size + tick * RECORD_SIZE + TELEMETRY_STRUCT.size
+        return memoryview(self._map)[start : start + COMMAND_STRUCT.size]
+
+    def commands(self):
+        """Returns the recorded lateral airspeeds and drop flags as arrays."""
+        commands = np.frombuffer(
+            self.records["command"].tobytes(),
+            dtype=[("lateral_airspeed", ">f4"), ("drop", "u1"), ("padding", "V3")],
+        )
+        return (commands["lateral_airspeed"].astype(float), commands["drop"].astype(bool))
+
+    def close(self):
+        self.records = None
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
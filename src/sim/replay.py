@@ -0,0 +1,158 @@
+"""Replays recorded flights through a pilot and diffs its commands against the recording.
+
+The recorded telemetry is fed to the pilot as fast as it can answer, with
+no simulation in the loop, so a controller change can be checked against
+many recorded flights in a fraction of their flight time. Once a pilot's
+commands diverge the rest of the flight is open-loop, so the first
+difference is the one to look at.
+
+Usage:
+    python zip_sim.py --headless --seed 3 --record flight3.zrec python test_pilot.py
+    python -m src.sim.replay --in-process AUTO flight3.zrec
+"""
+import argparse
+import sys
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from zip_sim import TELEMETRY_STRUCT, COMMAND_STRUCT, InProcessPilot
+from .recording import FlightLog
+
+ReplayResult = namedtuple(
+    "ReplayResult", ["path", "ticks", "diffs", "first_diff", "max_airspeed_diff", "elapsed_sec"]
+)
+
+# Replayed airspeeds may differ from the recording by this much before a tick counts as a difference.
+DEFAULT_TOLERANCE = 0.0
+
+MAX_REPORTED_DIFFS = 10
+
+
+# ------Replay------------------------------------------------------------------
+# ------------------------------------------------------------------------------
+# ------------------------------------------------------------------------------
+def replay(log, pilot):
+    """Feeds every recorded telemetry frame to the pilot and returns its replies as arrays.
+
+    Returns (lateral_airspeeds, drops, answered), where answered is False
+    for ticks the pilot gave no valid command for."""
+    ticks = log.ticks
+    lateral_airspeeds = np.zeros(ticks)
+    drops = np.zeros(ticks, dtype=bool)
+    answered = np.zeros(ticks, dtype=bool)
+    # each frame is copied into one buffer, so no view into the mapped log outlives the replay
+    telemetry = bytearray(TELEMETRY_STRUCT.size)
+    for tick in range(ticks):
+        telemetry[:] = log.telemetry(tick)
+        cmd = pilot.exchange(telemetry)
+        if cmd is None or len(cmd) != COMMAND_STRUCT.size:
+            continue
+        (lateral_airspeeds[tick], drop, _) = COMMAND_STRUCT.unpack(cmd)
+        drops[tick] = bool(drop)
+        answered[tick] = True
+    return (lateral_airspeeds, drops, answered)
+
+
+def diff_commands(recorded, replayed, tolerance=DEFAULT_TOLERANCE):
+    """Returns the ticks whose replayed command differs from the recorded one."""
+    (recorded_airspeeds, recorded_drops) = recorded
+    (airspeeds, drops, answered) = replayed
+    differs = (
+        ~answered
+        | (np.abs(airspeeds - recorded_airspeeds) > tolerance)
+        | (drops != recorded_drops)
+    )
+    return np.flatnonzero(differs)
+
+
+def replay_log(path, pilot_id, tolerance=DEFAULT_TOLERANCE):
+    """Replays one log through a fresh pilot, returning (ReplayResult, recorded, replayed) commands."""
+    with FlightLog(path) as log:
+        recorded = log.commands()
+        pilot = InProcessPilot(pilot_id)
+        start = time.perf_counter()
+        try:
+            replayed = replay(log, pilot)
+        finally:
+            pilot.close()
+        elapsed = time.perf_counter() - start
+        diffs = diff_commands(recorded, replayed, tolerance)
+        answered = replayed[2]
+        airspeed_diffs = np.abs(replayed[0] - recorded[0])[answered]
+        result = ReplayResult(
+            path,
+            log.ticks,
+            diffs,
+            int(diffs[0]) if diffs.size else None,
+            float(airspeed_diffs.max()) if airspeed_diffs.size else 0.0,
+            elapsed,
+        )
+        return (result, recorded, replayed)
+
+
+# ------Reporting---------------------------------------------------------------
+# ------------------------------------------------------------------------------
+# ------------------------------------------------------------------------------
+def print_result(result, recorded, replayed, max_reported=MAX_REPORTED_DIFFS):
+    print(
+        "{}: {} ticks replayed in {:.2f}s ({:.0f} ticks/s), {} differing, max airspeed diff {:.6g}".format(
+            result.path,
+            result.ticks,
+            result.elapsed_sec,
+            result.ticks / result.elapsed_sec if result.elapsed_sec else 0.0,
+            len(result.diffs),
+            result.max_airspeed_diff,
+        )
+    )
+    for tick in result.diffs[:max_reported].tolist():
+        replayed_cmd = (
+            "{:.6g} drop={}".format(replayed[0][tick], int(replayed[1][tick]))
+            if replayed[2][tick]
+            else "no command"
+        )
+        print(
+            "  tick {}: recorded {:.6g} drop={}, replayed {}".format(
+                tick, recorded[0][tick], int(recorded[1][tick]), replayed_cmd
+            )
+        )
+    if len(result.diffs) > max_reported:
+        print("  ... {} more".format(len(result.diffs) - max_reported))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Replay recorded flights through a pilot and diff its commands"
+    )
+    parser.add_argument("logs", nargs="+", help="Flight logs written with zip_sim.py --record")
+    parser.add_argument(
+        "--in-process",
+        metavar="PILOT_ID",
+        default="AUTO",
+        help="Pilot from PilotDirector to replay through (default AUTO)",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=DEFAULT_TOLERANCE,
+        help="Largest lateral airspeed difference that still counts as a match",
+    )
+    args = parser.parse_args(argv)
+
+    differing = 0
+    for path in args.logs:
+        try:
+            (result, recorded, replayed) = replay_log(path, args.in_process, args.tolerance)
+        except (OSError, ValueError) as e:
+            sys.stderr.write("{}\n".format(e))
+            differing += 1
+            continue
+        print_result(result, recorded, replayed)
+        if len(result.diffs):
+            differing += 1
+    return 1 if differing else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
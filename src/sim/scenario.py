@@ -0,0 +1,157 @@
+"""Scenario files: fixed worlds to fly instead of generating one from a seed.
+
+A scenario is a JSON file describing the world, where everything but the
+positions is optional:
+
+    {
+        "format": "zip-sim-scenario",
+        "version": 1,
+        "world": {"length": 2000.0, "width": 50.0},
+        "seed": 7,
+        "wind": {"speed": 18.0, "direction": 1.5708, "steady": true},
+        "delivery_sites": [[512.3, 20.1], ...],
+        "trees": [[140.0, 31.5], ...]
+    }
+
+The world size must match the simulator's, since it's built into the
+visualization and the pilots. The seed drives the wind when a speed or
+direction is left out and its gusts unless it's steady, and is used when a
+flight doesn't give a seed of its own. snapshot() captures a generated
+world, so `zip_sim.py --save-world` can turn any seed into a scenario.
+A snapshot flies the same world and starting wind, but its gusts are drawn
+afresh from the seed, so the flight itself differs from the generated one.
+"""
+import json
+import numbers
+
+from zip_sim import WORLD_LENGTH, WORLD_WIDTH, MAX_WINDSPEED_M_S, Scenario
+
+SCENARIO_FORMAT = "zip-sim-scenario"
+
+SCENARIO_VERSION = 1
+
+
+def snapshot(sim):
+    """Returns a Scenario of a simulation's world and wind, as they are right after reset()."""
+    return Scenario(
+        [d.position for d in sim.delivery_sites],
+        [t.position for t in sim.trees],
+        sim.wind.speed,
+        sim.wind.direction,
+    )
+
+
+# ------Encoding----------------------------------------------------------------
+# ------------------------------------------------------------------------------
+# ------------------------------------------------------------------------------
+def scenario_to_dict(scenario, seed=None):
+    data = {
+        "format": SCENARIO_FORMAT,
+        "version": SCENARIO_VERSION,
+        "world": {"length": WORLD_LENGTH, "width": WORLD_WIDTH},
+    }
+    if seed is not None:
+        data["seed"] = seed
+    wind = {}
+    if scenario.wind_speed is not None:
+        wind["speed"] = scenario.wind_speed
+    if scenario.wind_direction is not None:
+        wind["direction"] = scenario.wind_direction
+    if scenario.steady_wind:
+        wind["steady"] = True
+    if wind:
+        data["wind"] = wind
+    data["delivery_sites"] = [list(p) for p in scenario.delivery_sites]
+    data["trees"] = [list(p) for p in scenario.trees]
+    return data
+
+
+def _number(value, name):
+    if isinstance(value, bool) or not isinstance(value, numbers.Real):
+        raise ValueError("{} must be a number, got {!r}".format(name, value))
+    return float(value)
+
+
+def _positions(data, key):
+    positions = data.get(key, [])
+    if not isinstance(positions, list):
+        raise ValueError("{} must be a list of [x, y] positions".format(key))
+    result = []
+    for idx, p in enumerate(positions):
+        name = "{}[{}]".format(key, idx)
+        if not isinstance(p, list) or len(p) != 2:
+            raise ValueError("{} must be an [x, y] position, got {!r}".format(name, p))
+        (x, y) = (_number(p[0], name), _number(p[1], name))
+        if not (0.0 <= x < WORLD_LENGTH and 0.0 <= y < WORLD_WIDTH):
+            raise ValueError(
+                "{} ({}, {}) is outside the {} x {} m world".format(
+                    name, x, y, WORLD_LENGTH, WORLD_WIDTH
+                )
+            )
+        result.append((x, y))
+    return result
+
+
+def scenario_from_dict(data):
+    """Validates a decoded scenario file and returns (Scenario, seed), raising ValueError if it's invalid."""
+    if not isinstance(data, dict) or data.get("format") != SCENARIO_FORMAT:
+        raise ValueError("not a scenario file")
+    if data.get("version") != SCENARIO_VERSION:
+        raise ValueError(
+            "scenario version {!r} isn't supported, expected {}".format(
+                data.get("version"), SCENARIO_VERSION
+            )
+        )
+    world = data.get("world", {})
+    if not isinstance(world, dict):
+        raise ValueError("world must be an object")
+    length = _number(world.get("length", WORLD_LENGTH), "world.length")
+    width = _number(world.get("width", WORLD_WIDTH), "world.width")
+    if (length, width) != (WORLD_LENGTH, WORLD_WIDTH):
+        raise ValueError(
+            "scenario is for a {} x {} m world, the simulator's is {} x {} m".format(
+                length, width, WORLD_LENGTH, WORLD_WIDTH
+            )
+        )
+    seed = data.get("seed")
+    if seed is not None and (isinstance(seed, bool) or not isinstance(seed, int)):
+        raise ValueError("seed must be an integer, got {!r}".format(seed))
+    wind = data.get("wind", {})
+    if not isinstance(wind, dict):
+        raise ValueError("wind must be an object")
+    speed = wind.get("speed")
+    if speed is not None:
+        speed = _number(speed, "wind.speed")
+        if not 0.0 <= speed <= MAX_WINDSPEED_M_S:
+            raise ValueError(
+                "wind.speed {} is outside 0 to {} m/s".format(speed, MAX_WINDSPEED_M_S)
+            )
+    direction = wind.get("direction")
+    if direction is not None:
+        direction = _number(direction, "wind.direction")
+    steady = wind.get("steady", False)
+    if not isinstance(steady, bool):
+        raise ValueError("wind.steady must be true or false")
+    scenario = Scenario(
+        _positions(data, "delivery_sites"), _positions(data, "trees"), speed, direction, steady
+    )
+    return (scenario, seed)
+
+
+# ------Files-------------------------------------------------------------------
+# ------------------------------------------------------------------------------
+# ------------------------------------------------------------------------------
+def save_scenario(path, scenario, seed=None):
+    with open(path, "w") as f:
+        json.dump(scenario_to_dict(scenario, seed), f)
+        f.write("\n")
+
+
+def load_scenario(path):
+    """Loads a scenario file and returns (Scenario, seed), raising ValueError naming the file if it's invalid."""
+    with open(path) as f:
+        try:
+            return scenario_from_dict(json.load(f))
+        except ValueError as e:
+            # json's decode errors are ValueErrors too
+            raise ValueError("{}: {}".format(path, e)) from None
@@ -0,0 +1,127 @@
+"""Checks that the serial link to a simulated board resyncs after corrupted frames.
+
+A FakeArduino running AUTO is put on the far end of an in-memory cable
+that flips bits in both directions, and is sent a flight's telemetry one
+frame at a time, the way ArduinoController sends it. The corruption has to
+be caught (the parsers on both ends report errors) without stopping the
+link: once the cable is clean again, every frame after a short settling
+window has to be answered.
+
+Usage:
+    python -m src.sim.serial_resync --corruption-rate 0.002
+"""
+import argparse
+import sys
+import time
+
+from zip_sim import Simulation
+from src.pilots.fake_arduino import FakeArduino, loopback_pair
+from src.pilots.serial_protocol import CHECK_CRC16, CHECK_XOR
+from src.pilots.serial_transport import SerialTransport
+from src.pilots.controllers.controller_creator import (
+    ARDUINO_COMMAND_STRUCT,
+    ArduinoController,
+    AutoControlCreator,
+)
+
+# How long a frame waits for its reply before it counts as lost.
+REPLY_TIMEOUT_SEC = 0.1
+
+CLEAN_FRAMES = 60
+
+# Clean frames that may still go unanswered while the parsers skip what's left of the corrupted bytes. A corrupted
+# length byte can make a parser wait for up to a full payload's worth of bytes before it rescans them.
+SETTLING_FRAMES = 10
+
+
+def flight_telemetry(seed, count):
+    """Returns count telemetry messages of a vehicle flying straight, starting over whenever the flight ends."""
+    sim = Simulation()
+    telemetry = sim.reset(seed)
+    messages = []
+    while len(messages) < count:
+        if telemetry is None:
+            telemetry = sim.reset(seed)
+        messages.append(bytes(telemetry))
+        telemetry = sim.step(0.0, False)
+    return messages
+
+
+def exchange_all(transport, messages):
+    """Sends every message and waits for a reply to each, returning which ones were answered in time."""
+    answered = []
+    for message in messages:
+        transport.send(message)
+        answered.append(transport.receive(REPLY_TIMEOUT_SEC) is not None)
+    return answered
+
+
+def check_link(check, corruption_rate, frames, seed):
+    """Flies frames corrupted and then CLEAN_FRAMES clean telemetry messages over a cable on check.
+
+    Returns (frames answered while corrupted, parser errors on both ends, clean frames answered after settling, and
+    how many of them there were)."""
+    (link, device_link) = loopback_pair(timeout=ArduinoController.READ_POLL_SEC, seed=seed)
+    device = FakeArduino(
+        device_link, AutoControlCreator.create_controller("AUTO"), ARDUINO_COMMAND_STRUCT
+    )
+    transport = SerialTransport(link)
+    try:
+        # Agreed on before the corruption starts, since a lost request leaves the link on XOR.
+        if transport.negotiate(check, REPLY_TIMEOUT_SEC) != check:
+            raise RuntimeError("the simulated board didn't switch to {}".format(check))
+        messages = flight_telemetry(seed, frames + CLEAN_FRAMES)
+        link.corruption_rate = device_link.corruption_rate = corruption_rate
+        corrupted = exchange_all(transport, messages[:frames])
+        link.corruption_rate = device_link.corruption_rate = 0.0
+        # Replies that missed their frame's timeout would otherwise be taken for answers to clean frames.
+        time.sleep(REPLY_TIMEOUT_SEC)
+        while transport.receive(0) is not None:
+            pass
+        clean = exchange_all(transport, messages[frames:])[SETTLING_FRAMES:]
+        errors = transport.parser.errors + device.transport.parser.errors
+    finally:
+        transport.close()
+        device.close()
+    return (sum(corrupted), errors, sum(clean), len(clean))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Check that the serial link to a simulated board resyncs after corrupted frames"
+    )
+    parser.add_argument(
+        "--corruption-rate",
+        type=float,
+        default=0.002,
+        help="Chance of each byte on the cable getting a bit flipped while it is corrupted",
+    )
+    parser.add_argument(
+        "--frames", type=int, default=300, help="Telemetry frames to send over the corrupted cable"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the flight and the cable's corruption")
+    args = parser.parse_args(argv)
+
+    failed = 0
+    for check in (CHECK_XOR, CHECK_CRC16):
+        try:
+            (answered, errors, resynced, clean) = check_link(
+                check, args.corruption_rate, args.frames, args.seed
+            )
+        except RuntimeError as e:
+            sys.stderr.write("{}\n".format(e))
+            failed += 1
+            continue
+        ok = errors > 0 and resynced == clean
+        print(
+            "{:5} {}: {} of {} corrupted frames answered, {} parser errors, {} of {} clean frames answered".format(
+                check, "ok" if ok else "FAIL", answered, args.frames, errors, resynced, clean
+            )
+        )
+        if not ok:
+            failed += 1
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
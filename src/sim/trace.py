@@ -0,0 +1,95 @@
+"""Per-tick traces of a flight, kept as preallocated columns and saved as .npz for analysis in NumPy.
+
+Each saved trace holds one array per column, all with one entry per tick,
+plus scalar seed, dt_sec, result, deliveries and violations arrays:
+
+    x, y                  vehicle position when the telemetry was sent
+    wind_x, wind_y        wind vector at that time
+    lateral_airspeed      lateral airspeed the pilot commanded
+    drop                  whether the pilot commanded a drop
+    nearest_lidar         shortest non-zero lidar return, 0 if nothing was in range
+    nearest_lidar_angle   bearing of that return in degrees, as in the simulation's lidar_angles
+    pilot_state           the controller's PilotFlags state, -1 if the pilot doesn't report one. Only
+                          pilots run in the simulation's process do: a pilot process only sends
+                          back its commands
+"""
+import math
+
+import numpy as np
+
+from zip_sim import DT_SEC, RECOVERY_X, VEHICLE_AIRSPEED, MAX_WINDSPEED_M_S, LIDAR_ANGLES
+
+
+def max_episode_ticks(dt_sec):
+    """Enough ticks for the slowest possible flight, into a full headwind all the way to the recovery line."""
+    return math.ceil(RECOVERY_X / (VEHICLE_AIRSPEED - MAX_WINDSPEED_M_S) / dt_sec) + 1
+
+
+MAX_EPISODE_TICKS = max_episode_ticks(DT_SEC)
+
+TRACE_COLUMNS = (
+    ("x", np.float64),
+    ("y", np.float64),
+    ("wind_x", np.float32),
+    ("wind_y", np.float32),
+    ("lateral_airspeed", np.float32),
+    ("drop", np.bool_),
+    ("nearest_lidar", np.uint8),
+    ("nearest_lidar_angle", np.float32),
+    ("pilot_state", np.int8),
+)
+
+NO_PILOT_STATE = -1
+
+LIDAR_ANGLES_DEG = [math.degrees(angle) for angle in LIDAR_ANGLES]
+
+
+class EpisodeTrace:
+    """Columns for one flight, allocated up front for the longest possible flight at a tick length of dt_sec."""
+
+    __slots__ = ["ticks", "dt_sec", "_columns"]
+
+    def __init__(self, dt_sec=DT_SEC, capacity=None):
+        if capacity is None:
+            capacity = max_episode_ticks(dt_sec)
+        self.ticks = 0
+        self.dt_sec = dt_sec
+        self._columns = {name: np.zeros(capacity, dtype=dtype) for (name, dtype) in TRACE_COLUMNS}
+
+    def record(self, sim, lateral_airspeed, drop, pilot_state=None):
+        """Records a tick, after the pilot answered and before the simulation moves on."""
+        tick = self.ticks
+        columns = self._columns
+        if tick == len(columns["x"]):
+            # only reachable with a capacity below max_episode_ticks()
+            for name in columns:
+                columns[name] = np.concatenate((columns[name], np.zeros_like(columns[name])))
+        (columns["x"][tick], columns["y"][tick]) = sim.vehicle.position
+        (columns["wind_x"][tick], columns["wind_y"][tick]) = sim.wind.vector
+        columns["lateral_airspeed"][tick] = lateral_airspeed
+        columns["drop"][tick] = drop
+        samples = sim.lidar_samples
+        nearest = min((d for d in samples if d), default=0)
+        if nearest:
+            columns["nearest_lidar"][tick] = nearest
+            angles = sim.lidar_angles
+            columns["nearest_lidar_angle"][tick] = (
+                LIDAR_ANGLES_DEG[samples.index(nearest)]
+                if angles is LIDAR_ANGLES
+                else math.degrees(angles[samples.index(nearest)])
+            )
+        columns["pilot_state"][tick] = NO_PILOT_STATE if pilot_state is None else pilot_state
+        self.ticks = tick + 1
+
+    def columns(self):
+        """Returns views of the recorded part of every column."""
+        return {name: column[: self.ticks] for (name, column) in self._columns.items()}
+
+    def save(self, path, seed=None, score=None):
+        """Writes the trace to an .npz file, along with the seed and the flight's SimulationResult."""
+        metadata = {"seed": -1 if seed is None else seed, "dt_sec": self.dt_sec}
+        if score is not None:
+            metadata.update(
+                result=score.result, deliveries=score.deliveries, violations=score.violations
+            )
+        np.savez(path, **self.columns(), **metadata)
@@ -0,0 +1,408 @@
+"""Steps many independent zip flights in lockstep with NumPy.
+
+Every world is generated exactly like zip_sim.Simulation.reset(seed), then the vehicles, winds, trees, delivery sites
+and lidar of all worlds are held in arrays and advanced together by one step() call. Wind noise comes from a separate
+NumPy generator per world, so a world's flight only depends on its own seed and commands, but its wind drifts
+differently from the single-world simulation. The tick rate and lidar step can be changed like the single-world
+simulation's, and telemetry then carries the same versioned header.
+"""
+import math
+from collections import namedtuple
+
+import numpy as np
+
+from zip_sim import (
+    DT_SEC,
+    WORLD_WIDTH,
+    WORLD_LENGTH,
+    WORLD_WIDTH_HALF,
+    PACKAGE_FALL_SEC,
+    RECOVERY_X,
+    RECOVERY_Y_MIN,
+    RECOVERY_Y_MAX,
+    VEHICLE_AIRSPEED,
+    MAX_WINDSPEED_M_S,
+    DELIVERY_SITE_RADIUS,
+    TREE_COLLISION_RADIUS,
+    LIDAR_MAX_DISTANCE,
+    TELEMETRY_STRUCT,
+    TELEMETRY_MAGIC,
+    TELEMETRY_VERSION,
+    COMMAND_STRUCT,
+    RECOVERED,
+    PARALANDED,
+    CRASHED,
+    Simulation,
+    SimulationResult,
+    lidar_ray_distances,
+    round_lidar_samples,
+)
+
+# How many ticks of wind noise to draw from each world's generator at a time.
+WIND_NOISE_BLOCK = 1024
+
+# Padding for worlds with fewer lidar circles than the largest world. It has no radius, so it never reflects anything,
+# and it sorts after every real circle.
+LIDAR_PADDING = (2 * WORLD_LENGTH, 0.0, 0.0)
+
+VectorObservation = namedtuple(
+    "VectorObservation",
+    [
+        "timestamp",
+        "recovery_x_error",
+        "wind_vector",
+        "recovery_y_error",
+        "lidar_samples",
+        "done",
+    ],
+)
+
+
+def _pad(rows, width, fill):
+    """Stacks per-world lists of tuples into one (worlds, width, len(fill)) array."""
+    padded = np.empty((len(rows), width, len(fill)))
+    padded[:] = fill
+    for i, r in enumerate(rows):
+        if r:
+            padded[i, : len(r)] = r
+    return padded
+
+
+class VectorSimulation:
+    """N zip flights stepped together.
+
+    reset(seeds) generates one world per seed and returns the first VectorObservation. step() takes an array of
+    lateral airspeeds and an array of drop commands, one per world, and returns the next VectorObservation. Worlds
+    whose flight has ended are frozen and flagged in done until the next reset.
+
+    rate_hz and lidar_step_deg are those of zip_sim.Simulation, and raise the same ValueError for a bad lidar step."""
+
+    __slots__ = [
+        "num_envs",
+        "seeds",
+        "dt_sec",
+        "_wind_sigma",
+        "lidar_geometry",
+        "lidar_rays",
+        "telemetry_struct",
+        "_telemetry_format",
+        "_sim",
+        "positions",
+        "wind_speed",
+        "wind_direction",
+        "lateral_airspeed",
+        "ticks",
+        "done",
+        "result_codes",
+        "lidar_samples",
+        "num_packages",
+        "_trees",
+        "_tree_valid",
+        "_sites",
+        "_site_valid",
+        "_lidar_circles",
+        "_lidar_keys",
+        "_lidar_offsets",
+        "_lidar_reach",
+        "_deliveries",
+        "_was_package_dropped",
+        "_rngs",
+        "_wind_noise",
+        "_noise_index",
+    ]
+
+    def __init__(self, num_envs, rate_hz=None, lidar_step_deg=None):
+        self.num_envs = num_envs
+        self.seeds = [None] * num_envs
+        # Generates the worlds, and checks the rate and lidar step the same way the single-world simulation does
+        self._sim = Simulation(rate_hz=rate_hz, lidar_step_deg=lidar_step_deg)
+        self.dt_sec = self._sim.dt_sec
+        # Scales the wind noise like zip_sim.Wind.update, so the wind drifts as much per second at any tick rate
+        self._wind_sigma = math.sqrt(self.dt_sec * DT_SEC)
+        self.lidar_geometry = self._sim.lidar_geometry
+        self.lidar_rays = self._sim.lidar_rays
+        self.telemetry_struct = self._sim.telemetry_struct
+        if self.telemetry_struct is TELEMETRY_STRUCT:
+            self._telemetry_format = ()
+        else:
+            self._telemetry_format = (
+                TELEMETRY_MAGIC,
+                TELEMETRY_VERSION,
+                self.dt_sec,
+                *self.lidar_geometry,
+            )
+
+    def reset(self, seeds):
+        """Generates a world for every seed and returns the first observation."""
+        if len(seeds) != self.num_envs:
+            raise ValueError(
+                "expected {} seeds, got {}".format(self.num_envs, len(seeds))
+            )
+        n = self.num_envs
+        self.seeds = list(seeds)
+
+        trees = []
+        sites = []
+        circles = []
+        self.wind_speed = np.empty(n)
+        self.wind_direction = np.empty(n)
+        sim = self._sim
+        for i, seed in enumerate(self.seeds):
+            # Generate the world the same way the single-world simulation does, including the starting wind.
+            sim.reset(seed)
+            trees.append([t.position for t in sim.trees])
+            sites.append([s.position for s in sim.delivery_sites])
+            circles.append(
+                [
+                    o.position + (o.radius,)
+                    for o in [t.make_lidar_object() for t in sim.trees]
+                    + [s.make_lidar_object() for s in sim.delivery_sites]
+                ]
+            )
+            self.wind_speed[i] = sim.wind.speed
+            self.wind_direction[i] = sim.wind.direction
+
+        max_trees = max(map(len, trees), default=0)
+        max_sites = max(map(len, sites), default=0)
+        self._trees = _pad(trees, max_trees, (0.0, 0.0))
+        self._tree_valid = np.arange(max_trees) < np.array([len(t) for t in trees])[
+            :, np.newaxis
+        ]
+        self._sites = _pad(sites, max_sites, (0.0, 0.0))
+        self._site_valid = np.arange(max_sites) < np.array([len(s) for s in sites])[
+            :, np.newaxis
+        ]
+        # Like zip_sim.LidarIndex, every world's circles are sorted by x so each scan only gathers the ones in reach.
+        # Offsetting each world's x by a multiple of a span larger than any x makes all worlds one sorted array.
+        lidar_circles = _pad(circles, max(map(len, circles), default=0), LIDAR_PADDING)
+        order = np.argsort(lidar_circles[:, :, 0], axis=1, kind="stable")
+        lidar_circles = np.take_along_axis(lidar_circles, order[:, :, np.newaxis], 1)
+        self._lidar_offsets = np.arange(n) * (4 * WORLD_LENGTH)
+        self._lidar_keys = (
+            lidar_circles[:, :, 0] + self._lidar_offsets[:, np.newaxis]
+        ).ravel()
+        self._lidar_circles = lidar_circles.reshape(-1, 3)
+        self._lidar_reach = (
+            LIDAR_MAX_DISTANCE + 1.0 + lidar_circles[:, :, 2].max(initial=0.0)
+        )
+
+        self.positions = np.zeros((n, 2))
+        self.lateral_airspeed = np.zeros(n)
+        self.ticks = np.zeros(n, dtype=int)
+        self.done = np.zeros(n, dtype=bool)
+        self.result_codes = np.full(n, -1)
+        self.num_packages = self._site_valid.sum(axis=1)
+        self._deliveries = np.zeros((n, max_sites), dtype=int)
+        self._was_package_dropped = np.zeros(n, dtype=bool)
+
+        self._rngs = [np.random.default_rng(seed) for seed in self.seeds]
+        self._noise_index = WIND_NOISE_BLOCK
+        return self.observe()
+
+    @property
+    def wind_vector(self):
+        return np.stack(
+            (
+                self.wind_speed * np.cos(self.wind_direction),
+                self.wind_speed * np.sin(self.wind_direction),
+            ),
+            axis=-1,
+        )
+
+    def _next_wind_noise(self):
+        if self._noise_index == WIND_NOISE_BLOCK:
+            self._wind_noise = np.stack(
+                [rng.standard_normal((WIND_NOISE_BLOCK, 2)) for rng in self._rngs]
+            )
+            self._noise_index = 0
+        noise = self._wind_noise[:, self._noise_index]
+        self._noise_index += 1
+        return noise
+
+    def _cast_lidar(self):
+        n = self.num_envs
+        per_env = len(self._lidar_circles) // n
+        x = self.positions[:, 0]
+        y = self.positions[:, 1]
+        # Find each world's window of circles in reach. The offsets cost some precision, so widen every window by one
+        # circle on both ends and leave the exact "ahead of the vehicle" test to the mask below.
+        first = (
+            np.searchsorted(self._lidar_keys, x + self._lidar_offsets, side="right") - 1
+        )
+        last = (
+            np.searchsorted(
+                self._lidar_keys,
+                x + self._lidar_reach + self._lidar_offsets,
+                side="right",
+            )
+            + 1
+        )
+        window = first[:, np.newaxis] + np.arange(max(int((last - first).max()), 0))
+        row_start = (np.arange(n) * per_env)[:, np.newaxis]
+        in_world = (window >= row_start) & (window < row_start + per_env)
+        circles = self._lidar_circles[np.clip(window, 0, n * per_env - 1)]
+        # Only objects ahead of the vehicle are visible, same as zip_sim.cast_lidar. Windows are as wide as the widest
+        # one, so also drop circles past the reach of the lidar.
+        circles_x = circles[:, :, 0]
+        visible = (
+            in_world
+            & (circles_x > x[:, np.newaxis])
+            & (circles_x <= x[:, np.newaxis] + self._lidar_reach)
+            & (circles[:, :, 2] > 0.0)
+        )
+
+        # Pack the visible circles of all worlds into one flat list, grouped by world, so no time is spent on padding.
+        owners, _ = np.nonzero(visible)
+        circles = circles[visible]
+        owners_x = x[owners]
+        circles[:, 0] -= owners_x
+        circles[:, 1] = (
+            circles[:, 1] - y[owners] + WORLD_WIDTH_HALF
+        ) % WORLD_WIDTH - WORLD_WIDTH_HALF
+        distances, inside = lidar_ray_distances(circles, self.lidar_rays)
+
+        nearest = np.full((n, len(distances)), np.inf)
+        blind = np.zeros((n, 1), dtype=bool)
+        if len(owners):
+            seen, group_start = np.unique(owners, return_index=True)
+            nearest[seen] = np.minimum.reduceat(distances, group_start, axis=1).T
+            blind[seen] = np.logical_or.reduceat(inside, group_start, axis=1).T
+        return round_lidar_samples(nearest, blind)
+
+    def observe(self):
+        """Scans every world's lidar and returns the current observation."""
+        self.lidar_samples = self._cast_lidar()
+        x = self.positions[:, 0]
+        y = self.positions[:, 1]
+        return VectorObservation(
+            (self.ticks * self.dt_sec * 1e3).astype(int) & 0xFFFF,
+            np.rint(RECOVERY_X - x).astype(int),
+            self.wind_vector,
+            np.rint(
+                (-y + WORLD_WIDTH_HALF) % WORLD_WIDTH - WORLD_WIDTH_HALF
+            ).astype(int),
+            self.lidar_samples,
+            self.done.copy(),
+        )
+
+    def step(self, lateral_airspeed, drop_package_commanded):
+        """Flies every world that hasn't finished for one tick and returns the next observation."""
+        active = ~self.done
+        self.lateral_airspeed = np.where(
+            active, np.clip(lateral_airspeed, -30.0, 30.0), self.lateral_airspeed
+        )
+        drop_package_commanded = np.asarray(drop_package_commanded, dtype=bool)
+        self.ticks += active
+
+        wind = self.wind_vector
+        velocity = np.stack(
+            (VEHICLE_AIRSPEED + wind[:, 0], self.lateral_airspeed + wind[:, 1]),
+            axis=-1,
+        )
+        moved = (self.positions + self.dt_sec * velocity) % (WORLD_LENGTH, WORLD_WIDTH)
+        self.positions = np.where(active[:, np.newaxis], moved, self.positions)
+
+        # Check for collisions with trees
+        delta = np.abs(self._trees - self.positions[:, np.newaxis, :])
+        delta = np.minimum(delta, (WORLD_LENGTH, WORLD_WIDTH) - delta)
+        hit_tree = (
+            (delta * delta).sum(axis=-1) < TREE_COLLISION_RADIUS * TREE_COLLISION_RADIUS
+        ) & self._tree_valid
+        crashed = active & hit_tree.any(axis=1)
+        self.result_codes[crashed] = CRASHED
+
+        # Drop packages. A package lands where the vehicle's velocity carries it while falling, and is scored as soon
+        # as it's dropped since nothing can change its path after release.
+        dropping = (
+            active
+            & drop_package_commanded
+            & ~self._was_package_dropped
+            & (self.num_packages > 0)
+        )
+        if dropping.any():
+            self.num_packages -= dropping
+            landing = (
+                self.positions[dropping] + PACKAGE_FALL_SEC * velocity[dropping]
+            ) % (WORLD_LENGTH, WORLD_WIDTH)
+            delta = np.abs(self._sites[dropping] - landing[:, np.newaxis, :])
+            delta = np.minimum(delta, (WORLD_LENGTH, WORLD_WIDTH) - delta)
+            self._deliveries[dropping] += (
+                (delta * delta).sum(axis=-1)
+                < DELIVERY_SITE_RADIUS * DELIVERY_SITE_RADIUS
+            ) & self._site_valid[dropping]
+        self._was_package_dropped = np.where(
+            active, drop_package_commanded, self._was_package_dropped
+        )
+
+        noise = self._next_wind_noise()
+        self.wind_speed = np.where(
+            active,
+            np.clip(self.wind_speed + noise[:, 0] * self._wind_sigma * 10, 0.0, MAX_WINDSPEED_M_S),
+            self.wind_speed,
+        )
+        self.wind_direction = np.where(
+            active,
+            (self.wind_direction + noise[:, 1] * self._wind_sigma) % (2 * math.pi),
+            self.wind_direction,
+        )
+
+        x = self.positions[:, 0]
+        y = self.positions[:, 1]
+        recovered = active & (x >= RECOVERY_X)
+        self.result_codes[recovered] = np.where(
+            (y <= RECOVERY_Y_MIN) | (y >= RECOVERY_Y_MAX), RECOVERED, PARALANDED
+        )[recovered]
+
+        self.done |= crashed | recovered
+        return self.observe()
+
+    def end(self, env, result_code):
+        """Ends one world's flight early, e.g. when its pilot has died."""
+        self.result_codes[env] = result_code
+        self.done[env] = True
+
+    def telemetry(self, env):
+        """Packs one world's last observation into the same telemetry message zip_sim sends its pilot."""
+        x, y = self.positions[env]
+        wind_x, wind_y = self.wind_vector[env]
+        return self.telemetry_struct.pack(
+            *self._telemetry_format,
+            int(self.ticks[env] * self.dt_sec * 1e3) & 0xFFFF,
+            round(RECOVERY_X - x),
+            wind_x,
+            wind_y,
+            round((-y + WORLD_WIDTH_HALF) % WORLD_WIDTH - WORLD_WIDTH_HALF),
+            *self.lidar_samples[env].tolist()
+        )
+
+    def results(self):
+        """Scores every world like Simulation.result(). Worlds that are still flying have a result of None."""
+        return [
+            SimulationResult(
+                None if code < 0 else int(code),
+                int(np.count_nonzero(deliveries)),
+                int(np.maximum(deliveries - 1, 0).sum()),
+                int(ticks),
+            )
+            for code, deliveries, ticks in zip(
+                self.result_codes, self._deliveries, self.ticks
+            )
+        ]
+
+
+def fly_all(vector_sim, pilots, seeds):
+    """Flies one pilot link per world until every world has finished and returns their SimulationResults."""
+    vector_sim.reset(seeds)
+    n = vector_sim.num_envs
+    lateral_airspeed = np.zeros(n)
+    drop_package_commanded = np.zeros(n, dtype=bool)
+    while not vector_sim.done.all():
+        for env in np.flatnonzero(~vector_sim.done):
+            cmd = pilots[env].exchange(vector_sim.telemetry(env))
+            if cmd is None or len(cmd) != COMMAND_STRUCT.size:
+                vector_sim.end(env, CRASHED)  # The pilot must have exited
+                continue
+            (lateral_airspeed[env], drop, _) = COMMAND_STRUCT.unpack(cmd)
+            drop_package_commanded[env] = bool(drop)
+        vector_sim.step(lateral_airspeed, drop_package_commanded)
+    return vector_sim.results()
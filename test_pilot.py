@@ -1,7 +1,7 @@
 import sys
 
-from zip_sim import TELEMETRY_STRUCT
 from src.pilots.pilot_creator import PilotDirector
+from src.pilots.telemetry import TelemetryReader
 
 # set stdin to read bytes
 stdin = sys.stdin.buffer
@@ -10,20 +10,29 @@ stdin = sys.stdin.buffer
 def run_pilot(pilot_select="AUTO"):
     """pilot selection is done with the provided string values:
         -"AUTO"   : Default python concrete autopilot class
+        -"PLAN"   : autopilot flying a path planned over all tracked objects
         -"UNO"    : uses controller as interface for embedded arduino uno solution
                     see config.py for arduino init parameters
+        -"UNO_SIM": the UNO interface talking to a simulated board running AUTO,
+                    see config.py for the simulated link's latency and errors
         -"MANUAL" : Uses keyboard as controller for pilot"""
 
     if (
-        pilot_select == "AUTO" or pilot_select == "UNO" or pilot_select == "MANUAL"
+        pilot_select == "AUTO"
+        or pilot_select == "PLAN"
+        or pilot_select == "UNO"
+        or pilot_select == "UNO_SIM"
+        or pilot_select == "MANUAL"
     ):  # currently only two pilot implementations
         # Concrete Pilot Selection
         pilot = PilotDirector.select_pilot(pilot_select)
+        # every message is read into the same buffer
+        reader = TelemetryReader(stdin)
 
         while True:
             try:
-                tele_input = bytearray(stdin.read(TELEMETRY_STRUCT.size))
-                if len(tele_input) == 44:
+                tele_input = reader.read()
+                if tele_input is not None:
                     pilot.interpret_telemetry(tele_input)
                     pilot.send_command()
                 else:
@@ -32,6 +41,7 @@ def run_pilot(pilot_select="AUTO"):
             except (EOFError, BrokenPipeError, IOError, TimeoutError):
                 # ignore subprocess flush command
                 break
+        pilot.close()
 
 
 if __name__ == "__main__":
@@ -1,21 +1,29 @@
 import argparse
+import collections
+import json
 import math
 import os
 import random
+import select
 import sys
 import subprocess
 import struct
+import time
+import traceback
+
+import numpy as np
 
 # Suppress hello from pygame so that stdout is clean
 os.environ["PYGAME_HIDE_SUPPORT_PROMPT"] = "hide"
 import pygame  # noqa
 
 
-# The time step of the simulation. 60Hz is chosen to work well on most displays that are 60Hz.
+# The time step of the simulation. 60Hz is chosen to work well on most displays that are 60Hz. Other rates can be
+# chosen with --rate-hz, e.g. to see how pilots scale to faster ticks.
 DT_SEC = 1 / 60.0
 
-# The visualizer may be sped up or slowed down (CPU cycles permitting)
-VISUALIZER_RATES = [m / DT_SEC for m in (0.0625, 0.125, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0)]
+# The visualizer may be sped up or slowed down (CPU cycles permitting), by these multiples of real time
+VISUALIZER_SPEEDS = (0.0625, 0.125, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0)
 INITIAL_VISUALIZER_RATE_INDEX = 4
 # How fast to poll the UI when paused, since it's no longer coupled to the sim rate.
 PAUSED_RATE = 30
@@ -41,6 +49,11 @@ WORLD_LENGTH_HALF = WORLD_LENGTH / 2.0
 SCREEN_WIDTH_HALF = SCREEN_WIDTH // 2
 SCREEN_HEIGHT_HALF = SCREEN_HEIGHT // 2
 
+# The static part of the world is pre-rendered in strips this long, which must divide WORLD_LENGTH.
+BACKGROUND_STRIP_M = 100.0
+# How many pre-rendered strips to keep. Two are on screen at most, the rest save re-rendering when stepping back.
+BACKGROUND_STRIP_CACHE_SIZE = 4
+
 # How long it takes for the package to "fall" and hit the ground after being released.
 PACKAGE_FALL_SEC = 0.5
 
@@ -79,6 +92,50 @@ LIDAR_ANGLES = [
     (i - 15.0) * math.pi / 180 for i in range(0, 31)
 ]  # -15 to +15 degrees, 1 degree steps.
 
+# The lidar always sweeps this field of view, but its angle step can be changed with --lidar-step-deg as long as it
+# splits the field of view into an even number of steps.
+LIDAR_FOV_DEG = 30.0
+LIDAR_STEP_DEG = 1.0
+
+# Ray line coefficients for every lidar angle, shaped to broadcast against an array of circles. They come from the math
+# module rather than numpy so the batched lidar produces exactly the same samples as cast_lidar_ray.
+def lidar_rays(angles):
+    return (
+        np.array([math.sin(angle) for angle in angles])[:, np.newaxis],
+        np.array([-math.cos(angle) for angle in angles])[:, np.newaxis],
+    )
+
+
+(LIDAR_RAY_A, LIDAR_RAY_B) = lidar_rays(LIDAR_ANGLES)
+
+LidarGeometry = collections.namedtuple("LidarGeometry", ["sample_count", "step_deg"])
+
+
+def lidar_geometry(step_deg=LIDAR_STEP_DEG):
+    """Returns the geometry of a lidar sweeping LIDAR_FOV_DEG in steps of step_deg, with a ray at each edge and one
+    straight ahead. Raises ValueError if the step doesn't divide the field of view into an even number of steps."""
+    steps = round(LIDAR_FOV_DEG / step_deg) if step_deg > 0 else 0
+    if steps < 2 or steps % 2 or abs(steps * step_deg - LIDAR_FOV_DEG) > 1e-9:
+        raise ValueError(
+            "a lidar step of {} degrees doesn't split {} degrees into an even number of steps".format(
+                step_deg, LIDAR_FOV_DEG
+            )
+        )
+    return LidarGeometry(steps + 1, float(step_deg))
+
+
+DEFAULT_LIDAR_GEOMETRY = lidar_geometry()
+
+
+def lidar_angles(geometry):
+    """The angles swept by a lidar, from right to left, in radians. The default geometry gives LIDAR_ANGLES."""
+    middle = (geometry.sample_count - 1) / 2
+    return [
+        (i - middle) * geometry.step_deg * math.pi / 180
+        for i in range(geometry.sample_count)
+    ]
+
+
 DELIVERY_SITE_RADIUS = 5.0
 DELIVERY_SITE_LIDAR_RADIUS = 0.5
 
@@ -95,15 +152,37 @@ TREE_LIDAR_RADIUS = 3.0
 # recovery_x error [2 bytes]
 # recovery_y error [1 byte]
 # 31 lidar samples [31 bytes]
-TELEMETRY_STRUCT = struct.Struct(">Hhffb31B")
+TELEMETRY_FIELDS_FORMAT = "Hhffb{}B"
+TELEMETRY_STRUCT = struct.Struct(">" + TELEMETRY_FIELDS_FORMAT.format(len(LIDAR_ANGLES)))
 COMMAND_STRUCT = struct.Struct(">fB3s")
 
+# At any other tick rate or lidar step, telemetry starts with a versioned header telling the pilot how to read it. The
+# header is followed by the fields of TELEMETRY_STRUCT, with as many lidar samples as the header says.
+# magic "ZTEL" [4 bytes]
+# version [1 byte]
+# tick length in seconds [8 bytes]
+# lidar sample count [2 bytes]
+# lidar angle step in degrees [8 bytes]
+TELEMETRY_MAGIC = b"ZTEL"
+TELEMETRY_VERSION = 1
+TELEMETRY_FORMAT_STRUCT = struct.Struct(">4sBdHd")
+
 # Return codes for why the simulation ended
 RECOVERED = 0
 PARALANDED = 1
 CRASHED = 2
 SIM_QUIT = 3
 
+# How long a pilot process gets to exit once its pipes are closed, before it is killed. A pilot cut off for missing its
+# deadline may still be stuck computing, and would otherwise keep the simulation from exiting.
+PILOT_EXIT_TIMEOUT_SEC = 1.0
+
+# Output verbosity levels: the final score is printed at VERBOSITY_SCORE, and the pilot's command every tick from
+# VERBOSITY_TICKS up. Headless runs start at VERBOSITY_SILENT, visualized runs at VERBOSITY_TICKS.
+VERBOSITY_SILENT = 0
+VERBOSITY_SCORE = 1
+VERBOSITY_TICKS = 2
+
 
 def load_image(name):
     return pygame.image.load(os.path.join(os.path.dirname(__file__), "art", name))
@@ -164,6 +243,11 @@ class Camera(Entity):
     def scale(self, distance):
         return distance * self._scale_inv
 
+    def in_view(self, position, margin=0.0):
+        """Whether a point is within margin meters of the part of the world on screen, along the world x axis."""
+        delta_x = abs(((position[0] - self.position[0]) + WORLD_LENGTH_HALF) % WORLD_LENGTH - WORLD_LENGTH_HALF)
+        return delta_x <= SCREEN_HEIGHT_HALF / self._scale_inv + margin
+
 
 class Package(Entity):
     __slots__ = ["_velocity", "_fall_duration"]
@@ -236,13 +320,14 @@ class Zip(Circle):
 class DeliverySite(Circle):
     __slots__ = []
     _image = load_image("delivery_site.png")
+    _image_offset = (64, 64)
 
     def __init__(self, position):
         super().__init__(position, radius=DELIVERY_SITE_RADIUS)
 
-    def draw(self, camera, surface):
-        for projected_pos in camera.project(self.position):
-            surface.blit(self._image, (projected_pos[0] - 64, projected_pos[1] - 64))
+    def sprites(self):
+        """Returns the image as a (position, image, offset) sprite, in a list like Terrain.sprites()."""
+        return [(self.position, self._image, self._image_offset)]
 
     def make_lidar_object(self):
         return Circle(self.position, radius=DELIVERY_SITE_LIDAR_RADIUS)
@@ -251,31 +336,46 @@ class DeliverySite(Circle):
 class Tree(Circle):
     __slots__ = []
     _image = load_image("tree.png")
+    _image_offset = (32, 32)
 
     def __init__(self, position):
         super().__init__(position, radius=TREE_COLLISION_RADIUS)
 
-    def draw(self, camera, surface):
-        for projected_pos in camera.project(self.position):
-            surface.blit(self._image, (projected_pos[0] - 32, projected_pos[1] - 32))
+    def sprites(self):
+        """Returns the image as a (position, image, offset) sprite, in a list like Terrain.sprites()."""
+        return [(self.position, self._image, self._image_offset)]
 
     def make_lidar_object(self):
         return Circle(self.position, radius=TREE_LIDAR_RADIUS)
 
 
 class Wind:
-    __slots__ = ["_speed", "_direction"]
+    __slots__ = ["_speed", "_direction", "_rng", "_steady"]
 
-    def __init__(self):
-        self._speed = random.uniform(0.0, MAX_WINDSPEED_M_S)
-        self._direction = random.uniform(0.0, 2 * math.pi)
+    def __init__(self, rng=random, speed=None, direction=None, steady=False):
+        """A speed or direction that isn't given is drawn at random. Steady wind never changes."""
+        self._rng = rng
+        self._speed = rng.uniform(0.0, MAX_WINDSPEED_M_S) if speed is None else speed
+        self._direction = rng.uniform(0.0, 2 * math.pi) if direction is None else direction
+        self._steady = steady
 
     def update(self, dt):
-        # TODO: Scale sigma?
+        if self._steady:
+            return
+        # The wind drifts as a random walk, so its noise scales with the square root of the tick length to keep the
+        # same variance per second at any tick rate. At the default rate the sigmas are dt * 10 and dt.
         self._speed = max(
-            0.0, min(MAX_WINDSPEED_M_S, self._speed + random.gauss(0.0, dt * 10))
+            0.0, min(MAX_WINDSPEED_M_S, self._speed + self._rng.gauss(0.0, 10 * math.sqrt(dt * DT_SEC)))
         )
-        self._direction = (self._direction + random.gauss(0.0, dt)) % (2 * math.pi)
+        self._direction = (self._direction + self._rng.gauss(0.0, math.sqrt(dt * DT_SEC))) % (2 * math.pi)
+
+    @property
+    def speed(self):
+        return self._speed
+
+    @property
+    def direction(self):
+        return self._direction
 
     @property
     def vector(self):
@@ -288,14 +388,74 @@ class Wind:
 class Terrain:
     __slots__ = []
     _image = load_image("terrain.png")
+    _image_offset = (250, 1000)
+    # The terrain image is tiled along the world every this many meters.
+    tile_length = 100
+
+    def sprites(self):
+        """Returns the terrain tiles as (position, image, offset) sprites."""
+        return [((x, 0.0), self._image, self._image_offset) for x in range(0, int(WORLD_LENGTH), self.tile_length)]
+
+
+class WorldBackground:
+    """The terrain, distribution center, trees and delivery sites, pre-rendered in strips along the world.
+
+    Each strip is BACKGROUND_STRIP_M of the world across its full width, drawn the way a camera at y = 0 sees it. The
+    sprites are only drawn when a strip first comes into view, and a frame then only blits the one or two strips on
+    screen, shifted for the camera's y, instead of every sprite in the world."""
+
+    __slots__ = ["_sprites", "_strips", "_strip_count", "_strip_height"]
+
+    def __init__(self, sim, distribution_center_image):
+        # Drawn in the same order as when every sprite was blitted to the screen each frame.
+        self._sprites = (
+            Terrain().sprites()
+            + [((0.0, 0.0), distribution_center_image, (250, 100))]
+            + [sprite for t in sim.trees for sprite in t.sprites()]
+            + [sprite for s in sim.delivery_sites for sprite in s.sprites()]
+        )
+        self._strips = collections.OrderedDict()
+        self._strip_count = round(WORLD_LENGTH / BACKGROUND_STRIP_M)
+        self._strip_height = round(BACKGROUND_STRIP_M / SCALE)
+
+    def _render_strip(self, idx):
+        strip = pygame.Surface((SCREEN_WIDTH, self._strip_height)).convert()
+        # Sprites are placed relative to the strip's top edge, which is its far end along the world x axis.
+        top_x = (idx + 1) * BACKGROUND_STRIP_M
+        center_x = top_x - BACKGROUND_STRIP_M / 2
+        for (position, image, (offset_x, offset_y)) in self._sprites:
+            # The strip's own copy of the sprite, if the world wraps between them
+            delta_x = ((position[0] - center_x) + WORLD_LENGTH_HALF) % WORLD_LENGTH - WORLD_LENGTH_HALF
+            row = round((BACKGROUND_STRIP_M / 2 - delta_x) / SCALE) - offset_y
+            if row >= self._strip_height or row + image.get_height() <= 0:
+                continue
+            column = round(-(position[1] % WORLD_WIDTH) / SCALE + SCREEN_WIDTH_HALF) - offset_x
+            strip.blit(image, (column, row))
+            strip.blit(image, (column + SCREEN_WIDTH, row))
+        return strip
+
+    def _strip(self, idx):
+        strip = self._strips.get(idx)
+        if strip is None:
+            strip = self._render_strip(idx)
+            if len(self._strips) >= BACKGROUND_STRIP_CACHE_SIZE:
+                self._strips.popitem(last=False)
+            self._strips[idx] = strip
+        else:
+            self._strips.move_to_end(idx)
+        return strip
 
     def draw(self, camera, surface):
-        # There's probably a better way to do this, but as long as it works...
-        for x in range(0, int(WORLD_LENGTH), 100):
-            for projected_pos in camera.project((x, 0.0)):
-                surface.blit(
-                    self._image, (projected_pos[0] - 250, projected_pos[1] - 1000)
-                )
+        view_half_length = SCREEN_HEIGHT_HALF * SCALE
+        camera_x = camera.position[0]
+        first = math.floor((camera_x - view_half_length) / BACKGROUND_STRIP_M)
+        last = math.floor((camera_x + view_half_length) / BACKGROUND_STRIP_M)
+        for k in range(first, last + 1):
+            strip = self._strip(k % self._strip_count)
+            # Where the strip's top edge at world y = 0 lands. The strip wraps across the screen like the world does.
+            ((x, y), _) = camera.project(((k + 1) * BACKGROUND_STRIP_M, 0.0))
+            surface.blit(strip, (x - SCREEN_WIDTH_HALF, y))
+            surface.blit(strip, (x + SCREEN_WIDTH_HALF, y))
 
 
 def cast_lidar_ray(angle, circles):
@@ -331,23 +491,596 @@ def cast_lidar_ray(angle, circles):
     return distance if distance <= LIDAR_MAX_DISTANCE else 0
 
 
-def cast_lidar(start_pos, objects):
-    # Remove objects that are behind the vehicle, and shift the positions to be in the vehicle's frame
-    relative_objects = [
-        (
-            o.position[0] - start_pos[0],
-            (o.position[1] - start_pos[1] + WORLD_WIDTH_HALF) % WORLD_WIDTH
-            - WORLD_WIDTH_HALF,
-            o.radius,
-        )
-        for o in objects
-        if o.position[0] > start_pos[0]
+def lidar_ray_distances(circles, rays=None):
+    """Measures how far every angle in LIDAR_ANGLES travels to every circle, in one array operation.
+
+    This is the batched form of the loop in cast_lidar_ray, and follows the same math step for step. circles is an
+    (..., N, 3) array of (x, y, radius) in the vehicle's frame. Returns an (..., angles, N) array of distances that are
+    inf where the ray misses, and an (..., 1, N) mask of the circles the vehicle is inside of. A circle with a zero
+    radius and a nonzero position never reflects anything, so it can be used as padding. Other angles can be swept by
+    passing their lidar_rays()."""
+    # Insert an axis for the angles so every array below is (..., angles, circles).
+    o_x = circles[..., np.newaxis, :, 0]
+    o_y = circles[..., np.newaxis, :, 1]
+    o_r = circles[..., np.newaxis, :, 2]
+    inside = o_x * o_x + o_y * o_y <= o_r * o_r
+    (a, b) = (LIDAR_RAY_A, LIDAR_RAY_B) if rays is None else rays
+    signed_c = -(a * o_x + b * o_y)
+    num_wraps = np.rint(signed_c / (b * WORLD_WIDTH))
+    signed_c -= num_wraps * b * WORLD_WIDTH
+    hits = np.abs(signed_c) < o_r
+    # Misses would take the square root of a negative number, so zero them out and mask them off afterwards.
+    gnarly_math = np.sqrt(np.where(hits, o_r * o_r - signed_c * signed_c, 0.0))
+    x = a * signed_c + b * gnarly_math + o_x
+    y = b * signed_c - a * gnarly_math + o_y + num_wraps * WORLD_WIDTH
+    return np.where(hits, np.sqrt(x * x + y * y), np.inf), inside
+
+
+def round_lidar_samples(distances, blind):
+    """Rounds the nearest distance along each ray into integer samples, the same way cast_lidar_ray does.
+
+    Rays farther than LIDAR_MAX_DISTANCE read 0, and so does every ray of a scan that is blind because the vehicle is
+    inside an object."""
+    samples = np.rint(distances)
+    samples[~(samples <= LIDAR_MAX_DISTANCE) | blind] = 0
+    return samples.astype(int)
+
+
+def cast_lidar_rays(circles, rays=None):
+    """Casts every angle in LIDAR_ANGLES (or in rays) against an (..., N, 3) array of circles and returns (..., angles)
+    samples.
+
+    Returns exactly the same samples as calling cast_lidar_ray for each angle. Leading dimensions let several
+    independent scans run at once."""
+    distances, inside = lidar_ray_distances(circles, rays)
+    return round_lidar_samples(
+        distances.min(axis=-1, initial=np.inf), inside.any(axis=-1)
+    )
+
+
+class LidarIndex:
+    """The circles that reflect lidar, sorted by their world x coordinate.
+
+    Trees and delivery sites never move once the world is generated, so the index is built once and each cast only
+    looks at the slice of circles that the lidar can actually reach."""
+
+    __slots__ = ["_circles", "_x", "_reach"]
+
+    def __init__(self, objects):
+        circles = np.array(
+            [(o.position[0], o.position[1], o.radius) for o in objects], dtype=float
+        ).reshape(-1, 3)
+        self._circles = circles[np.argsort(circles[:, 0], kind="stable")]
+        self._x = self._circles[:, 0]
+        # A sample rounds to zero past LIDAR_MAX_DISTANCE + 0.5, and no point on a circle is closer than its center x
+        # minus its radius, so anything farther ahead than this can't show up in a scan.
+        self._reach = LIDAR_MAX_DISTANCE + 1.0 + self._circles[:, 2].max(initial=0.0)
+
+    def __len__(self):
+        return len(self._circles)
+
+    def relative_circles(self, start_pos):
+        """Returns the circles ahead of start_pos and within lidar reach, shifted into the vehicle's frame."""
+        start_x, start_y = start_pos
+        first = np.searchsorted(self._x, start_x, side="right")
+        last = np.searchsorted(self._x, start_x + self._reach, side="right")
+        circles = self._circles[first:last].copy()
+        circles[:, 0] -= start_x
+        circles[:, 1] = (
+            circles[:, 1] - start_y + WORLD_WIDTH_HALF
+        ) % WORLD_WIDTH - WORLD_WIDTH_HALF
+        return circles
+
+
+def cast_lidar(start_pos, objects, rays=None):
+    # Only objects ahead of the vehicle and within lidar range are considered, already shifted into the vehicle's frame
+    if not isinstance(objects, LidarIndex):
+        objects = LidarIndex(objects)
+    return cast_lidar_rays(objects.relative_circles(start_pos), rays).tolist()
+
+
+SimulationResult = collections.namedtuple(
+    "SimulationResult", ["result", "deliveries", "violations", "ticks"]
+)
+
+# A fixed world to fly instead of a generated one, e.g. loaded with src.sim.scenario. Positions are (x, y) tuples in the
+# world frame. A wind speed or direction of None is drawn from the seed, like a generated world's.
+Scenario = collections.namedtuple(
+    "Scenario",
+    ["delivery_sites", "trees", "wind_speed", "wind_direction", "steady_wind"],
+    defaults=(None, None, False),
+)
+
+
+# ------World Generation--------------------------------------------------------
+# ------------------------------------------------------------------------------
+# ------------------------------------------------------------------------------
+# Candidate positions are drawn this many at a time beyond the number still needed, and rejected together.
+WORLDGEN_BATCH_MARGIN = 16
+
+
+def wrapped_distances(xs, ys, position):
+    """Entity.distance_to from a position to arrays of points, computed with the same operations.
+
+    Positions may also be arrays, shaped to broadcast against the points."""
+    delta_x = np.abs(xs - position[0])
+    delta_y = np.abs(ys - position[1])
+    # The same as wrapping deltas over half the world, since the other way around is then the shorter one.
+    np.minimum(delta_x, WORLD_LENGTH - delta_x, out=delta_x)
+    np.minimum(delta_y, WORLD_WIDTH - delta_y, out=delta_y)
+    return np.sqrt(delta_x * delta_x + delta_y * delta_y)
+
+
+def clear_of(xs, ys, entities, min_distance):
+    """Returns whether each point is at least min_distance from every one of the entities."""
+    if not entities:
+        return np.ones(len(xs), dtype=bool)
+    (entity_xs, entity_ys) = np.array([e.position for e in entities]).T
+    distances = wrapped_distances(xs, ys, (entity_xs[:, np.newaxis], entity_ys[:, np.newaxis]))
+    return (distances >= min_distance).all(axis=0)
+
+
+def round_to_tenth(values):
+    """Rounds an array to the nearest tenth like round(value, 1) does for each value.
+
+    round() rounds the exact decimal value, while scaling by 10 first can round the product across a half. The few
+    values that close to a half are rounded with round() itself."""
+    scaled = values * 10.0
+    rounded = np.rint(scaled) / 10.0
+    for idx in np.flatnonzero(np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6).tolist():
+        rounded[idx] = round(float(values[idx]), 1)
+    return rounded
+
+
+class RandomCandidates:
+    """Candidate positions drawn from a random.Random exactly as one-at-a-time rejection loops would draw them.
+
+    Candidates the placement doesn't use are handed back with unused(), which rewinds the generator to just after the
+    last used one, so the rest of the world and the wind are drawn from the same stream as before."""
+
+    __slots__ = ["_rng", "_x_bounds", "_y_bounds", "_wrap", "_state", "_drawn"]
+
+    def __init__(self, rng, x_bounds, y_bounds, wrap):
+        self._rng = rng
+        self._x_bounds = x_bounds
+        self._y_bounds = y_bounds
+        self._wrap = wrap
+        self._state = None
+        self._drawn = 0
+
+    def draw(self, count):
+        """Returns the x and y coordinates of count candidates as arrays."""
+        self._state = self._rng.getstate()
+        self._drawn = count
+        random = self._rng.random
+        # Each candidate is uniform(*x_bounds) then uniform(*y_bounds), which is a + (b - a) * random().
+        samples = np.array([random() for _ in range(2 * count)])
+        ((x_min, x_max), (y_min, y_max)) = (self._x_bounds, self._y_bounds)
+        xs = x_min + (x_max - x_min) * samples[0::2]
+        ys = y_min + (y_max - y_min) * samples[1::2]
+        if self._wrap:
+            xs %= WORLD_LENGTH
+            ys %= WORLD_WIDTH
+        # Round the position to the nearest tenth of a meter. This keeps the sprites from jumping around while drawing
+        # due to floating point round-off to the nearest pixel.
+        return (round_to_tenth(xs), round_to_tenth(ys))
+
+    def unused(self, count):
+        """Hands back the last count candidates of the latest draw."""
+        if count:
+            self._rng.setstate(self._state)
+            random = self._rng.random
+            for _ in range(2 * (self._drawn - count)):
+                random()
+
+
+class FastCandidates:
+    """Candidate positions drawn in bulk from a NumPy generator seeded from the simulation's generator.
+
+    Worlds are still reproducible from a seed, but differ from the ones RandomCandidates produces."""
+
+    __slots__ = ["_generator", "_x_bounds", "_y_bounds", "_wrap"]
+
+    def __init__(self, generator, x_bounds, y_bounds, wrap):
+        self._generator = generator
+        self._x_bounds = x_bounds
+        self._y_bounds = y_bounds
+        self._wrap = wrap
+
+    def draw(self, count):
+        xs = self._generator.uniform(*self._x_bounds, count)
+        ys = self._generator.uniform(*self._y_bounds, count)
+        if self._wrap:
+            xs %= WORLD_LENGTH
+            ys %= WORLD_WIDTH
+        return (np.round(xs, 1), np.round(ys, 1))
+
+    def unused(self, count):
+        pass
+
+
+def place_delivery_sites(candidates, count, min_distance=MIN_DELIVERY_DISTANCE):
+    """Places count delivery sites, taking the first candidate at least min_distance from every site placed so far."""
+    delivery_sites = []
+    while len(delivery_sites) < count:
+        (xs, ys) = candidates.draw(count - len(delivery_sites) + WORLDGEN_BATCH_MARGIN)
+        # Whether each candidate is still far enough from every site, updated as sites are placed.
+        clear = clear_of(xs, ys, delivery_sites, min_distance)
+        next_idx = 0
+        while len(delivery_sites) < count:
+            hits = np.flatnonzero(clear[next_idx:])
+            if not hits.size:
+                next_idx = len(xs)
+                break
+            idx = next_idx + int(hits[0])
+            site = DeliverySite((float(xs[idx]), float(ys[idx])))
+            delivery_sites.append(site)
+            next_idx = idx + 1
+            clear[next_idx:] &= (
+                wrapped_distances(xs[next_idx:], ys[next_idx:], site.position) >= min_distance
+            )
+        candidates.unused(len(xs) - next_idx)
+    return delivery_sites
+
+
+def place_trees(candidates, count, delivery_sites, min_distance=MIN_TREE_DISTANCE):
+    """Places count trees, skipping candidates closer than min_distance to any delivery site."""
+    trees = []
+    while len(trees) < count:
+        needed = count - len(trees)
+        # Few candidates land near a site, so only a few more than needed are drawn.
+        (xs, ys) = candidates.draw(needed + needed // 8 + 1)
+        accepted = np.flatnonzero(clear_of(xs, ys, delivery_sites, min_distance))[:needed]
+        trees.extend(map(Tree, zip(xs[accepted].tolist(), ys[accepted].tolist())))
+        candidates.unused(len(xs) - int(accepted[-1]) - 1 if len(trees) == count else 0)
+    return trees
+
+
+class Simulation:
+    """A single flight through a randomly generated world, advanced one tick at a time.
+
+    reset() generates the world and returns the first packed telemetry message. step() applies a pilot command, moves
+    everything forward by DT_SEC and returns the next telemetry message, or None once the flight has ended. result()
+    scores the flight. Each simulation has its own random number generator, so many can run in one process.
+
+    With fast_worldgen, worlds are drawn in bulk from NumPy instead of from the simulation's generator. They are still
+    reproducible from a seed, but aren't the worlds other simulations generate for that seed.
+
+    rate_hz and lidar_step_deg change the tick rate and the lidar's angle step. Telemetry then starts with the versioned
+    header described at TELEMETRY_FORMAT_STRUCT, while the defaults keep sending the 44-byte message of the challenge."""
+
+    __slots__ = [
+        "rng",
+        "fast_worldgen",
+        "dt_sec",
+        "lidar_geometry",
+        "lidar_angles",
+        "lidar_rays",
+        "telemetry_struct",
+        "_telemetry_format",
+        "delivery_sites",
+        "trees",
+        "lidar_objects",
+        "vehicle",
+        "wind",
+        "lateral_airspeed",
+        "lidar_samples",
+        "num_packages",
+        "dropped_packages",
+        "ticks",
+        "result_code",
+        "_was_package_dropped",
     ]
-    return [cast_lidar_ray(angle, relative_objects) for angle in LIDAR_ANGLES]
+
+    def __init__(self, fast_worldgen=False, rate_hz=None, lidar_step_deg=None):
+        self.rng = random.Random()
+        self.fast_worldgen = fast_worldgen
+        self.dt_sec = DT_SEC if rate_hz is None else 1.0 / rate_hz
+        self.lidar_geometry = lidar_geometry(
+            LIDAR_STEP_DEG if lidar_step_deg is None else lidar_step_deg
+        )
+        # The challenge's own rate and lidar keep the unversioned message, so existing pilots still understand it
+        if self.dt_sec == DT_SEC and self.lidar_geometry == DEFAULT_LIDAR_GEOMETRY:
+            self.lidar_angles = LIDAR_ANGLES
+            self.lidar_rays = None
+            self.telemetry_struct = TELEMETRY_STRUCT
+            self._telemetry_format = ()
+        else:
+            self.lidar_angles = lidar_angles(self.lidar_geometry)
+            self.lidar_rays = lidar_rays(self.lidar_angles)
+            self.telemetry_struct = struct.Struct(
+                TELEMETRY_FORMAT_STRUCT.format
+                + TELEMETRY_FIELDS_FORMAT.format(self.lidar_geometry.sample_count)
+            )
+            self._telemetry_format = (
+                TELEMETRY_MAGIC,
+                TELEMETRY_VERSION,
+                self.dt_sec,
+                *self.lidar_geometry,
+            )
+        self.delivery_sites = []
+        self.trees = []
+        self.lidar_objects = LidarIndex([])
+        self.vehicle = None
+        self.wind = None
+        self.lateral_airspeed = 0.0
+        self.lidar_samples = None
+        self.num_packages = 0
+        self.dropped_packages = []
+        self.ticks = 0
+        self.result_code = None
+        self._was_package_dropped = False
+
+    def reset(self, seed=None, scenario=None):
+        """Generates a new world from the seed and returns the first telemetry message.
+
+        Given a Scenario, its world is flown instead and the seed only drives the wind."""
+        self.rng.seed(seed)
+        if scenario is None:
+            self._generate_world()
+            self.wind = Wind(self.rng)
+        else:
+            self._set_world(
+                [DeliverySite(p) for p in scenario.delivery_sites],
+                [Tree(p) for p in scenario.trees],
+            )
+            self.wind = Wind(
+                self.rng, scenario.wind_speed, scenario.wind_direction, scenario.steady_wind
+            )
+        self.vehicle = Zip()
+        self.lateral_airspeed = 0.0
+        # Used to de-bounce commands to drop a package
+        self._was_package_dropped = False
+        # Number of packages still in the zip
+        self.num_packages = len(self.delivery_sites)
+        # List of package objects that have been dropped
+        self.dropped_packages = []
+        self.ticks = 0
+        # Set to an exit code when the flight is over
+        self.result_code = None
+        return self.telemetry()
+
+    def _generate_world(self):
+        rng = self.rng
+        if self.fast_worldgen:
+            generator = np.random.default_rng(rng.getrandbits(64))
+            site_candidates = FastCandidates(
+                generator, DELIVERY_SITE_X_BOUNDS, DELIVERY_SITE_Y_BOUNDS, wrap=True
+            )
+            tree_candidates = FastCandidates(
+                generator, TREE_X_BOUNDS, (0, WORLD_WIDTH), wrap=False
+            )
+        else:
+            site_candidates = RandomCandidates(
+                rng, DELIVERY_SITE_X_BOUNDS, DELIVERY_SITE_Y_BOUNDS, wrap=True
+            )
+            tree_candidates = RandomCandidates(
+                rng, TREE_X_BOUNDS, (0, WORLD_WIDTH), wrap=False
+            )
+        # Randomly generate delivery sites that aren't too close to each other.
+        delivery_sites = place_delivery_sites(site_candidates, NUM_DELIVERY_SITES)
+
+        # Randomly generate trees that aren't too close to delivery sites.
+        tree_density = rng.gauss(TYPICAL_NUM_TREES, MAX_NUM_TREES / 3)
+        num_trees = round(
+            min(MAX_NUM_TREES, tree_density)
+            if tree_density >= TYPICAL_NUM_TREES
+            else rng.triangular(0, TYPICAL_NUM_TREES, TYPICAL_NUM_TREES)
+        )
+        trees = place_trees(tree_candidates, num_trees, delivery_sites)
+        self._set_world(delivery_sites, trees)
+
+    def _set_world(self, delivery_sites, trees):
+        # Trees can overlap, so sort them so they render over each other properly.
+        trees.sort(key=lambda x: x.position[0], reverse=True)
+
+        self.delivery_sites = delivery_sites
+        self.trees = trees
+        # The objects that reflect lidar points
+        self.lidar_objects = LidarIndex(
+            [t.make_lidar_object() for t in trees]
+            + [d.make_lidar_object() for d in delivery_sites]
+        )
+
+    def scan_lidar(self):
+        """Scans the lidar from the vehicle's current position into lidar_samples and returns them."""
+        self.lidar_samples = cast_lidar(
+            self.vehicle.position, self.lidar_objects, self.lidar_rays
+        )
+        return self.lidar_samples
+
+    def telemetry(self):
+        """Scans the lidar from the vehicle's current position and returns the packed telemetry message."""
+        vehicle_x, vehicle_y = self.vehicle.position
+        wind_x, wind_y = self.wind.vector
+        self.scan_lidar()
+        return self.telemetry_struct.pack(
+            *self._telemetry_format,
+            int(self.ticks * self.dt_sec * 1e3) & 0xFFFF,
+            round(RECOVERY_X - vehicle_x),
+            wind_x,
+            wind_y,
+            round((-vehicle_y + WORLD_WIDTH_HALF) % WORLD_WIDTH - WORLD_WIDTH_HALF),
+            *self.lidar_samples
+        )
+
+    def step(self, lateral_airspeed, drop_package_commanded):
+        """Flies one tick with the commanded lateral airspeed and returns the next telemetry message, or None once
+        the flight has ended."""
+        self.advance(lateral_airspeed, drop_package_commanded)
+        if self.result_code is not None:
+            return None
+        return self.telemetry()
+
+    def advance(self, lateral_airspeed, drop_package_commanded):
+        """Moves the physics forward by one tick without scanning the lidar."""
+        vehicle = self.vehicle
+        self.lateral_airspeed = max(-30.0, min(30.0, lateral_airspeed))
+        self.ticks += 1
+
+        vehicle.update(self.dt_sec, self.lateral_airspeed, self.wind.vector)
+
+        # Check for collisions with trees
+        for t in self.trees:
+            if t.contains(vehicle.position):
+                self.result_code = CRASHED
+                break
+
+        for p in self.dropped_packages:
+            p.update(self.dt_sec)
+
+        # Drop a package if commanded to. The package is dropped after updating physics so that we can
+        # append it right on to the end of the dropped packages list. This adds some "realism" since a
+        # real mechanism would release the package some time after being commanded to.
+        if (
+            drop_package_commanded
+            and not self._was_package_dropped
+            and self.num_packages > 0
+        ):
+            self.num_packages -= 1
+            self.dropped_packages.append(
+                Package(
+                    vehicle.position,
+                    vehicle.get_velocity(self.lateral_airspeed, self.wind.vector),
+                )
+            )
+
+        self._was_package_dropped = drop_package_commanded
+
+        self.wind.update(self.dt_sec)
+
+        vehicle_x, vehicle_y = vehicle.position
+        if vehicle_x >= RECOVERY_X:
+            self.result_code = (
+                RECOVERED
+                if vehicle_y <= RECOVERY_Y_MIN or vehicle_y >= RECOVERY_Y_MAX
+                else PARALANDED
+            )
+
+    def end(self, result_code):
+        """Ends the flight early, e.g. when the pilot has died."""
+        self.result_code = result_code
+
+    def result(self):
+        """Scores the flight, landing any packages that are still in the air."""
+        # Count delivered packages, looking for double deliveries
+        package_count_by_site = {}
+        for p in self.dropped_packages:
+            # Make sure the package is at rest
+            p.update(PACKAGE_FALL_SEC)
+            for s in self.delivery_sites:
+                if s.contains(p.position):
+                    try:
+                        package_count_by_site[s] += 1
+                    except KeyError:
+                        package_count_by_site[s] = 1
+        return SimulationResult(
+            self.result_code,
+            len(package_count_by_site),
+            sum((x - 1 for x in package_count_by_site.values() if x > 1)),
+            self.ticks,
+        )
+
+
+class SubprocessPilot:
+    """A pilot running in a child process, exchanging packed messages over its stdin and stdout."""
+
+    __slots__ = ["_process"]
+
+    def __init__(self, command):
+        self._process = subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+
+    def exchange(self, telemetry, timeout=None):
+        """Sends a packed telemetry message and returns the packed command, or None if the pilot has exited.
+
+        If a timeout in seconds is given, raises TimeoutError when the pilot hasn't started answering in time. This
+        relies on select() working with pipes, so it's ignored on Windows."""
+        self._process.stdin.write(telemetry)
+        self._process.stdin.flush()
+        if timeout is not None and os.name == "posix":
+            ready, _, _ = select.select([self._process.stdout], [], [], timeout)
+            if not ready:
+                raise TimeoutError
+        cmd = self._process.stdout.read(COMMAND_STRUCT.size)
+        if self._process.poll() != None:
+            # On stderr, so it can't get mixed into a --json summary or the score
+            sys.stderr.write("Status : FAIL {}\n".format(self._process.returncode))
+            return None
+        return cmd
+
+    @property
+    def flag_status(self):
+        # A pilot process only sends commands, its controller's state stays on its side of the pipe.
+        return None
+
+    def close(self):
+        self._process.stdin.close()
+        self._process.stdout.close()
+        try:
+            self._process.wait(timeout=PILOT_EXIT_TIMEOUT_SEC)
+        except subprocess.TimeoutExpired:
+            self._process.kill()
+            self._process.wait()
+
+
+class InProcessPilot:
+    """A pilot from PilotDirector running inside the simulation's process.
+
+    It is handed the same packed telemetry and returns the same packed command as a pilot process would, but skips the
+    pipe writes, flushes and context switches on every tick."""
+
+    __slots__ = ["_pilot"]
+
+    def __init__(self, pilot_id):
+        # Imported here since the pilots import this module for the API structs.
+        from src.pilots.pilot_creator import PilotDirector
+
+        self._pilot = PilotDirector.select_pilot(pilot_id)
+
+    def exchange(self, telemetry, timeout=None):
+        # A pilot in the same process can't be interrupted, so the timeout is only checked by the caller afterwards.
+        try:
+            self._pilot.interpret_telemetry(telemetry)
+            return self._pilot.build_command()
+        except Exception:
+            # Treat it like a pilot process dying with a traceback on stderr.
+            traceback.print_exc()
+            return None
+
+    @property
+    def flag_status(self):
+        """The pilot's PilotFlags state after its last command, or None if it doesn't keep one."""
+        return self._pilot.flag_status
+
+    def close(self):
+        self._pilot.close()
+
+
+def fly(sim, pilot, seed=None, trace=None, scenario=None):
+    """Flies a full headless flight of the simulation with a pilot link and returns its SimulationResult.
+
+    If an EpisodeTrace from src.sim.trace is given, every tick is recorded in it. If a Scenario is given, its world is
+    flown instead of one generated from the seed."""
+    telemetry = sim.reset(seed, scenario)
+    while telemetry is not None:
+        cmd = pilot.exchange(telemetry)
+        if cmd is None or len(cmd) != COMMAND_STRUCT.size:
+            sim.end(CRASHED)  # The pilot must have exited
+            break
+        (lateral_airspeed, drop_package_commanded_byte, _) = COMMAND_STRUCT.unpack(cmd)
+        if trace is not None:
+            trace.record(
+                sim, lateral_airspeed, bool(drop_package_commanded_byte), pilot.flag_status
+            )
+        telemetry = sim.step(lateral_airspeed, bool(drop_package_commanded_byte))
+    return sim.result()
 
 
 if __name__ == "__main__":
-    # file1 = open("telem_file.bin","wb")
     parser = argparse.ArgumentParser(description='"8-bit" Zip Sim')
     parser.add_argument(
         "pilot", nargs=argparse.REMAINDER, help="A pilot process to run"
@@ -355,6 +1088,11 @@ if __name__ == "__main__":
     parser.add_argument(
         "--headless", action="store_true", help="Run without visualization"
     )
+    parser.add_argument(
+        "--in-process",
+        metavar="PILOT_ID",
+        help="Run a pilot from PilotDirector (AUTO, PLAN, UNO, UNO_SIM, MANUAL) inside the sim instead of as a process",
+    )
     visualizer_group = parser.add_argument_group("Visualization options")
     visualizer_group.add_argument(
         "--chase-y",
@@ -370,19 +1108,106 @@ if __name__ == "__main__":
     parser.add_argument(
         "--seed", type=int, help="Seed to use for random number generation"
     )
+    parser.add_argument(
+        "--scenario",
+        metavar="FILE",
+        help="Fly the world from a scenario file (see src/sim/scenario.py) instead of generating one",
+    )
+    parser.add_argument(
+        "--save-world",
+        metavar="FILE",
+        help="Save the world as a scenario file before flying it",
+    )
+    parser.add_argument(
+        "--fast-worldgen",
+        action="store_true",
+        help="Generate the world with NumPy; faster for big worlds, but a seed gives a different world than without it",
+    )
+    parser.add_argument(
+        "--rate-hz",
+        type=float,
+        help="Tick rate of the simulation (default {:g}); other rates send versioned telemetry".format(1 / DT_SEC),
+    )
+    parser.add_argument(
+        "--lidar-step-deg",
+        type=float,
+        help="Angle between lidar rays (default {:g}), splitting the {:g} degree sweep evenly; other steps send "
+        "versioned telemetry".format(LIDAR_STEP_DEG, LIDAR_FOV_DEG),
+    )
+    output_group = parser.add_argument_group("Output options")
+    output_group.add_argument(
+        "-v",
+        "--verbose",
+        action="count",
+        default=0,
+        help="Print more; headless runs print nothing by default, the final score with -v and also the pilot's "
+        "command every tick with -vv",
+    )
+    output_group.add_argument(
+        "-q",
+        "--quiet",
+        action="count",
+        default=0,
+        help="Print less; visualized runs leave out the per-tick commands with -q and also the final score with -qq",
+    )
+    output_group.add_argument(
+        "--json",
+        action="store_true",
+        help="Print a JSON line with the seed, result, deliveries, violations, ticks and wall time at the end",
+    )
+    parser.add_argument(
+        "--record",
+        metavar="FILE",
+        help="Record the telemetry and pilot commands of every tick to a flight log for src.sim.replay",
+    )
+    parser.add_argument(
+        "--export-trace",
+        metavar="FILE",
+        help="Save the position, wind, commands, nearest lidar return and pilot state of every tick as .npz columns. "
+        "The pilot state is only recorded for --in-process pilots",
+    )
+    profiling_group = parser.add_argument_group("Profiling options")
+    profiling_group.add_argument(
+        "--profile",
+        action="store_true",
+        help="Time the pilot, lidar, physics and render of every tick and print percentiles at the end",
+    )
+    profiling_group.add_argument(
+        "--trace", metavar="FILE", help="Write per-tick timings to a CSV file (implies --profile)"
+    )
+    profiling_group.add_argument(
+        "--deadline-ms",
+        type=float,
+        help="Per-tick deadline for the pilot to answer, e.g. {:.1f} for real time at 60Hz (implies --profile)".format(
+            DT_SEC * 1e3
+        ),
+    )
+    profiling_group.add_argument(
+        "--deadline-policy",
+        choices=["count", "crash"],
+        default="count",
+        help="Whether a missed deadline is only counted, or ends the flight as a crash",
+    )
     args = parser.parse_args()
+    if args.pilot and args.in_process:
+        parser.error("a pilot process can't be combined with --in-process")
+    if args.rate_hz is not None and args.rate_hz <= 0:
+        parser.error("--rate-hz must be positive")
+    try:
+        sim = Simulation(args.fast_worldgen, args.rate_hz, args.lidar_step_deg)
+    except ValueError as e:
+        parser.error(str(e))
 
-    random.seed(args.seed)
     headless = args.headless
-    api_mode = len(args.pilot) > 0
+    # Printing every tick costs more than simulating it, so headless runs print nothing unless asked.
+    verbosity = (VERBOSITY_SILENT if headless else VERBOSITY_TICKS) + args.verbose - args.quiet
+    api_mode = len(args.pilot) > 0 or args.in_process is not None
 
     if api_mode:
-        pilot = subprocess.Popen(
-            args.pilot,
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-        )
-        loop_count = 0  # To count iterations to compute the telemetry timestamp
+        if args.in_process:
+            pilot = InProcessPilot(args.in_process)
+        else:
+            pilot = SubprocessPilot(args.pilot)
 
     if not headless:
         pygame.init()
@@ -391,192 +1216,163 @@ if __name__ == "__main__":
         clock = pygame.time.Clock()
         camera = Camera(position=(CAMERA_AHEAD_M, 0.0))
         distribution_center_image = load_image("distribution_center.png")
-        terrain = Terrain()
         reticle_image = load_image("reticle.png")
         chase_y = args.chase_y
         show_lidar = args.show_lidar
         visualizer_paused = args.start_paused
         visualizer_rate_index = INITIAL_VISUALIZER_RATE_INDEX
-
-    # Randomly generate delivery sites that aren't too close to each other.
-    delivery_sites = []
-    for _ in range(NUM_DELIVERY_SITES):
-        while True:
-            # Round the position to the nearest tenth of a meter. This keeps the sprites from jumping around while
-            # drawing due to floating point round-off to the nearest pixel.
-            site_pos = (
-                round(random.uniform(*DELIVERY_SITE_X_BOUNDS) % WORLD_LENGTH, 1),
-                round(random.uniform(*DELIVERY_SITE_Y_BOUNDS) % WORLD_WIDTH, 1),
-            )
-            if (
-                min(
-                    (s.distance_to(site_pos) for s in delivery_sites),
-                    default=MIN_DELIVERY_DISTANCE,
-                )
-                >= MIN_DELIVERY_DISTANCE
-            ):
-                delivery_sites.append(DeliverySite(site_pos))
-                break
-
-    # Randomly generate trees that aren't too close to delivery sites.
-    trees = []
-    tree_density = random.gauss(TYPICAL_NUM_TREES, MAX_NUM_TREES / 3)
-    num_trees = round(
-        min(MAX_NUM_TREES, tree_density)
-        if tree_density >= TYPICAL_NUM_TREES
-        else random.triangular(0, TYPICAL_NUM_TREES, TYPICAL_NUM_TREES)
+        visualizer_rates = [speed / sim.dt_sec for speed in VISUALIZER_SPEEDS]
+
+    profiler = None
+    if args.profile or args.trace or args.deadline_ms is not None:
+        # Imported here so that the pilots, which import this module, don't pull in the profiling tools.
+        from src.sim.profiling import TickProfiler
+
+        profiler = TickProfiler(args.deadline_ms)
+    # The pilot is only cut off when a missed deadline ends the flight anyway.
+    pilot_timeout = (
+        args.deadline_ms * 1e-3
+        if args.deadline_ms is not None and args.deadline_policy == "crash"
+        else None
     )
-    for _ in range(num_trees):
-        while True:
-            # Round the position to the nearest tenth of a meter. This keeps the sprites from jumping around while
-            # drawing due to floating point round-off to the nearest pixel.
-            tree_pos = (
-                round(random.uniform(*TREE_X_BOUNDS), 1),
-                round(random.uniform(0, WORLD_WIDTH), 1),
-            )
-            if (
-                min(
-                    (s.distance_to(tree_pos) for s in delivery_sites),
-                    default=MIN_TREE_DISTANCE,
-                )
-                >= MIN_TREE_DISTANCE
-            ):
-                trees.append(Tree(tree_pos))
-                break
-    # Trees can overlap, so sort them so they render over each other properly.
-    trees.sort(key=lambda x: x.position[0], reverse=True)
 
-    # A list of objects that reflect lidar points
-    lidar_objects = [t.make_lidar_object() for t in trees] + [
-        d.make_lidar_object() for d in delivery_sites
-    ]
+    seed = args.seed
+    scenario = None
+    if args.scenario:
+        from src.sim.scenario import load_scenario
+
+        try:
+            (scenario, scenario_seed) = load_scenario(args.scenario)
+        except (OSError, ValueError) as e:
+            parser.error(str(e))
+        if seed is None:
+            seed = scenario_seed
+    if seed is None and (args.record or args.export_trace or args.json):
+        # A log, trace or summary should be enough to fly the same world again.
+        seed = random.SystemRandom().randrange(2 ** 32)
+    recorder = None
+    if args.record:
+        if not api_mode:
+            parser.error("--record needs a pilot")
+        if sim.telemetry_struct is not TELEMETRY_STRUCT:
+            parser.error("--record only logs the default telemetry, without --rate-hz or --lidar-step-deg")
+        from src.sim.recording import FlightRecorder
+
+        recorder = FlightRecorder(args.record, seed)
+    episode_trace = None
+    if args.export_trace:
+        from src.sim.trace import EpisodeTrace
+
+        if api_mode and not args.in_process:
+            # A pilot process only sends back commands, so there is no state to record.
+            sys.stderr.write("--export-trace only records the pilot state of --in-process pilots, it will be -1\n")
+        episode_trace = EpisodeTrace(sim.dt_sec)
+
+    telemetry = sim.reset(seed, scenario)
+    if not headless:
+        background = WorldBackground(sim, distribution_center_image)
+    if args.save_world:
+        from src.sim.scenario import snapshot, save_scenario
 
-    vehicle = Zip()
+        save_scenario(args.save_world, snapshot(sim), seed)
+    lateral_airspeed = 0.0
 
     # Set to an exit code when it's time to leave the main loop
     result = None
-
-    wind = Wind()
-    lateral_airspeed = 0.0
-    # Used to de-bounce commands to drop a package
-    was_package_dropped = False
-    # Number of packages still in the zip
-    num_packages = len(delivery_sites)
-    # List of package objects that have been dropped
-    dropped_packages = []
+    start_time = time.perf_counter()
 
     while result is None:
         drop_package_commanded = False
+        if profiler:
+            profiler.start_tick()
         if api_mode:
-            lidar_samples = cast_lidar(vehicle.position, lidar_objects)
-            pilot.stdin.write(
-                TELEMETRY_STRUCT.pack(
-                    int(loop_count * DT_SEC * 1e3) & 0xFFFF,
-                    round(RECOVERY_X - vehicle.position[0]),
-                    wind.vector[0],
-                    wind.vector[1],
-                    round(
-                        (-vehicle.position[1] + WORLD_WIDTH_HALF) % WORLD_WIDTH
-                        - WORLD_WIDTH_HALF
-                    ),
-                    *lidar_samples
+            try:
+                cmd = pilot.exchange(
+                    telemetry,
+                    pilot_timeout if profiler and profiler.deadline_active else None,
                 )
-            )
-
-            pilot.stdin.flush()
-            loop_count += 1
-
-            cmd = pilot.stdout.read(COMMAND_STRUCT.size)
-
-            if pilot.poll() != None:
-                error = pilot.stderr.readlines()
-                print("Status : FAIL", pilot.returncode, error)
-                result = CRASHED  # The pilot process must have exited
-                break
+            except TimeoutError:
+                cmd = None
+            if profiler:
+                missed = profiler.lap("pilot")
+                if missed and args.deadline_policy == "crash":
+                    sys.stderr.write(
+                        "Pilot missed its {}ms deadline on tick {}\n".format(
+                            args.deadline_ms, sim.ticks
+                        )
+                    )
+                    result = CRASHED
+                    break
 
-            if len(cmd) != COMMAND_STRUCT.size:
-                result = CRASHED  # The pilot process must have exited
+            if cmd is None or len(cmd) != COMMAND_STRUCT.size:
+                result = CRASHED  # The pilot must have exited
                 break
+            if recorder:
+                recorder.record(telemetry, cmd)
             (
                 lateral_airspeed_input,
                 drop_package_commanded_byte,
                 _,
             ) = COMMAND_STRUCT.unpack(cmd)
-            lateral_airspeed = max(-30.0, min(30.0, lateral_airspeed_input))
+            lateral_airspeed = lateral_airspeed_input
 
             drop_package_commanded = bool(drop_package_commanded_byte)
-            print("Airspeed: ", lateral_airspeed_input)
-            print("Drop: ", drop_package_commanded)
+            if verbosity >= VERBOSITY_TICKS:
+                print("Airspeed: ", lateral_airspeed_input)
+                print("Drop: ", drop_package_commanded)
         elif not headless:
             keys = pygame.key.get_pressed()
-            lateral_airspeed -= lateral_airspeed / 0.5 * DT_SEC
+            lateral_airspeed -= lateral_airspeed / 0.5 * sim.dt_sec
             if keys[pygame.K_LEFT]:
-                lateral_airspeed = min(30.0, lateral_airspeed + DT_SEC * 200.0)
+                lateral_airspeed = min(30.0, lateral_airspeed + sim.dt_sec * 200.0)
             if keys[pygame.K_RIGHT]:
-                lateral_airspeed = max(-30.0, lateral_airspeed - DT_SEC * 200.0)
+                lateral_airspeed = max(-30.0, lateral_airspeed - sim.dt_sec * 200.0)
             if keys[pygame.K_SPACE]:
                 drop_package_commanded = True
 
-        vehicle.update(DT_SEC, lateral_airspeed, wind.vector)
-
-        # Check for collisions with trees
-        for t in trees:
-            if t.contains(vehicle.position):
-                result = CRASHED
-                break
-
-        for p in dropped_packages:
-            p.update(DT_SEC)
-
-        # Drop a package if commanded to. The package is dropped after updating physics so that we can
-        # append it right on to the end of the dropped packages list. This adds some "realism" since a
-        # real mechanism would release the package some time after being commanded to.
-        if drop_package_commanded and not was_package_dropped and num_packages > 0:
-            num_packages -= 1
-            dropped_packages.append(
-                Package(
-                    vehicle.position,
-                    vehicle.get_velocity(lateral_airspeed, wind.vector),
-                )
-            )
-
-        was_package_dropped = drop_package_commanded
-
-        wind.update(DT_SEC)
-
-        vehicle_x, vehicle_y = vehicle.position
-        if vehicle_x >= RECOVERY_X:
-            result = (
-                RECOVERED
-                if vehicle_y <= RECOVERY_Y_MIN or vehicle_y >= RECOVERY_Y_MAX
-                else PARALANDED
+        if episode_trace:
+            episode_trace.record(
+                sim,
+                lateral_airspeed,
+                drop_package_commanded,
+                pilot.flag_status if api_mode else None,
             )
+        sim.advance(lateral_airspeed, drop_package_commanded)
+        if profiler:
+            profiler.lap("physics")
+        if sim.result_code is not None:
+            telemetry = None
+        elif api_mode:
+            telemetry = sim.telemetry()
+        elif episode_trace:
+            # Nothing reads telemetry in a manual flight, but the trace logs the nearest lidar return of every tick.
+            sim.scan_lidar()
+        if profiler:
+            profiler.lap("lidar")
+        lateral_airspeed = sim.lateral_airspeed
+        result = sim.result_code
+        if result in (RECOVERED, PARALANDED):
             break
 
         if not headless:
+            vehicle = sim.vehicle
             # Update the camera to be fixed above the vehicle in the x axis.
             camera.position = (
                 vehicle.position[0] + CAMERA_AHEAD_M,
                 vehicle.position[1] if chase_y else 0.0,
             )
 
-            terrain.draw(camera, screen)
-            # Draw distribution center
-            for pos in camera.project((0, 0)):
-                screen.blit(distribution_center_image, (pos[0] - 250, pos[1] - 100))
-
-            for t in trees:
-                t.draw(camera, screen)
-            for s in delivery_sites:
-                s.draw(camera, screen)
-            for p in dropped_packages:
-                p.draw(camera, screen)
+            # Terrain, distribution center, trees and delivery sites
+            background.draw(camera, screen)
+            for p in sim.dropped_packages:
+                if camera.in_view(p.position, margin=1.0):
+                    p.draw(camera, screen)
 
             if show_lidar:
                 # We could try to be clever and avoid casting the lidar twice if in API mode, but there's no real need
                 # since we have plenty of CPU cycles when running in real-time.
-                lidar_samples = cast_lidar(vehicle.position, lidar_objects)
-                for angle, d in zip(LIDAR_ANGLES, lidar_samples):
+                samples = cast_lidar(vehicle.position, sim.lidar_objects, sim.lidar_rays)
+                for angle, d in zip(sim.lidar_angles, samples):
                     x = d * math.cos(angle)
                     y = d * math.sin(angle)
                     for pos in camera.project(vehicle.position):
@@ -597,13 +1393,15 @@ if __name__ == "__main__":
             reticle.move(
                 (
                     v * PACKAGE_FALL_SEC
-                    for v in vehicle.get_velocity(lateral_airspeed, wind.vector)
+                    for v in vehicle.get_velocity(lateral_airspeed, sim.wind.vector)
                 )
             )
             for pos in camera.project(reticle.position):
                 screen.blit(reticle_image, (pos[0] - 8, pos[1] - 8))
 
             pygame.display.flip()
+            if profiler:
+                profiler.lap("render")
 
             # This loop is a little gnarly since python lacks a do-while loop. We want to run at least once no
             # matter what, and run repeatedly if the simulation is paused.
@@ -613,7 +1411,6 @@ if __name__ == "__main__":
                     if e.type == pygame.QUIT or (
                         e.type == pygame.KEYDOWN and e.key == pygame.K_ESCAPE
                     ):
-                        # file1.close()
                         result = SIM_QUIT
                         wait_for_step = False
                         break
@@ -627,7 +1424,7 @@ if __name__ == "__main__":
                             visualizer_rate_index = max(0, visualizer_rate_index - 1)
                         if e.key == pygame.K_PERIOD:
                             visualizer_rate_index = min(
-                                len(VISUALIZER_RATES) - 1, visualizer_rate_index + 1
+                                len(visualizer_rates) - 1, visualizer_rate_index + 1
                             )
                 if wait_for_step:
                     # There's two things going on here. First, if single-stepped, we don't want to delay the loop.
@@ -636,33 +1433,40 @@ if __name__ == "__main__":
                     if visualizer_paused:
                         clock.tick(PAUSED_RATE)
                     else:
-                        clock.tick(VISUALIZER_RATES[visualizer_rate_index])
+                        clock.tick(visualizer_rates[visualizer_rate_index])
                         wait_for_step = False
 
     if not headless:
         pygame.quit()
 
-    # Count delivered packages, looking for double deliveries
-    package_count_by_site = {}
-    for p in dropped_packages:
-        # Make sure the package is at rest
-        p.update(PACKAGE_FALL_SEC)
-        for s in delivery_sites:
-            if s.contains(p.position):
-                try:
-                    package_count_by_site[s] += 1
-                except KeyError:
-                    package_count_by_site[s] = 1
+    score = sim.result()
 
     if api_mode:
-        pilot.stdin.close()
-        pilot.stdout.close()
-        pilot.wait()
-    print("Deliveries: {}".format(len(package_count_by_site)))
-    print(
-        "ZIPAA Violations: {}".format(
-            sum((x - 1 for x in package_count_by_site.values() if x > 1))
+        pilot.close()
+    if recorder:
+        recorder.close()
+    if episode_trace:
+        # The exit code also covers flights the pilot or the user ended, which the simulation never saw.
+        episode_trace.save(args.export_trace, seed, score._replace(result=result))
+    if verbosity >= VERBOSITY_SCORE:
+        print("Deliveries: {}".format(score.deliveries))
+        print("ZIPAA Violations: {}".format(score.violations))
+    if args.json:
+        print(
+            json.dumps(
+                {
+                    "seed": seed,
+                    "result": result,
+                    "deliveries": score.deliveries,
+                    "violations": score.violations,
+                    "ticks": score.ticks,
+                    "wall_time_sec": round(time.perf_counter() - start_time, 6),
+                }
+            )
         )
-    )
+    if profiler:
+        profiler.print_report()
+        if args.trace:
+            profiler.write_trace(args.trace)
 
     sys.exit(result)